@@ -2,22 +2,26 @@
 
 from uuid import UUID
 from fastapi import HTTPException, status
-from typing import List, Union
+from typing import List, Optional, Union
 from ..models.feedback import (
     ContextSpecificFeedback,
     FeedbackCategory,
     PromptFeedback,
     Feedback,
 )
+from ..utils.pagination import DEFAULT_PAGE_SIZE, keyset_page
+from ..utils.read_models import parse_fields, projection, read_document, stored_keys
 
 conflict = "Prompt already shown"
+# The order of the pages when the feedback of a user is read a page at a time
+feedback_sort_keys = ["created_at", "_id"]
 
 class FeedbackList:
     def __init__(self, db):
         self.db = db
     
     # Create a new prompt feedback
-    def create_prompt(self, prompt_feedback: PromptFeedback) -> PromptFeedback:
+    async def create_prompt(self, prompt_feedback: PromptFeedback) -> PromptFeedback:
         # existing = self.db.find_one({
         #     "user_id": prompt_feedback.user_id,
         #     "prompt": prompt_feedback.prompt
@@ -28,13 +32,13 @@ class FeedbackList:
         #         detail=conflict
         #     )
         document = prompt_feedback.model_dump(by_alias=True, exclude_none=True)
-        self.db.insert_one(document)
+        await self.db.insert_one(document)
         return prompt_feedback
 
     # Create new standard feedback
-    def create_feedback(self, feedback: Feedback) -> Feedback:
+    async def create_feedback(self, feedback: Feedback) -> Feedback:
         document = feedback.model_dump(by_alias=True, exclude_none=True)
-        self.db.insert_one(document)
+        await self.db.insert_one(document)
         return feedback
     
     def get_categories(self) -> List[str]:
@@ -44,19 +48,50 @@ class FeedbackList:
         return [prompt.value for prompt in ContextSpecificFeedback]
     
     # Useful for us if we want to find all feedback from one specific user
-    def list_by_user(self, user_id: str) -> List[Union[Feedback, PromptFeedback]]:
+    async def list_by_user(self, user_id: str, fields: Optional[str] = None, limit: Optional[int] = None, cursor: Optional[str] = None) -> Union[List[dict], dict]:
+        """
+            All feedback of the user as a list. With a limit or a cursor only a page of it is returned, oldest first,
+            along with the next_cursor to send for the next page.
+        """
+        user_uuid = self.parse_user_id(user_id)
+        wanted = parse_fields([Feedback, PromptFeedback], fields)
+        # feedback_type is always read, as it decides which of the models the document is
+        feedback_projection = projection(wanted, needed=("feedback_type", *feedback_sort_keys))
+        if limit is None and cursor is None:
+            documents = self.db.find({"user_id": user_uuid}, feedback_projection)
+            return [self.read_feedback(document, wanted) async for document in documents]
+
+        documents, next_cursor, _ = await keyset_page(self.db, {"user_id": user_uuid}, feedback_sort_keys, limit or DEFAULT_PAGE_SIZE, cursor, feedback_projection)
+        return {
+            "status": status.HTTP_200_OK,
+            "data": [self.read_feedback(document, wanted) for document in documents],
+            "next_cursor": next_cursor
+        }
+
+    def stream_by_user(self, user_id: str, fields: Optional[str] = None):
+        """
+            All feedback of the user one at a time straight from the cursor. Used for exports.
+        """
+        user_uuid = self.parse_user_id(user_id)
+        wanted = parse_fields([Feedback, PromptFeedback], fields)
+        # The id and fields are checked before anything is streamed, the query only runs once the response reads from it
+        documents = self.db.find({"user_id": user_uuid}, projection(wanted, needed=("feedback_type",)))
+        return (self.read_feedback(document, wanted) async for document in documents)
+
+    def parse_user_id(self, user_id: str) -> UUID:
         try:
-            user_uuid = UUID(user_id)
+            return UUID(user_id)
         except ValueError:
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
                 detail="Invalid user_id format"
             )
-        documents = list(self.db.find({"user_id": user_uuid}))
-        result: List[Union[Feedback, PromptFeedback]] = []
-        for document in documents:
-            if "prompt" == document.get("feedback_type"):
-                result.append(PromptFeedback(**document))
-            else:
-                result.append(Feedback(**document))
-        return result
+
+    def read_feedback(self, document: dict, wanted: Optional[List[str]]) -> dict:
+        if "prompt" == document.get("feedback_type"):
+            model = PromptFeedback
+        else:
+            model = Feedback
+        # Only the fields that exist on that kind of feedback
+        keys = None if wanted is None else [key for key in wanted if key in stored_keys(model)]
+        return read_document(model, document, keys)
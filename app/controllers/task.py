@@ -2,17 +2,31 @@ from datetime import datetime, timedelta, timezone
 from zoneinfo import ZoneInfo
 from fastapi import HTTPException, status
 from uuid import UUID
-from typing import List, Tuple, Union
-from pymongo import UpdateOne
-
-from app.controllers.user import UserList
-from ..utils.scheduler import calculate_tracked_duration, generate_available_work_window_slots, schedule_tasks
+from pymongo import ReturnDocument
+from typing import Dict, List, Optional, Tuple, Union
+
+from app.controllers.user import estimation_average_update, uncompleted_estimation_average_update
+from ..database.task_repository import TaskRepository
+from ..database.unit_of_work import UnitOfWork
+from ..utils.pagination import DEFAULT_PAGE_SIZE, keyset_page
+from ..utils.read_models import parse_fields, projection, read_document
+from ..utils.reschedule_coalescer import PendingMutation, reschedule_coalescer
+from ..utils.reschedule_jobs import RescheduleJob, reschedule_jobs
+from ..utils.ranking import document_rank, needs_rebalance, number_by_rank, rank_for_position, RANK_GAP
+from ..utils.scheduler import TaskRecord, from_epoch_us, schedule_records, schedule_tasks, to_epoch_us
+from ..utils.events import event_hub
+from ..utils.versions import resource_versions
+from ..utils.tracked_duration import calculate_tracked_duration_in_time_frame
+from ..utils.time_frame_cache import time_frame_cache
+from ..utils.work_windows import WorkWindowIndex
 
 from ..models.task import Task, UpdateTask
 from ..models.time_frame import TimeFrame
 
 # Constants
 not_found_404 = "Task not found"
+# The order of the tasks when they are read a page at a time, the same order as the priorities
+task_sort_keys = ["rank", "_id"]
 
 # Helpers
 class TaskList():
@@ -21,21 +35,36 @@ class TaskList():
         self.time_frame_collection = time_frame_collection
         self.user_collection = user_collection
 
-    def create_task(self, task: Task):
+    async def create_task(self, task: Task):
         """
             Creates a new task and uses the scheduler to place the correct start and end time
             of each task based on work windows and priority. When a new task is created this
             is also in charge of potential rescheduling of other tasks in same time frame.
+            If the task does not fit in what is left of the time frame it is rejected before anything is written.
         """
-        self.db.insert_one(task.model_dump(by_alias=True))
+        # The time frame and all of its tasks are fetched together
+        generation = reschedule_coalescer.generation()
+        repository = await self.load_time_frame_tasks(task.time_frame_id)
+        created = await self.coalesce(
+            task.time_frame_id,
+            lambda unit, loaded: self.create_task_in(unit, loaded, task),
+            repository,
+            generation
+        )
+        event_hub.publish(task.time_frame_id, "task_created", {"task": created, "changed": []})
+        return created
 
+    async def create_task_in(self, unit: UnitOfWork, repository: TaskRepository, task: Task) -> Task:
         # Find all tasks belonging to the given time frame
-        all_documents = list(self.db.find({"time_frame_id": task.time_frame_id}))
-        tasks = [Task.model_validate(document) for document in all_documents]
+        records = self.load_task_records(repository, task.time_frame_id, unit)
+
+        # Give the task a rank between the tasks it is placed between, so none of the other tasks have to be updated
+        task.priority = min(max(task.priority, 1), len(records) + 1)
+        task.rank = self.rank_for_priority(records, task.priority, unit)
 
         # Find the task  with priority‐1, if it exists
         prev = next(
-            (t for t in tasks if t.priority == task.priority - 1),
+            (record for record in records if record.priority == task.priority - 1),
             None
         )
 
@@ -46,83 +75,203 @@ class TaskList():
             base_time = now_utc
         else:
             # If it was marked completed, we use actual tracked_time finish; otherwise its scheduled .end
-            if prev.completed and prev.tracked_duration is not None:
-                actual_finish = prev.start + timedelta(hours=prev.tracked_duration)
-            else:
-                actual_finish = prev.end
+            base_time = max(now_utc, from_epoch_us(prev.actual_finish()))
 
-            base_time = max(now_utc, actual_finish)
+        # Get the time frame and its work windows
+        time_frame, windows = await self.load_time_frame(repository, task.time_frame_id)
 
-        # Build your work windows from the timeframe:
-        time_frame_document = self.time_frame_collection.find_one({"_id": task.time_frame_id})
-        time_frame = TimeFrame.model_validate(time_frame_document)
-        slots = generate_available_work_window_slots(time_frame)
+        # Use the capacity of the time frame to check the task fits, instead of finding out halfway through scheduling
+        if windows.finish_time(timedelta(hours=task.self_estimated_duration), base_time) is None:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Not enough available work time left in the time frame for this task"
+            )
 
-        # Trim out everything before base_time
-        available = self.remaining_work_windows(slots, base_time)
+        # Find the free work windows after base_time in the window index
+        available = windows.free_after(base_time)
 
         scheduled = schedule_tasks([task], available)
         new_schedule = scheduled[0]
 
-        # Persist its start & end
-        self.db.update_one(
-            {"_id": new_schedule.task_id},
-            {"$set": {"start": new_schedule.start, "end": new_schedule.end}}
-        )
+        # Persist the task with its start & end
+        unit.insert(self.db, new_schedule.model_dump(by_alias=True))
 
         return new_schedule
 
 
 
-    def find_all_time_frame_tasks(self, time_frame_id: Union[str, UUID]) -> dict:
+    async def create_tasks(self, time_frame_id: UUID, tasks: List[Task]) -> dict:
+        """
+            Creates a list of tasks at once, like a whole project plan. Each task is placed at its priority among the
+            tasks already in the time frame, and the tasks from the first new one and onwards are scheduled in a single
+            pass. Returns the placed tasks along with the existing tasks that had to move to make room for them.
+        """
+        generation = reschedule_coalescer.generation()
+        repository = await self.load_time_frame_tasks(time_frame_id)
+        result = await self.coalesce(
+            time_frame_id,
+            lambda unit, loaded: self.create_tasks_in(unit, loaded, time_frame_id, tasks),
+            repository,
+            generation
+        )
+        event_hub.publish(time_frame_id, "tasks_created", {"tasks": result["data"], "changed": result["changed"]})
+        return result
+
+    async def create_tasks_in(self, unit: UnitOfWork, repository: TaskRepository, time_frame_id: UUID, tasks: List[Task]) -> dict:
+        records = self.load_task_records(repository, time_frame_id, unit)
+        existing_ids = {record.task_id for record in records}
+
+        # Place the tasks in order of priority, so each one is put at its priority among the ones placed before it
+        tasks = sorted(tasks, key=lambda t: t.priority)
+        new_records: List[TaskRecord] = []
+        for task in tasks:
+            priority = min(max(task.priority, 1), len(records) + 1)
+            task.rank = self.rank_for_priority(records, priority, unit)
+            record = TaskRecord.from_task(task)
+            records.insert(priority - 1, record)
+            number_by_rank(records)
+            new_records.append(record)
+
+        # Everything from the first new task and onwards is scheduled again, starting where the task before it finished
+        first = min(record.priority for record in new_records)
+        base_time = to_epoch_us(datetime.now(timezone.utc))
+        if first > 1:
+            base_time = max(base_time, records[first - 2].actual_finish())
+        to_run = [record for record in records[first - 1:] if not record.completed]
+
+        _, windows = await self.load_time_frame(repository, time_frame_id)
+        needed = sum(record.duration for record in to_run)
+        if windows.finish_time(timedelta(microseconds=needed), from_epoch_us(base_time)) is None:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Not enough available work time left in the time frame for these tasks"
+            )
+
+        stored = {record.task_id: record.placement() for record in to_run if record.task_id in existing_ids}
+        schedule_records(to_run, windows.free_after(base_time))
+
+        for task, record in zip(tasks, new_records):
+            task.priority = record.priority
+            task.rank = record.rank
+            task.start = from_epoch_us(record.start) if record.start is not None else None
+            task.end = from_epoch_us(record.end)
+            unit.insert(self.db, task.model_dump(by_alias=True))
+        changed = self.persist_moved_tasks(unit, [record for record in to_run if record.task_id in existing_ids], stored)
+
+        return {
+            "status": status.HTTP_201_CREATED,
+            "data": sorted(tasks, key=lambda t: t.priority),
+            "changed": changed
+        }
+
+    async def find_all_time_frame_tasks(self, time_frame_id: Union[str, UUID], fields: Optional[str] = None, limit: Optional[int] = None, cursor: Optional[str] = None) -> dict:
         """
         Returns all tasks for a given time_frame_id, or 404 if none exist.
+        fields is an optional comma separated list of the fields to return.
+        With a limit or a cursor only a page of the tasks is returned, along with the next_cursor for the next page.
         """
-        # Ensure we have a UUID, otherwise we get an error when creating a new task
-        if isinstance(time_frame_id, str):
-            try:
-                time_frame_uuid = UUID(time_frame_id)
-            except ValueError:
-                raise HTTPException(
-                    status_code=status.HTTP_400_BAD_REQUEST,
-                    detail="Invalid time frame id format"
-                )
-        else:
-            time_frame_uuid = time_frame_id
+        wanted = parse_fields([Task], fields)
+        time_frame_uuid = self.parse_time_frame_id(time_frame_id)
+        # The rank and priority are always read, as they are needed for the order
+        task_projection = projection(wanted, needed=("rank", "priority"))
+        if limit is not None or cursor is not None:
+            return await self.find_time_frame_task_page(time_frame_uuid, wanted, task_projection, limit or DEFAULT_PAGE_SIZE, cursor)
 
         # Creates a list of all tasks belonging to the time frame
-        docs = list(self.db.find({"time_frame_id": time_frame_uuid}))
+        docs = await self.db.find({"time_frame_id": time_frame_uuid}, task_projection).to_list()
         if not docs:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
                 detail="No tasks found in this time frame"
             )
 
-        # Turn documents into a task model
-        tasks = [Task.model_validate(document) for document in docs]
+        # The priority is the position of the task when sorted by rank. The documents are trusted, so they are
+        # returned without validating them through the task model again
+        docs.sort(key=lambda document: (document_rank(document), document["_id"]))
+        tasks = []
+        for priority, document in enumerate(docs, start=1):
+            document["priority"] = priority
+            tasks.append(read_document(Task, document, wanted))
         return {
             "status": status.HTTP_200_OK,
             "data": tasks
         }
 
-    def find_specific_task(self, task_id: str):
+    async def find_time_frame_task_page(self, time_frame_uuid: UUID, wanted: Optional[List[str]], task_projection: Optional[dict], limit: int, cursor: Optional[str]) -> dict:
+        """
+            A page of the tasks sorted by rank in the database. The cursor remembers how many tasks came before the page,
+            so the priorities keep counting from there. Tasks from before ranks existed have no rank and sort first, so if
+            the first page starts with one, the tasks of the time frame are ranked before the page is read again. That way
+            the pages are in the same order as the whole list.
+        """
+        query = {"time_frame_id": time_frame_uuid}
+        docs, next_cursor, position = await keyset_page(self.db, query, task_sort_keys, limit, cursor, task_projection)
+        if cursor is None and docs and docs[0].get("rank") is None:
+            await self.rank_unranked_tasks(time_frame_uuid)
+            docs, next_cursor, position = await keyset_page(self.db, query, task_sort_keys, limit, cursor, task_projection)
+        if not docs and cursor is None:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="No tasks found in this time frame"
+            )
+        tasks = []
+        for priority, document in enumerate(docs, start=position + 1):
+            document["priority"] = priority
+            tasks.append(read_document(Task, document, wanted))
+        return {
+            "status": status.HTTP_200_OK,
+            "data": tasks,
+            "next_cursor": next_cursor
+        }
+
+    def stream_time_frame_tasks(self, time_frame_id: Union[str, UUID], fields: Optional[str] = None):
+        """
+            All tasks of the time frame in order of rank, one at a time straight from the cursor. Used for exports.
+        """
+        wanted = parse_fields([Task], fields)
+        time_frame_uuid = self.parse_time_frame_id(time_frame_id)
+        # The ids and fields are checked before anything is streamed, the query only runs once the response reads from it
+        documents = self.db.find({"time_frame_id": time_frame_uuid}, projection(wanted, needed=("rank", "priority"))).sort([(key, 1) for key in task_sort_keys])
+        return self.read_ranked_tasks(documents, wanted)
+
+    # The tasks of a cursor sorted by rank, numbered with their priority as they come in
+    async def read_ranked_tasks(self, documents, wanted: Optional[List[str]]):
+        priority = 0
+        async for document in documents:
+            priority += 1
+            yield read_document(Task, {**document, "priority": priority}, wanted)
+
+    def parse_time_frame_id(self, time_frame_id: Union[str, UUID]) -> UUID:
+        # Ensure we have a UUID, otherwise we get an error when creating a new task
+        if isinstance(time_frame_id, str):
+            try:
+                return UUID(time_frame_id)
+            except ValueError:
+                raise HTTPException(
+                    status_code=status.HTTP_400_BAD_REQUEST,
+                    detail="Invalid time frame id format"
+                )
+        return time_frame_id
+
+    async def find_specific_task(self, task_id: str):
         """
             Find a specific task based on the provided id
         """
-        result = self.db.find_one({"_id": UUID(task_id)})
+        result = await self.db.find_one({"_id": UUID(task_id)})
 
         if result:
-            return Task(**result)
+            return Task(**{**result, "priority": await self.display_priority(result)})
         else:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
                 detail="No task found"
             )
 
-    # TODO: We need to fix the update tasks and creation of a new one. Currently, it does work, but if a user suddenly has a lot of tasks and we call all of them individual to update them, it can potentially create bottlenecks.
-    def update_task(self, task_id: str, task: UpdateTask) -> Task:
+    async def update_task(self, task_id: str, task: UpdateTask, background: bool = False) -> dict:
         """
             Updates a task. If the field contains completed, priority or duration it will also update all other tasks for that time frame to ensure they have the correct time allocated.
+            Returns the updated task along with the tasks that were moved, so the frontend does not have to fetch the whole time frame again.
+            With background the other tasks are rescheduled by a job instead, and the id of the job is returned with the task.
         """
         # validate and pull existing task
         try:
@@ -131,25 +280,46 @@ class TaskList():
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST, 
                 detail="Invalid task id format")
-        existing = self.find_specific_task(task_id)
+        # The task, its time frame and the other tasks are fetched together and only validated once
+        generation = reschedule_coalescer.generation()
+        repository = TaskRepository(self.db, self.time_frame_collection)
+        existing = await self.load_task(repository, task_uuid)
 
-        # Update and check that it succeeded
         update_field = task.model_dump(exclude_unset=True)
-        result = self.db.update_one({"_id": task_uuid}, {"$set": update_field})
-        if result.matched_count == 0:
-            raise HTTPException(
-                status_code=status.HTTP_404_NOT_FOUND, 
-                detail=not_found_404
-            )
+        # All writes are collected and sent together when the batch of the time frame is done. The task is taken from
+        # the repository the batch runs on, as an earlier mutation in the batch may have changed it
+        deferred: List = [] if background else None
+
+        async def mutation(unit: UnitOfWork, loaded: TaskRepository) -> dict:
+            if deferred is not None:
+                deferred.clear()
+            return await self.update_task_in(unit, loaded, task_uuid, self.loaded_task(loaded, task_uuid), dict(update_field), deferred)
+
+        result = await self.coalesce(existing.time_frame_id, mutation, repository, generation)
+        if background:
+            result["job_id"] = self.queue_deferred(existing.time_frame_id, task_uuid, deferred)
+        event_hub.publish(existing.time_frame_id, "task_updated", {"task": result["data"], "changed": result["changed"], "job_id": result.get("job_id")})
+        return result
+
+    async def update_task_in(self, unit: UnitOfWork, repository: TaskRepository, task_uuid: UUID, existing: Task, update_field: dict, deferred: Optional[List] = None) -> dict:
+        records: List[TaskRecord] = []
+        # The other tasks of the time frame are only needed when the schedule can change
+        if update_field.keys() & {"completed", "priority", "self_estimated_duration"}:
+            records = self.load_task_records(repository, existing.time_frame_id, unit)
+            updated = next(record for record in records if record.task_id == task_uuid)
+            # Moving a task only changes its own rank, the priority of the other tasks follows from the ranks
+            if update_field.get("priority") is not None and update_field["priority"] != existing.priority:
+                others = [record for record in records if record is not updated]
+                update_field["priority"] = min(max(update_field["priority"], 1), len(others) + 1)
+                update_field["rank"] = self.rank_for_priority(others, update_field["priority"], unit)
+            # The update is applied to the record as well, so the rest can be worked out without reading the tasks again
+            updated.apply(update_field)
+            number_by_rank(records)
+        unit.update(self.db, task_uuid, update_field)
 
         # Gettubg everything ready to be able to handle the duration and work window logic updates.
-        # First we find the time frame and validates it
-        time_frame_document = self.time_frame_collection.find_one({"_id": existing.time_frame_id})
-        time_frame = TimeFrame.model_validate(time_frame_document)
-        # Find all tasks belonging to the model so it is ready for when start and end times needs to be updated.
-        all_responses = self.find_all_time_frame_tasks(existing.time_frame_id)
-        all_tasks: List[Task] = all_responses["data"]
-        original_windows = generate_available_work_window_slots(time_frame)
+        # First we find the time frame and its work windows
+        time_frame, windows = await self.load_time_frame(repository, existing.time_frame_id)
 
         # These are used as temp variables to help selective checks later
         completed = update_field.get("completed", existing.completed)
@@ -159,49 +329,39 @@ class TaskList():
         # Check to see if completed is what is being updated, and it is set to true, but also ensure 
         # that it is not already set to true to avoid uneeded calls to the database.
         if "completed" in update_field and completed and not existing.completed:
-            finished_utc = self.handle_completion(task_uuid, existing, time_frame)
-            # Takes the existing task but only overrides the end field. This is just to have a copy 
-            # of the task with the actual end time and not estimated end time, that we can then use to reschedule all the
+            finished_utc, duration = await self.handle_completion(unit, task_uuid, existing, time_frame, windows)
+            update_field.update({"tracked_duration": duration, "finished": finished_utc})
+            # A record of the task where only the end is overridden. This is just to have the task with
+            # the actual end time and not estimated end time, that we can then use to reschedule all the
             # other tasks to have the correct end time based on what the actual end time of the task was, without having 
             # to change the end time for the task so that can be used for later research if needed
-            completed_task = existing.model_copy(update={"end": finished_utc})
+            completed_task = TaskRecord.from_task(existing)
+            completed_task.priority = updated.priority
+            completed_task.end = to_epoch_us(finished_utc)
             # Reschedule downstream tasks
-            self.reschedule_downstream_tasks(existing.time_frame_id, all_tasks, original_windows, completed_task)
-            return self.find_specific_task(task_id)
+            changed = self.downstream_of(unit, records, windows, completed_task, deferred)
+            return self.changeset(self.updated_task(existing, update_field, updated), changed)
 
         # Check to update if complete is being updated to false and then reschedule tasks back to the original estimate
         if "completed" in update_field and not completed and existing.completed:
-            # undo completion and zero tracked_duration
-            self.handle_uncompletion(task_uuid, existing, time_frame)
-
-            all_tasks = self.find_all_time_frame_tasks(existing.time_frame_id)["data"]
-            windows = generate_available_work_window_slots(time_frame)
-            # Finding the task where we need to pivot back from before we completed it
-            pivot = self.find_specific_task(task_id)
-
-            self.reschedule_downstream_tasks(
-                pivot.time_frame_id,
-                all_tasks,
-                windows,
-                pivot
-            )
+            # undo completion and zero tracked_duration, the task itself is where we pivot back from
+            await self.handle_uncompletion(unit, task_uuid, existing, time_frame)
+            update_field.update({"tracked_duration": 0, "finished": None})
+            updated.apply(update_field)
+
+            changed = self.downstream_of(unit, records, windows, updated, deferred)
 
-            return pivot
+            return self.changeset(self.updated_task(existing, update_field, updated), changed)
         # Check if priority or duration is updated on one of the tasks and then update all time frame tasks accordingly
         if priority_new != existing.priority or new_estimate != existing.self_estimated_duration:
-                updated = self.find_specific_task(task_id)
-
-                time_frame_documents  = self.time_frame_collection.find_one({"_id": updated.time_frame_id})
-                time_frame = TimeFrame.model_validate(time_frame_documents)
-                original_windows = generate_available_work_window_slots(time_frame)
-
                 # Checks to ensure that priorities are handled correctly, as logic from 1st priority and
                 # all others have to be different to keep their correct time slots.
                 if priority_new != existing.priority:
                     if updated.priority == 1:
+                        # The task that was first before the move is now second
                         original_first = next(
-                            t for t in all_tasks
-                            if t.task_id != updated.task_id and t.priority == 1
+                            record for record in records
+                            if record.priority == 2
                         )
                         # To ensure that the time is not set back to the beginning of the time frame, but to 
                         # the original start
@@ -209,188 +369,444 @@ class TaskList():
                     else:
                         # pick up after the new (priority-1)
                         prev = next(
-                            t for t in all_tasks
-                            if t.priority == updated.priority - 1
+                            record for record in records
+                            if record.priority == updated.priority - 1
                         )
                         # Ensure that the next task is placed correctly depending on if the previous task 
                         # has been completed or not
-                        base_time = (
-                            (prev.start + timedelta(hours=prev.tracked_duration))
-                            if (prev.completed and prev.tracked_duration is not None)
-                            else prev.end
-                        )
+                        base_time = prev.actual_finish()
 
                 else:
                     # If no priority was updated then keep the old start time to avoid beginning at the first
                     # work window in time frame
-                    base_time = existing.start
+                    base_time = to_epoch_us(existing.start)
                 # Ensure we only schedule in free work windows
-                free_windows = self.remaining_work_windows(original_windows, base_time)
+                free_windows = windows.free_after(base_time)
+                stored = {updated.task_id: updated.placement()}
 
                 # Ensure the schedule is placed at either a free window or take over priority 1s start
-                pivot_schedule = schedule_tasks([updated], free_windows)[0]
+                schedule_records([updated], free_windows)
+                self.persist_moved_tasks(unit, [updated], stored)
 
-                self.db.update_one(
-                    {"_id": pivot_schedule.task_id},
-                    {"$set": {"start": pivot_schedule.start, "end": pivot_schedule.end}}
-                )
+                changed = self.downstream_of(unit, records, windows, updated, deferred)
 
-                self.reschedule_downstream_tasks(
-                    updated.time_frame_id,
-                    all_tasks,
-                    original_windows,
-                    pivot_schedule
-                )
+                return self.changeset(self.updated_task(existing, update_field, updated), changed)
+
+        # Nothing that affects the schedule was updated, so no other tasks have moved
+        return self.changeset(self.updated_task(existing, update_field, None), [])
+
+    async def reorder_tasks(self, time_frame_id: UUID, task_ids: List[UUID]) -> dict:
+        """
+            Applies a whole new order of the tasks in a time frame at once, like after dragging tasks around in the planner.
+            The tasks get new ranks, everything from the first task that changed place is scheduled again in one pass,
+            and all of it is written in a single bulk write.
+        """
+        generation = reschedule_coalescer.generation()
+        repository = await self.load_time_frame_tasks(time_frame_id)
+        result = await self.coalesce(
+            time_frame_id,
+            lambda unit, loaded: self.reorder_tasks_in(unit, loaded, time_frame_id, task_ids),
+            repository,
+            generation
+        )
+        event_hub.publish(time_frame_id, "tasks_reordered", {"tasks": result["data"], "changed": result["changed"]})
+        return result
+
+    async def reorder_tasks_in(self, unit: UnitOfWork, repository: TaskRepository, time_frame_id: UUID, task_ids: List[UUID]) -> dict:
+        records = self.load_task_records(repository, time_frame_id, unit)
+        by_id = {record.task_id: record for record in records}
+        # The new order has to contain every task of the time frame exactly once
+        if len(task_ids) != len(records) or set(task_ids) != by_id.keys():
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="The new order must contain every task in the time frame exactly once"
+            )
+
+        # Find the first task that changed place, nothing before it has to move
+        first = next((position for position, task_id in enumerate(task_ids) if records[position].task_id != task_id), None)
+        if first is None:
+            return {"status": status.HTTP_200_OK, "data": [record.changeset() for record in records], "changed": []}
+        # Like when moving a single task to the top, the first moved task takes over the start of the one that was there
+        base_time = records[first].start if first == 0 else records[first - 1].actual_finish()
+
+        # Spread the ranks out in the new order, only the tasks whose rank changes are written
+        reordered = [by_id[task_id] for task_id in task_ids]
+        for priority, record in enumerate(reordered, start=1):
+            record.priority = priority
+            if record.rank != priority * RANK_GAP:
+                record.rank = priority * RANK_GAP
+                unit.update(self.db, record.task_id, {"rank": record.rank, "priority": priority})
+
+        to_run = [record for record in reordered[first:] if not record.completed]
+        stored = {record.task_id: record.placement() for record in to_run}
+        _, windows = await self.load_time_frame(repository, time_frame_id)
+        try:
+            schedule_records(to_run, windows.free_after(base_time))
+        except RuntimeError as error:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=str(error)
+            )
+        changed = self.persist_moved_tasks(unit, to_run, stored)
 
-                return self.find_specific_task(task_id)
+        return {"status": status.HTTP_200_OK, "data": [record.changeset() for record in reordered], "changed": changed}
 
-    def delete_task(self, task_id: str):
+    async def delete_task(self, task_id: str, background: bool = False):
         try:
             uuid = UUID(task_id)
         except ValueError:
             raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
                                 detail="Invalid task id format")
-        to_delete = self.find_specific_task(task_id)
-
-        result = self.db.delete_one({"_id": uuid})
-        if not result.deleted_count:
-            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
-                                detail="Task not found")
-
-        # Decrement priority of everything that was below the task
-        self.db.update_many(
-            {
-                "time_frame_id": to_delete.time_frame_id,
-                "priority": {"$gt": to_delete.priority}
-            },
-            {"$inc": {"priority": -1}}
-        )
-        
-         # Reload all tasks in that timeframe
-        time_frame_documents = list(self.db.find({"time_frame_id": to_delete.time_frame_id}))
-        all_tasks = [Task.model_validate(document) for document in time_frame_documents]
+        generation = reschedule_coalescer.generation()
+        repository = TaskRepository(self.db, self.time_frame_collection)
+        to_delete = await self.load_task(repository, uuid)
+
+        deferred: List = [] if background else None
+
+        async def mutation(unit: UnitOfWork, loaded: TaskRepository) -> List[dict]:
+            if deferred is not None:
+                deferred.clear()
+            return await self.delete_task_in(unit, loaded, uuid, deferred)
+
+        changed = await self.coalesce(to_delete.time_frame_id, mutation, repository, generation)
+        result = {"status": status.HTTP_200_OK, "data": {"deleted_task_id": task_id}, "changed": changed}
+        if background:
+            result["job_id"] = self.queue_deferred(to_delete.time_frame_id, uuid, deferred)
+        event_hub.publish(to_delete.time_frame_id, "task_deleted", {"task_id": uuid, "changed": changed, "job_id": result.get("job_id")})
+        return result
+
+    async def delete_task_in(self, unit: UnitOfWork, repository: TaskRepository, task_uuid: UUID, deferred: Optional[List] = None) -> List[dict]:
+        to_delete = self.loaded_task(repository, task_uuid)
+        unit.delete(self.db, task_uuid)
+        if deferred is not None:
+            deferred.append(lambda unit, loaded: self.reschedule_after_delete(unit, loaded, to_delete))
+            return []
+        return await self.reschedule_after_delete(unit, repository, to_delete)
+
+    async def reschedule_after_delete(self, unit: UnitOfWork, repository: TaskRepository, to_delete: Task) -> List[dict]:
+        # The remaining tasks in that timeframe. Their priority follows from the ranks, so nothing has to be shifted up
+        records = [
+            record for record in self.load_task_records(repository, to_delete.time_frame_id, unit)
+            if record.task_id != to_delete.task_id
+        ]
+        number_by_rank(records)
 
         # Split into tasks before and after to ensure we update times correclty
-        before = [task for task in all_tasks if task.priority < to_delete.priority]
-        after  = [task for task in all_tasks if task.priority >= to_delete.priority]
+        before = [record for record in records if record.priority < to_delete.priority]
+        after  = [record for record in records if record.priority >= to_delete.priority]
 
         # Fetch the TimeFrame and remaining tasks
-        time_frame_document = self.time_frame_collection.find_one({"_id": to_delete.time_frame_id})
-        time_frame = TimeFrame.model_validate(time_frame_document)
+        _, windows = await self.load_time_frame(repository, to_delete.time_frame_id)
 
-        all_tasks = self.find_all_time_frame_tasks(to_delete.time_frame_id)["data"]
+        # Ensure the following tasks only start after actual finished time of an older task 
+        base_time = to_epoch_us(to_delete.start)
+        for record in before:
+            base_time = max(base_time, record.actual_finish())
+        windows = windows.free_after(base_time)
 
-        windows = generate_available_work_window_slots(time_frame)
-        windows = self.remaining_work_windows(windows, to_delete.start)
+        # Schedule the after_tasks into the remaining windows and only write the ones that moved
+        stored = {record.task_id: record.placement() for record in after}
+        scheduled = schedule_records(after, windows)
+        return self.persist_moved_tasks(unit, scheduled, stored)
 
-        # Ensure the following tasks only start after actual finished time of an older task 
-        for task in sorted(before, key=lambda t: t.priority):
-            if task.completed and task.tracked_duration is not None:
-                end_time = task.start + timedelta(hours=task.tracked_duration)
+    ### Helpers for updating to avoid a really bloated update function ###
+
+    # Mutations of a time frame go through the coalescer, so two of them never run at the same time, and the ones
+    # arriving together share one load and one bulk write
+    async def coalesce(self, time_frame_id: UUID, mutation, repository: TaskRepository, generation: int):
+        try:
+            return await reschedule_coalescer.submit(
+                time_frame_id,
+                mutation,
+                lambda batch, stale: self.run_batch(time_frame_id, batch, stale),
+                repository,
+                generation
+            )
+        finally:
+            # The tasks may have changed, so the ETags of the task list are no longer valid
+            resource_versions.bump("tasks", time_frame_id)
+
+    async def run_batch(self, time_frame_id: UUID, batch: List[PendingMutation], stale: bool) -> None:
+        """
+            Runs the queued mutations of a time frame on the same loaded tasks and writes them in one bulk write.
+            If one of them fails nothing of the batch is written, and each mutation runs on its own instead. Every
+            write of a mutation, the estimation stats of the user included, goes through the unit of work, so running
+            it again does not write anything twice.
+        """
+        if len(batch) > 1:
+            try:
+                repository = batch[0].repository
+                if stale or repository is None:
+                    repository = await self.load_time_frame_tasks(time_frame_id)
+                async with UnitOfWork() as unit:
+                    results = []
+                    for pending in batch:
+                        results.append(await pending.mutation(unit, repository))
+                        # The next mutation sees the tasks as this one left them
+                        repository.apply_pending(unit)
+            except Exception as error:
+                reschedule_coalescer.failed_batches += 1
+                # A 400 or 404 of one of the mutations is answered to its own request below, anything else is a failure
+                if not isinstance(error, HTTPException):
+                    print(f"Batch of {len(batch)} mutations of time frame {time_frame_id} failed, running them one at a time: {error!r}")
             else:
-                end_time = task.end
-            windows = self.remaining_work_windows(windows, end_time)
-
-        # Schedule the after_tasks into the remaining windows
-        scheduled = schedule_tasks(after, windows)
-        for task in scheduled:
-            utc_start = task.start.astimezone(timezone.utc)
-            utc_end   = task.end.astimezone(timezone.utc)
-
-            self.db.update_one(
-                {"_id": task.task_id},
-                {"$set": {"start": utc_start, "end": utc_end}}
+                for pending, result in zip(batch, results):
+                    pending.result = result
+                return
+
+        for pending in batch:
+            try:
+                # The repository the request loaded is only used if nothing has changed the tasks since
+                if len(batch) == 1 and not stale and pending.repository is not None:
+                    repository = pending.repository
+                else:
+                    repository = await self.load_time_frame_tasks(time_frame_id)
+                async with UnitOfWork() as unit:
+                    pending.result = await pending.mutation(unit, repository)
+            except Exception as error:
+                pending.error = error
+
+    # The time frame with all of its tasks, 404 if it does not exist
+    async def load_time_frame_tasks(self, time_frame_id: UUID) -> TaskRepository:
+        repository = TaskRepository(self.db, self.time_frame_collection)
+        if not await repository.load_by_time_frame(time_frame_id):
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="Time frame not found"
             )
+        return repository
 
-        return {"status": status.HTTP_200_OK, "data": {"deleted_task_id": task_id}}
+    # A task of a time frame that is already loaded, 404 if it was deleted in the meantime
+    def loaded_task(self, repository: TaskRepository, task_id: UUID) -> Task:
+        task = repository.task(task_id)
+        if task is None:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="No task found"
+            )
+        return task
 
-    ### Helpers for updating to avoid a really bloated update function ###
+    # The task with its time frame and the other tasks of the time frame, 404 if it does not exist
+    async def load_task(self, repository: TaskRepository, task_id: UUID) -> Task:
+        if await repository.load_by_task(task_id) is None:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="No task found"
+            )
+        return repository.task(task_id)
+
+    # The validated time frame and its work window index comes from the time frame cache, so we do not
+    # have to fetch and generate them for every task mutation.
+    async def load_time_frame(self, repository: TaskRepository, time_frame_id: UUID) -> Tuple[TimeFrame, WorkWindowIndex]:
+        loaded = await repository.time_frame(time_frame_id)
+        if loaded is None:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="Time frame not found"
+            )
+        return loaded
     
-    # Used for finding out how much time is left after finishing. 
-    def remaining_work_windows(self, 
-        windows: List[Tuple[datetime, datetime]],
-        finished_utc: datetime
-    ) -> List[Tuple[datetime, datetime]]:
-        # Free is the leftover time that might still be if the user finish early.
-        free: List[Tuple[datetime, datetime]] = []
-        for start, end in windows:
-            # Skip the work window if ends before the task is finished
-            if end <= finished_utc:
-                continue
-            # If it finish during the work window, only keep the free part of the work window.
-            if start < finished_utc < end:
-                free.append((finished_utc, end))
-            else:
-                free.append((start, end))
-        return free
+    # The tasks of a time frame as compact records sorted by rank, which is all the scheduler needs
+    def load_task_records(self, repository: TaskRepository, time_frame_id: UUID, unit: UnitOfWork) -> List[TaskRecord]:
+        records = repository.task_records(time_frame_id)
+        # Tasks from before ranks existed, or gaps that got too small, means the ranks are spread out again
+        if repository.has_unranked_tasks(time_frame_id) or needs_rebalance([record.rank for record in records]):
+            self.rebalance_ranks(records, unit)
+        return records
+
+    # Gives the tasks from before ranks existed their rank, through the coalescer like any other write to the time frame.
+    # load_task_records spreads the ranks out in the order of document_rank, which is the order of the whole list
+    async def rank_unranked_tasks(self, time_frame_id: UUID) -> None:
+        generation = reschedule_coalescer.generation()
+        repository = await self.load_time_frame_tasks(time_frame_id)
+
+        async def mutation(unit: UnitOfWork, loaded: TaskRepository) -> None:
+            self.load_task_records(loaded, time_frame_id, unit)
+
+        await self.coalesce(time_frame_id, mutation, repository, generation)
+
+    # Rank for a task placed at the given priority among the records, rebalancing first if there is no room
+    def rank_for_priority(self, records: List[TaskRecord], priority: int, unit: UnitOfWork) -> float:
+        rank = rank_for_position([record.rank for record in records], priority)
+        if rank is None:
+            self.rebalance_ranks(records, unit)
+            rank = rank_for_position([record.rank for record in records], priority)
+        return rank
+
+    # Spread the ranks of the records out evenly again, the only time every task in a time frame is written
+    def rebalance_ranks(self, records: List[TaskRecord], unit: UnitOfWork) -> None:
+        for record in records:
+            record.rank = record.priority * RANK_GAP
+            unit.update(self.db, record.task_id, {"rank": record.rank, "priority": record.priority})
+
+    # The 1..N priority of a task is its position in the time frame when sorted by rank
+    async def display_priority(self, document: dict) -> int:
+        if document.get("rank") is None:
+            return document["priority"]
+        return await self.db.count_documents({
+            "time_frame_id": document["time_frame_id"],
+            "rank": {"$lt": document["rank"]}
+        }) + 1
+
+    # Reschedule the tasks after the pivot now, or leave it for a background job when deferred is given
+    def downstream_of(self, unit: UnitOfWork, records: List[TaskRecord], windows: WorkWindowIndex, pivot: TaskRecord, deferred: Optional[List]) -> List[dict]:
+        if deferred is None:
+            return self.reschedule_downstream_tasks(unit, records, windows, pivot)
+        # Only the id and the end are kept, the job reads the rest of the tasks again when it runs
+        task_id, end = pivot.task_id, pivot.end
+        deferred.append(lambda unit, loaded: self.reschedule_downstream_in(unit, loaded, task_id, end))
+        return []
+
+    async def reschedule_downstream_in(self, unit: UnitOfWork, repository: TaskRepository, task_id: UUID, end: int) -> List[dict]:
+        """
+            The downstream reschedule of a background job, from the task as it is stored now but ending where it did
+            when the job was queued (for a completed task that is when it was finished).
+        """
+        pivot = repository.task(task_id)
+        if pivot is None:
+            # Deleted before the job ran, the delete has rescheduled the tasks after it
+            return []
+        records = self.load_task_records(repository, pivot.time_frame_id, unit)
+        _, windows = await self.load_time_frame(repository, pivot.time_frame_id)
+        record = next(record for record in records if record.task_id == task_id)
+        pivot_record = record.with_placement(record.start, end)
+        return self.reschedule_downstream_tasks(unit, records, windows, pivot_record)
+
+    # Queues the reschedule left by a background mutation, returns the id of the job or None if nothing was left
+    def queue_deferred(self, time_frame_id: UUID, task_id: UUID, deferred: List) -> Optional[UUID]:
+        if not deferred:
+            return None
+        reschedule = deferred[0]
+
+        async def run(job: RescheduleJob) -> Tuple[List[dict], int]:
+            changed = await self.coalesce(time_frame_id, reschedule, None, 0)
+            # The version lets the frontend see the schedule has settled without knowing about the job
+            time_frame = await self.time_frame_collection.find_one_and_update(
+                {"_id": time_frame_id},
+                {"$inc": {"schedule_version": 1}},
+                projection={"schedule_version": 1, "user_id": 1},
+                return_document=ReturnDocument.AFTER
+            )
+            schedule_version = None
+            if time_frame:
+                resource_versions.bump("time_frames", time_frame["user_id"])
+                schedule_version = time_frame["schedule_version"]
+            event_hub.publish(time_frame_id, "tasks_rescheduled", {"job_id": job.job_id, "task_id": task_id, "changed": changed, "schedule_version": schedule_version})
+            return changed, schedule_version
+
+        return reschedule_jobs.submit(time_frame_id, task_id, run).job_id
+
+    async def subscribe_events(self, time_frame_id: str):
+        """
+            Subscribes to the changes of the tasks in the time frame, 404 if the time frame does not exist.
+        """
+        time_frame_uuid = self.parse_time_frame_id(time_frame_id)
+        if await time_frame_cache.get_async(time_frame_uuid, lambda: self.time_frame_collection.find_one({"_id": time_frame_uuid})) is None:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="Time frame not found"
+            )
+        return event_hub.subscribe(time_frame_uuid)
+
+    def find_job(self, job_id: str) -> dict:
+        try:
+            job_uuid = UUID(job_id)
+        except ValueError:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Invalid job id format"
+            )
+        job = reschedule_jobs.get(job_uuid)
+        if job is None:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="Job not found"
+            )
+        return {"status": status.HTTP_200_OK, "data": job.to_dict()}
 
     # Reschedule just the downstream tasks - used when completing a task
     def reschedule_downstream_tasks(
         self,
-        time_frame_id: UUID,
-        all_tasks: List[Task],
-        original_window: List[Tuple[datetime, datetime]],
-        completed_task: Task,
-    ) -> None:
+        unit: UnitOfWork,
+        records: List[TaskRecord],
+        windows: WorkWindowIndex,
+        completed_task: TaskRecord,
+    ) -> List[dict]:
         # filter to not-yet-completed, lower-priority tasks
         to_run = [
-            task for task in all_tasks
-            if task.priority > completed_task.priority and not task.completed
+            record for record in records
+            if record.priority > completed_task.priority and not record.completed
         ]
+        # Remember where the tasks are placed right now, so we can compare with the new placement
+        stored = {record.task_id: record.placement() for record in to_run}
 
-        free_windows = self.remaining_work_windows(original_window, completed_task.end)
-        scheduled = schedule_tasks(to_run, free_windows)
-        for task in scheduled:
-            utc_start = task.start.astimezone(timezone.utc)
-            utc_end   = task.end.astimezone(timezone.utc)
+        free_windows = windows.free_after(completed_task.end)
+        scheduled = schedule_records(to_run, free_windows)
+        return self.persist_moved_tasks(unit, scheduled, stored)
+
+    # Only write the tasks where start or end actually changed and return them as the changeset
+    def persist_moved_tasks(
+        self,
+        unit: UnitOfWork,
+        scheduled: List[TaskRecord],
+        stored: Dict[UUID, Tuple[Optional[int], Optional[int]]],
+    ) -> List[dict]:
+        moved: List[dict] = []
+        for record in scheduled:
+            if not record.moved_from(stored[record.task_id]):
+                continue
+            changed = record.changeset()
+            unit.update(self.db, record.task_id, {"start": changed["start"], "end": changed["end"]})
+            moved.append(changed)
+        return moved
+
+    # The task as it is after the update, built from what we already have instead of reading it back
+    def updated_task(self, existing: Task, update_field: dict, record: Optional[TaskRecord]) -> Task:
+        fields = dict(update_field)
+        if record is not None:
+            fields.update({key: value for key, value in record.changeset().items() if key != "_id"})
+        return existing.model_copy(update=fields)
+
+    # Response for the endpoints that can move other tasks around
+    def changeset(self, task: Task, changed: List[dict]) -> dict:
+        return {
+            "status": status.HTTP_200_OK,
+            "data": task,
+            "changed": changed
+        }
 
-            self.db.update_one(
-                {"_id": task.task_id},
-                {"$set": {"start": utc_start, "end": utc_end}}
-            )
-            
         # tnhe logic of how the task is completed. Here we ensure that the tracked_duration is updated
-    def handle_completion(self, task_uuid: UUID, existing: Task, time_frame: TimeFrame) -> datetime:
+    async def handle_completion(self, unit: UnitOfWork, task_uuid: UUID, existing: Task, time_frame: TimeFrame, windows: WorkWindowIndex) -> Tuple[datetime, float]:
         finished_utc = datetime.now(timezone.utc)
-        duration = round(calculate_tracked_duration(
+        duration = round(calculate_tracked_duration_in_time_frame(
             existing.start,
             finished_utc, 
-            time_frame.work_time_frame_intervals,
+            time_frame,
+            windows,
         ), 2)
-        self.db.update_one(
-            {"_id": task_uuid},
-            {"$set": {"tracked_duration": duration}}
-        )
+        # The finished time is stored as well, so the tracked duration can be recalculated later
+        unit.update(self.db, task_uuid, {"tracked_duration": duration, "finished": finished_utc})
         
         # Ensure the user model is updated as well
         user_id = time_frame.user_id
         pct_error = (duration - existing.self_estimated_duration) / existing.self_estimated_duration * 100
-        user_controller = UserList(self.user_collection)
-        user_controller.update_user_estimation_average(
-            user_id,
-            existing.category,
-            pct_error
-        )
+        # Written with the task by the unit of work, so a batch that runs again does not add the estimation twice
+        unit.update_pipeline(self.user_collection, user_id, estimation_average_update(existing.category, pct_error))
+        unit.after_flush(lambda: resource_versions.bump("user", user_id))
             
-        return finished_utc
+        return finished_utc, duration
 
     # Reset when un-completing
-    def handle_uncompletion(self, task_uuid: UUID, existing: Task, time_frame: TimeFrame) -> None:
+    async def handle_uncompletion(self, unit: UnitOfWork, task_uuid: UUID, existing: Task, time_frame: TimeFrame) -> None:
         # Grab the old pct_error 
         old_pct = round((existing.tracked_duration - existing.self_estimated_duration) / existing.self_estimated_duration * 100)
 
         # Reset that task’s tracked_duration
-        self.db.update_one(
-            {"_id": task_uuid},
-            {"$set": {"tracked_duration": 0}}
-        )
+        unit.update(self.db, task_uuid, {"tracked_duration": 0, "finished": None})
 
         # Ensure the average and history is removed from the users model
-        user_controller = UserList(self.user_collection)
-        user_controller.uncomplete_user_estimation_average(
-            time_frame.user_id,
-            existing.category,
-            old_pct,
-        )
+        user_id = time_frame.user_id
+        unit.update_pipeline(self.user_collection, user_id, uncompleted_estimation_average_update(existing.category, old_pct))
+        unit.after_flush(lambda: resource_versions.bump("user", user_id))
             
         
\ No newline at end of file
@@ -1,37 +1,49 @@
-from datetime import datetime, date
+from datetime import datetime, date, timedelta, timezone
 from fastapi import HTTPException, status
 from uuid import UUID
-from typing import List
+from typing import List, Optional
 
 from ..models.time_frame import TimeFrame, UpdateTimeFrame
+from ..utils.pagination import DEFAULT_PAGE_SIZE, keyset_page
+from ..utils.read_models import parse_fields, projection, read_document
+from ..utils.time_frame_cache import time_frame_cache
+from ..utils.versions import resource_versions
 
 # Constants
 not_found_404 = "Time Frame not found"
+# The order of the pages in the list of all time frames
+time_frame_sort_keys = ["created_at", "_id"]
 
 class TimeFrameList():
     def __init__(self, db):
         self.db = db
 
-    # Get all time frames in database
-    def get_all_time_frames(self) -> List[TimeFrame]:
+    # Get the time frames in database a page at a time
+    async def get_all_time_frames(self, limit: int = DEFAULT_PAGE_SIZE, cursor: Optional[str] = None):
         """
-            Get all time frames in the database and returns them as a list.
+            Get a page of the time frames in the database, oldest first.
+            next_cursor is sent as cursor to get the next page, it is None on the last page.
         """
-        result = self.db.find()
-        number_of_time_frames = self.db.count_documents({})
+        documents, next_cursor, _ = await keyset_page(self.db, {}, time_frame_sort_keys, limit, cursor)
 
         return {
             "status": status.HTTP_200_OK,
-            "meta": number_of_time_frames,
-            "data": [TimeFrame(**time_frame) for time_frame in result]
+            "data": [read_document(TimeFrame, time_frame) for time_frame in documents],
+            "next_cursor": next_cursor
         }
+
+    def stream_all_time_frames(self):
+        """
+            All time frames in the database, one at a time straight from the cursor. Used for exports.
+        """
+        return (read_document(TimeFrame, time_frame) async for time_frame in self.db.find())
     
     # Get a specific time frame from the database
-    def get_single_time_frame(self, time_frame_id: str):
+    async def get_single_time_frame(self, time_frame_id: str):
         """
             Get a single time frame based on their id
         """
-        result = self.db.find_one({"_id": UUID(time_frame_id)})
+        result = await self.db.find_one({"_id": UUID(time_frame_id)})
         if result:
             return {
                 "status": status.HTTP_200_OK,
@@ -44,23 +56,25 @@ class TimeFrameList():
             )
         
     # Get all time frames for a specific user
-    def get_all_user_specific_time_frames(self, user_id: str) -> List[TimeFrame]:
+    async def get_all_user_specific_time_frames(self, user_id: str, fields: Optional[str] = None) -> List[TimeFrame]:
         """
             Given a users id, it will find all their time frames and return them as a list.
+            fields is an optional comma separated list of the fields to return.
         """
-        result = self.db.find({"user_id": UUID(user_id)})
+        wanted = parse_fields([TimeFrame], fields)
+        result = self.db.find({"user_id": UUID(user_id)}, projection(wanted))
 
         return {
             "status": status.HTTP_200_OK,
-            "data": [TimeFrame(**time_frame) for time_frame in result]
+            "data": [read_document(TimeFrame, time_frame, wanted) async for time_frame in result]
         }
     
     # Used to find the current active time frame that the user has
-    def get_active_time_frame(self, user_id: str):
+    async def get_active_time_frame(self, user_id: str):
         """
             Given a users id it will return the current active time frame for this user. There should only be one active time frame per user.
         """
-        result = self.db.find_one({
+        result = await self.db.find_one({
             "user_id": UUID(user_id),
             # $gte is a mongodb operator that works for comparision. It only find documents that are greater than or equal to the given value. In this case it only find the current active time frame document.
             "end_date": {"$gte": datetime.today()}
@@ -79,8 +93,41 @@ class TimeFrameList():
             )
 
 
+    # Used to check if more work fits in the time frame without scheduling anything
+    async def get_capacity(self, time_frame_id: str, after: Optional[datetime] = None, hours: Optional[float] = None):
+        """
+            Given a time frame id it returns how many work hours are left after a given time (default is now).
+            If hours is given it also returns when that amount of work would be done, or null if it does not fit.
+        """
+        time_frame_uuid = UUID(time_frame_id)
+        loaded = await time_frame_cache.get_async(time_frame_uuid, lambda: self.db.find_one({"_id": time_frame_uuid}))
+        if loaded is None:
+            raise HTTPException (
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail=not_found_404 
+            )
+        _, windows = loaded
+
+        if after is None:
+            after = datetime.now(timezone.utc)
+        elif after.tzinfo is None:
+            after = after.replace(tzinfo=timezone.utc)
+
+        capacity = {
+            "after": after,
+            "remaining_hours": windows.remaining_after(after).total_seconds() / 3600
+        }
+        if hours is not None:
+            finishes_at = windows.finish_time(timedelta(hours=hours), after)
+            capacity["hours"] = hours
+            capacity["fits"] = finishes_at is not None
+            capacity["finishes_at"] = finishes_at
+        return {
+            "status": status.HTTP_200_OK,
+            "data": capacity
+        }
         
-    def create_time_frame(self, time_frame: TimeFrame):
+    async def create_time_frame(self, time_frame: TimeFrame):
         """
             Creates a new time frame and adds it to the database.
         """
@@ -91,18 +138,23 @@ class TimeFrameList():
             )
         
 
-        _ = self.db.insert_one(time_frame.model_dump(by_alias=True))
+        _ = await self.db.insert_one(time_frame.model_dump(by_alias=True))
+        resource_versions.bump("time_frames", time_frame.user_id)
 
-    def update_time_frame(self, time_frame_id: str, time_frame: UpdateTimeFrame):
+    async def update_time_frame(self, time_frame_id: str, time_frame: UpdateTimeFrame):
         """
             Update the different fields in a time frame
         """
         update_field = time_frame.model_dump(exclude_unset=True)
 
-        result = self.db.update_one(
+        result = await self.db.update_one(
                 {"_id": UUID(time_frame_id)},
                 {"$set": update_field}
             )
+        # The cached work windows are based on the old dates and weekend setting
+        time_frame_cache.invalidate(UUID(time_frame_id))
+        # We do not know the user here, so the ETags of every users time frames are invalid (they are rarely updated)
+        resource_versions.bump("time_frames")
         if result.modified_count:
             return {
                 "status": status.HTTP_200_OK,
@@ -114,12 +166,14 @@ class TimeFrameList():
                 detail=not_found_404
             )
 
-    def delete_time_frame(self, time_frame_id: str):
+    async def delete_time_frame(self, time_frame_id: str):
         """
             Given the id it will delete the time frame from the database.
         """
         # should we do a check if the time_frame they are deleting has a match on their own id?
-        result = self.db.delete_one({"_id": UUID(time_frame_id)})
+        result = await self.db.delete_one({"_id": UUID(time_frame_id)})
+        time_frame_cache.invalidate(UUID(time_frame_id))
+        resource_versions.bump("time_frames")
         if result.deleted_count:
             return {
                 "status": status.HTTP_200_OK,
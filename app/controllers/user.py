@@ -1,48 +1,138 @@
 # Imports
 from fastapi import HTTPException, status
-from typing import List
+from fastapi.concurrency import run_in_threadpool
+from typing import List, Tuple
 from uuid import UUID
 
-from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
 
 from app.models.task import TaskCategory
 
 # Utils
 from ..utils.hasher import Hasher
+from ..utils.pagination import DEFAULT_PAGE_SIZE, keyset_page
+from ..utils.read_models import parse_fields, projection, read_document
+from ..utils.versions import resource_versions
 
 # Models
 from ..models.user import User, UserUpdate
 
 # Constants
 not_found_404 = "User not found"
+# Never sent back when reading a user, and the history of every category is only used for research
+hidden_user_fields = ["password"]
+excluded_user_fields = ["password"] + [f"estimation_average_for_category.{category.value}.history" for category in TaskCategory]
+# The order of the pages in the list of all users, _id breaks the ties between users created at the same time
+user_sort_keys = ["created_at", "_id"]
+
+# The update pipelines of the estimation stats of a category. A task mutation queues them on its unit of work, so
+# they are only written along with the task and never twice when a batch of mutations runs again.
+
+# Insert the history of estimations and calculate the average of their estimations
+# used for help in regards to estimation guesses.
+def estimation_average_update(category: TaskCategory, pct_error: float) -> List[dict]:
+    key = category.value
+    return [
+        # push the new pct_error onto the history array for research purpose
+        {"$set": {
+            f"estimation_average_for_category.{key}.history": {
+                    "$concatArrays": [
+                        {"$ifNull": [f"$estimation_average_for_category.{key}.history", []]},
+                        [ { "$round": [pct_error, 0] } ]
+                ]
+            }
+        }},
+        # recompute avg_pct_error based on the history array
+        {"$set": {
+            f"estimation_average_for_category.{key}.avg_pct_error": {
+                "$round": [
+                    { "$avg": f"$estimation_average_for_category.{key}.history" },
+                    0
+                ]
+            }
+        }}
+    ]
+
+def uncompleted_estimation_average_update(category: TaskCategory, pct_error: float) -> List[dict]:
+    """
+    Remove the given pct_error from performance.<category>.history
+    and recompute avg_pct_error (rounded to 0 decimals).
+    """
+    key = category.value  # e.g. "reading"
+    return [
+        # Stage 1: filter out any entry equal to pct_error
+        {"$set": {
+            f"estimation_average_for_category.{key}.history": {
+                "$filter": {
+                    "input": f"$estimation_average_for_category.{key}.history",
+                    "as": "e",
+                    "cond": {"$ne": ["$$e", pct_error]}
+                }
+            }
+        }},
+        # Stage 2: recompute & round the average (or zero if empty)
+        {"$set": {
+            f"estimation_average_for_category.{key}.avg_pct_error": {
+                "$round": [
+                    {"$ifNull": [
+                        {"$avg": f"$estimation_average_for_category.{key}.history"},
+                        0
+                    ]},
+                    0
+                ]
+            }
+        }}
+    ]
+
+# The unique indexes on username and email (app/database/indexes.py) turn away the second of two requests taking the
+# same one at the same time, which is answered like the check in check_username_and_email
+def raise_taken(error: DuplicateKeyError):
+    key_pattern = (error.details or {}).get("keyPattern", {})
+    raise HTTPException(
+        status_code = status.HTTP_400_BAD_REQUEST,
+        detail = "Email already taken" if "email" in key_pattern else "Username already taken"
+    )
 
 # Helpers
 class UserList:
     def __init__(self, db):
         self.db = db
 
-    # Find all users in the collection and return them as a list
-    def get_all_users(self) -> List[User]:
+    # Find the users in the collection a page at a time
+    async def get_all_users(self, limit: int = DEFAULT_PAGE_SIZE, cursor: str | None = None):
         """
-            Get all users in database, returns a list
+            Get a page of the users in the database, without their passwords, oldest first.
+            next_cursor is sent as cursor to get the next page, it is None on the last page.
         """
-        result = self.db.find()
-        number_of_users = self.db.count_documents({})
+        documents, next_cursor, _ = await keyset_page(self.db, {}, user_sort_keys, limit, cursor, projection(None, exclude=hidden_user_fields))
         return {
             "status": status.HTTP_200_OK,
-            "meta": number_of_users, # prints the amount of users in the collection - only metadata, so cannot be used in FE
-            "data": [User(**user) for user in result]
+            "data": [read_document(User, user) for user in documents],
+            "next_cursor": next_cursor
         }
 
-    def get_user(self, user_id: str):
+    def stream_all_users(self):
+        """
+            All users in the database without their passwords, one at a time straight from the cursor. Used for exports.
+        """
+        documents = self.db.find({}, projection(None, exclude=hidden_user_fields))
+        return (read_document(User, user) async for user in documents)
+
+    async def get_user(self, user_id: str, fields: str | None = None):
         """
-            Get a single user based on their id
+            Get a single user based on their id, without the password and the estimation history.
+            fields is an optional comma separated list of the fields to return.
         """
-        result = self.db.find_one({"_id": UUID(user_id)})
+        wanted = parse_fields([User], fields, hidden=hidden_user_fields)
+        result = await self.db.find_one({"_id": UUID(user_id)}, projection(wanted, exclude=excluded_user_fields))
         if result:
+            if wanted is None or "estimation_average_for_category" in wanted:
+                # The history is left out of the projection, also when the stats are asked for
+                for stats in result.get("estimation_average_for_category", {}).values():
+                    stats.pop("history", None)
             return {
                 "status": status.HTTP_200_OK,
-                "data": User(**result)
+                "data": read_document(User, result, wanted)
             }
         else:
             raise HTTPException(
@@ -51,11 +141,11 @@ class UserList:
             )
     
     # Used in auth for token validation
-    def get_user_by_username(self, username: str):
+    async def get_user_by_username(self, username: str):
         """
             Get a single user based on their username
         """
-        result = self.db.find_one({"username": username})
+        result = await self.db.find_one({"username": username})
         if result:
             return User(**result)
         else:
@@ -65,53 +155,62 @@ class UserList:
             )
     
     
-    def authenticate_user(self, username: str, password: str):
+    async def authenticate_user(self, username: str, password: str):
         """
             Takes the users usernamer and passowrd, verify the hased password and returns the user
         """
-        user = self.get_user_by_username(username=username)
+        user = await self.get_user_by_username(username=username)
         if not user:
             raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect username or password",
             headers={"WWW-Authenticate": "Bearer"},
         )
-        if not Hasher.verify_password(plain_password=password, hashed_password=user.password):
+        # bcrypt is slow on purpose, so it runs in the threadpool instead of holding up the other requests
+        if not await run_in_threadpool(Hasher.verify_password, plain_password=password, hashed_password=user.password):
             raise HTTPException(
                 status_code=status.HTTP_401_UNAUTHORIZED,
                 detail="Incorrect password"
             )
         return user
 
-    def create_user(self, user: User):
+    async def create_user(self, user: User):
         """
             Hashes the users password and adds them to the database
         """
         # check if username or email is already taken
-        self.check_username_and_email(user)
+        await self.check_username_and_email(user)
 
         # Hashing password with bcrypt from CryptContext
-        hashed_password = Hasher.get_password_hash(user.password)
+        hashed_password = await run_in_threadpool(Hasher.get_password_hash, user.password)
         user.password = hashed_password
 
-        _ = self.db.insert_one(user.model_dump(by_alias=True))
+        try:
+            _ = await self.db.insert_one(user.model_dump(by_alias=True))
+        except DuplicateKeyError as error:
+            # Another request took the username or email after the check above
+            raise_taken(error)
 
-    def update_user(self, user_id: str, user: UserUpdate):
+    async def update_user(self, user_id: str, user: UserUpdate):
         """
             Can update the username, email or password of the user. 
             If the user updates their password it will be hashed before storing it.
         """
-        self.check_username_and_email(user)
+        await self.check_username_and_email(user)
 
         update_field = user.model_dump(exclude_unset=True)
         # Ensure updated password is still hashed
         if "password" in update_field:
-            update_field["password"] = Hasher.get_password_hash(user.password)
+            update_field["password"] = await run_in_threadpool(Hasher.get_password_hash, user.password)
 
-        result = self.db.update_one(
-                {"_id": UUID(user_id)},
-                {"$set": update_field}
-            )
+        try:
+            result = await self.db.update_one(
+                    {"_id": UUID(user_id)},
+                    {"$set": update_field}
+                )
+        except DuplicateKeyError as error:
+            raise_taken(error)
+        resource_versions.bump("user", user_id)
         if result.modified_count:
             return {
                 "status": status.HTTP_200_OK,
@@ -125,11 +224,12 @@ class UserList:
 
 
     # Delete user from database
-    def delete_user(self, user_id: str):
+    async def delete_user(self, user_id: str):
         """
             Deletes a user from the database based on their id
         """
-        result = self.db.delete_one({"_id": UUID(user_id)})
+        result = await self.db.delete_one({"_id": UUID(user_id)})
+        resource_versions.bump("user", user_id)
         if result.deleted_count:
             return {
                 "status": status.HTTP_200_OK,
@@ -141,103 +241,35 @@ class UserList:
                 detail = not_found_404
             )
 
-    def check_username_and_email(self, user):
+    async def check_username_and_email(self, user):
         """
             Checks if username or email is already used in the database. Returns 400 if they are taken.
         """
-        if self.db.find_one({"username": user.username}):
+        if await self.db.find_one({"username": user.username}):
             raise HTTPException(
                 status_code = status.HTTP_400_BAD_REQUEST,
                 detail = "Username already taken"
             )
         
         # Check if email already exists
-        if self.db.find_one({"email": user.email}):
+        if await self.db.find_one({"email": user.email}):
             raise HTTPException(
                 status_code = status.HTTP_400_BAD_REQUEST,
                 detail = "Email already taken"
             )
             
-    # Insert the history of estimations and calculate the average of their estimations 
-    # used for help in regards to estimation guesses.
-    def update_user_estimation_average(
-        self,
-        user_id: UUID,
-        category: TaskCategory,
-        pct_error: float
-    ) -> None:
-        key = category.value
-
-        self.db.find_one_and_update(
-            {"_id": user_id},
-            [
-                # push the new pct_error onto the history array for research purpose
-                {"$set": {
-                    f"estimation_average_for_category.{key}.history": {
-                            "$concatArrays": [
-                                {"$ifNull": [f"$estimation_average_for_category.{key}.history", []]},
-                                [ { "$round": [pct_error, 0] } ]
-                        ]
-                    }
-                }},
-                # recompute avg_pct_error based on the history array
-                {"$set": {
-                    f"estimation_average_for_category.{key}.avg_pct_error": {
-                        "$round": [
-                            { "$avg": f"$estimation_average_for_category.{key}.history" },
-                            0
-                        ]
-                    }
-                }}
-            ],
-            return_document=ReturnDocument.AFTER
-        )
-        
+    async def suggestion_estimation(self, user_id: str, category: TaskCategory, estimate: float, confirm: bool = False) -> dict | None:
+        user = await self.db.find_one({"_id": UUID(user_id)})
+        stats_dict = user.get("estimation_average_for_category", {})
+        return self.suggest_from_stats(stats_dict, category, estimate, confirm)
 
-    def uncomplete_user_estimation_average(
-        self,
-        user_id: UUID,
-        category: TaskCategory,
-        pct_error: float
-    ) -> None:
-        """
-        Remove the given pct_error from performance.<category>.history
-        and recompute avg_pct_error (rounded to 0 decimals).
-        """
-        key = category.value  # e.g. "reading"
-
-        self.db.find_one_and_update(
-            {"_id": user_id},
-            [
-                # Stage 1: filter out any entry equal to pct_error
-                {"$set": {
-                    f"estimation_average_for_category.{key}.history": {
-                        "$filter": {
-                            "input": f"$estimation_average_for_category.{key}.history",
-                            "as": "e",
-                            "cond": {"$ne": ["$$e", pct_error]}
-                        }
-                    }
-                }},
-                # Stage 2: recompute & round the average (or zero if empty)
-                {"$set": {
-                    f"estimation_average_for_category.{key}.avg_pct_error": {
-                        "$round": [
-                            {"$ifNull": [
-                                {"$avg": f"$estimation_average_for_category.{key}.history"},
-                                0
-                            ]},
-                            0
-                        ]
-                    }
-                }}
-            ],
-            return_document=ReturnDocument.AFTER
-        )
-        
-    def suggestion_estimation(self, user_id: str, category: TaskCategory, estimate: float, confirm: bool = False) -> dict | None:
-        user = self.db.find_one({"_id": UUID(user_id)})
+    # Same as suggestion_estimation for a whole list of tasks, but the users stats are only read once
+    async def suggestion_estimations(self, user_id: str, tasks: List[Tuple[TaskCategory, float]], confirm: bool = False) -> List[dict | None]:
+        user = await self.db.find_one({"_id": UUID(user_id)}, {"estimation_average_for_category": 1})
         stats_dict = user.get("estimation_average_for_category", {})
+        return [self.suggest_from_stats(stats_dict, category, estimate, confirm) for category, estimate in tasks]
+
+    def suggest_from_stats(self, stats_dict: dict, category: TaskCategory, estimate: float, confirm: bool) -> dict | None:
         get_stats = stats_dict.get(category.value, {})
         avg_error = get_stats.get("avg_pct_error", 0.0)
         
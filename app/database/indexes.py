@@ -0,0 +1,240 @@
+# The indexes of every collection, created when the server starts (and by hand with the command below). Each one
+# backs the queries of a controller, so none of the lookups the routes make have to scan a whole collection.
+#
+# Run from the root of the repository, it uses the same .env as the server:
+#   python -m app.database.indexes             # create the indexes that are missing
+#   python -m app.database.indexes --list      # print the declared indexes without connecting
+#   python -m app.database.indexes --explain   # create them, explain the query of every controller and exit with 1 on a COLLSCAN
+#
+# --explain runs the controllers against the database, so point DB_URI at a local mongod (the collections can be
+# empty, nothing is written besides the indexes). The queries are taken from the commands the controllers actually
+# send, so a new or changed query is checked without having to list it here. tests/test_query_plans.py does the same
+# check on an empty database of its own.
+
+import argparse
+import asyncio
+import sys
+from datetime import datetime, timezone
+from types import SimpleNamespace
+from typing import Dict, List, Tuple
+from uuid import uuid4
+
+from fastapi import HTTPException
+from pymongo import ASCENDING, AsyncMongoClient, IndexModel, monitoring
+from pymongo.errors import PyMongoError
+
+from ..settings import get_settings
+from .mongodb import client_options
+
+INDEXES: Dict[str, List[IndexModel]] = {
+    "task": [
+        # The tasks of a time frame in the order of their priority. Used by find_all, the pages and exports of a
+        # time frame, the $lookup loading a time frame with its tasks and display_priority counting the tasks before one
+        IndexModel([("time_frame_id", ASCENDING), ("rank", ASCENDING), ("_id", ASCENDING)], name="time_frame_id_rank"),
+    ],
+    "user": [
+        # Login and the checks when creating or updating a user. Being unique also stops two requests at the same
+        # time from both getting the same username or email
+        IndexModel([("username", ASCENDING)], name="username_unique", unique=True),
+        IndexModel([("email", ASCENDING)], name="email_unique", unique=True),
+        # The pages of all users
+        IndexModel([("created_at", ASCENDING), ("_id", ASCENDING)], name="created_at"),
+    ],
+    "time_frame": [
+        # The time frames of a user, and the active one which ends today or later
+        IndexModel([("user_id", ASCENDING), ("end_date", ASCENDING)], name="user_id_end_date"),
+        # The pages of all time frames
+        IndexModel([("created_at", ASCENDING), ("_id", ASCENDING)], name="created_at"),
+    ],
+    "feedback": [
+        # The feedback of a user, oldest first
+        IndexModel([("user_id", ASCENDING), ("created_at", ASCENDING), ("_id", ASCENDING)], name="user_id_created_at"),
+    ],
+}
+
+
+async def ensure_indexes(database) -> Dict[str, List[str]]:
+    """
+        Creates the declared indexes that do not exist yet, and returns the names of the indexes of each collection.
+        Indexes that already exist are left alone, so it is cheap to run on every start.
+    """
+    created = {}
+    for collection_name, models in INDEXES.items():
+        created[collection_name] = await database[collection_name].create_indexes(models)
+    return created
+
+async def ensure_indexes_at_startup(database) -> None:
+    # DB_ENSURE_INDEXES=false turns it off, if the database user may not create indexes. The server should still
+    # start if the database is down or an index cannot be built (e.g. duplicate usernames)
+    if not get_settings().db_ensure_indexes:
+        return
+    try:
+        await ensure_indexes(database)
+    except PyMongoError as error:
+        print(f"Could not create the indexes: {error}")
+
+
+### Checking the query plans ###
+
+# The commands that read documents and have a query plan
+EXPLAINED_COMMANDS = {"find", "aggregate", "count"}
+# Fields of a sent command that belong to the session or the connection and not the query
+SESSION_FIELDS = {"lsid", "txnNumber", "autocommit", "startTransaction", "readConcern", "writeConcern", "apiVersion"}
+
+class QueryRecorder(monitoring.CommandListener):
+    """
+        Command listener keeping the queries sent while it records, along with the controller method that sent them.
+    """
+    def __init__(self):
+        self.source = None
+        self.queries: List[Tuple[str, str, dict]] = []
+
+    def started(self, event) -> None:
+        if self.source is not None and event.command_name in EXPLAINED_COMMANDS:
+            command = {key: value for key, value in event.command.items() if not key.startswith("$") and key not in SESSION_FIELDS}
+            self.queries.append((self.source, event.command_name, command))
+
+    def succeeded(self, event) -> None:
+        pass
+
+    def failed(self, event) -> None:
+        pass
+
+def controller_queries(database) -> List[Tuple[str, object]]:
+    """
+        The controller methods whose queries are explained, called with ids that do not exist. A 404 is fine, the
+        query has been sent by then. The exports of all users and all time frames read the whole collection on
+        purpose, so they are not in here.
+    """
+    # Imported here, the controllers are not needed for creating the indexes
+    from ..controllers.feedback import FeedbackList
+    from ..controllers.task import TaskList
+    from ..controllers.time_frame import TimeFrameList
+    from ..controllers.user import UserList
+    from ..database.task_repository import TaskRepository
+    from ..utils.pagination import encode_cursor
+
+    users = UserList(database.user)
+    time_frames = TimeFrameList(database.time_frame)
+    feedback = FeedbackList(database.feedback)
+    tasks = TaskList(database.task, database.time_frame, database.user)
+    user_id, time_frame_id, task_id = uuid4(), uuid4(), uuid4()
+    # A cursor in the middle of the pages, so the query for the next page is checked as well
+    created_cursor = encode_cursor([datetime.now(timezone.utc), uuid4()], 10)
+    rank_cursor = encode_cursor([1024.0, uuid4()], 10)
+
+    async def stream(documents) -> None:
+        async for _ in documents:
+            pass
+
+    return [
+        ("UserList.get_all_users", lambda: users.get_all_users(10)),
+        ("UserList.get_all_users next page", lambda: users.get_all_users(10, created_cursor)),
+        ("UserList.get_user_by_username", lambda: users.get_user_by_username("explain")),
+        ("UserList.check_username_and_email", lambda: users.check_username_and_email(SimpleNamespace(username="explain", email="explain@example.com"))),
+        ("TimeFrameList.get_all_time_frames", lambda: time_frames.get_all_time_frames(10)),
+        ("TimeFrameList.get_all_time_frames next page", lambda: time_frames.get_all_time_frames(10, created_cursor)),
+        ("TimeFrameList.get_all_user_specific_time_frames", lambda: time_frames.get_all_user_specific_time_frames(str(user_id))),
+        ("TimeFrameList.get_active_time_frame", lambda: time_frames.get_active_time_frame(str(user_id))),
+        ("FeedbackList.list_by_user", lambda: feedback.list_by_user(str(user_id))),
+        ("FeedbackList.list_by_user page", lambda: feedback.list_by_user(str(user_id), None, 10, created_cursor)),
+        ("FeedbackList.stream_by_user", lambda: stream(feedback.stream_by_user(str(user_id)))),
+        ("TaskList.find_all_time_frame_tasks", lambda: tasks.find_all_time_frame_tasks(str(time_frame_id))),
+        ("TaskList.find_all_time_frame_tasks page", lambda: tasks.find_all_time_frame_tasks(str(time_frame_id), None, 10, rank_cursor)),
+        ("TaskList.stream_time_frame_tasks", lambda: stream(tasks.stream_time_frame_tasks(str(time_frame_id)))),
+        ("TaskList.display_priority", lambda: tasks.display_priority({"time_frame_id": time_frame_id, "rank": 1024.0, "priority": 1})),
+        ("TaskRepository.load_by_time_frame", lambda: TaskRepository(database.task, database.time_frame).load_by_time_frame(time_frame_id)),
+        ("TaskRepository.load_by_task", lambda: TaskRepository(database.task, database.time_frame).load_by_task(task_id)),
+    ]
+
+def plan_stages(plan) -> List[str]:
+    """
+        The stages of every winning plan in an explain result. The rejected plans are skipped, a COLLSCAN in there
+        was never used.
+    """
+    stages = []
+    if isinstance(plan, dict):
+        if isinstance(plan.get("stage"), str):
+            stages.append(plan["stage"])
+        for key, value in plan.items():
+            if key != "rejectedPlans":
+                stages += plan_stages(value)
+    elif isinstance(plan, list):
+        for value in plan:
+            stages += plan_stages(value)
+    return stages
+
+def lookup_queries(command: dict) -> List[Tuple[str, dict]]:
+    # The tasks a $lookup joins in are found with a query on the other collection, which explain on the aggregation
+    # does not show, so it is explained as a find on that collection by itself
+    queries = []
+    for stage in command.get("pipeline", []):
+        lookup = stage.get("$lookup")
+        if lookup is not None and "foreignField" in lookup:
+            queries.append((lookup["from"], {"find": lookup["from"], "filter": {lookup["foreignField"]: uuid4()}}))
+    return queries
+
+async def explain_queries(database, recorder: QueryRecorder) -> List[Tuple[str, str, List[str]]]:
+    """
+        Runs every controller query and explains it. Returns the controller method, the query and the stages of the
+        winning plan of each of them, tests/test_query_plans.py fails if one of them has a COLLSCAN.
+    """
+    for source, call in controller_queries(database):
+        recorder.source = source
+        try:
+            await call()
+        except HTTPException:
+            pass
+        finally:
+            recorder.source = None
+
+    plans = []
+    for source, command_name, command in recorder.queries:
+        explained = [(f"{command_name} {command[command_name]}", command)]
+        explained += [(f"$lookup {collection}", lookup) for collection, lookup in lookup_queries(command)]
+        for description, query in explained:
+            # The query holds UUIDs, so it is encoded with the options of the database and not the defaults of command
+            result = await database.command("explain", query, verbosity="queryPlanner", codec_options=database.codec_options)
+            plans.append((source, description, plan_stages(result)))
+    return plans
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Create the indexes of the collections")
+    parser.add_argument("--list", action="store_true", help="Print the declared indexes without connecting")
+    parser.add_argument("--explain", action="store_true", help="Explain the query of every controller and exit with 1 on a COLLSCAN")
+    args = parser.parse_args()
+
+    if args.list:
+        for collection_name, models in INDEXES.items():
+            for model in models:
+                print(f"{collection_name:12} {model.document['name']:22} {dict(model.document['key'])} {'unique' if model.document.get('unique') else ''}")
+        return
+
+    async def run() -> int:
+        recorder = QueryRecorder()
+        # A client of its own, so the recorder only sees the commands sent from here
+        settings = get_settings()
+        client = AsyncMongoClient(settings.db_uri, **{**client_options(settings), "event_listeners": [recorder]})
+        try:
+            created = await ensure_indexes(client.db)
+            for collection_name, names in created.items():
+                print(f"{collection_name:12} {', '.join(names)}")
+            if not args.explain:
+                return 0
+            plans = await explain_queries(client.db, recorder)
+            scans = 0
+            for source, description, stages in plans:
+                collection_scan = "COLLSCAN" in stages
+                scans += collection_scan
+                print(f"{'COLLSCAN' if collection_scan else 'ok':8} {source:50} {description:24} {' > '.join(stages)}")
+            print(f"{len(plans)} queries explained, {scans} collection scans")
+            return 1 if scans else 0
+        finally:
+            await client.close()
+
+    sys.exit(asyncio.run(run()))
+
+
+if __name__ == "__main__":
+    main()
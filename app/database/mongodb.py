@@ -1,13 +1,50 @@
-import os
-from zoneinfo import ZoneInfo
+from functools import lru_cache
+from typing import Annotated
+
 import certifi
-from pymongo import MongoClient
-from dotenv import load_dotenv
+from fastapi import Depends, Request
+from pymongo import AsyncMongoClient, MongoClient
+from pymongo.asynchronous.database import AsyncDatabase
+
+from ..settings import Settings, get_settings
+from .monitoring import command_counter, pool_monitor
+
+# The clients are made from the settings when they are needed instead of when this module is imported. The server
+# makes its async client in the lifespan in main.py and the routes get the database through get_database.
+
+def client_options(settings: Settings) -> dict:
+    options = dict(tlsCAFile=certifi.where(), uuidRepresentation='standard', tz_aware=True, event_listeners=[command_counter, pool_monitor])
+    # Pool, timeouts, compression and concerns from the environment. Anything that is not set is left to the driver,
+    # except the server selection timeout, see settings.py
+    connection_options = {
+        "maxPoolSize": settings.db_max_pool_size,
+        "connectTimeoutMS": settings.db_connect_timeout_ms,
+        "socketTimeoutMS": settings.db_socket_timeout_ms,
+        "serverSelectionTimeoutMS": settings.db_server_selection_timeout_ms,
+        # e.g. zstd,snappy,zlib, the server uses the first one it supports. zstd needs the zstandard package and snappy
+        # needs python-snappy, the ones that are not installed are skipped with a warning
+        "compressors": settings.db_compressors,
+        "readConcernLevel": settings.db_read_concern,
+        "w": settings.db_write_concern,
+    }
+    options.update({name: value for name, value in connection_options.items() if value is not None})
+    return options
+
+def create_async_client(settings: Settings) -> AsyncMongoClient:
+    # The routes use the async client, so a request waiting on Atlas does not block the event loop for the other requests.
+    # Only the async client keeps idle connections open, the blocking client is only used by the admin jobs
+    return AsyncMongoClient(settings.db_uri, minPoolSize=settings.db_min_pool_size, **client_options(settings))
+
+@lru_cache(maxsize=None)
+def get_blocking_database():
+    # The admin jobs in app/jobs run on their own and keep using the blocking client, made the first time it is used
+    settings = get_settings()
+    return MongoClient(settings.db_uri, **client_options(settings)).db
+
 
-# Loading the connection variable from .env file
-load_dotenv()
+# Dependency for the routes, the database of the client the lifespan made. The dependencies are async even though
+# they do not await anything, FastAPI runs plain functions in the threadpool and that would be a thread hop per request
+async def get_database(request: Request) -> AsyncDatabase:
+    return request.app.state.database
 
-# Connect to the database
-atlas_uri = os.getenv("DB_URI")
-client = MongoClient(atlas_uri, tlsCAFile=certifi.where(), uuidRepresentation='standard', tz_aware=True)
-database = client.db
\ No newline at end of file
+database_dependency = Annotated[AsyncDatabase, Depends(get_database)]
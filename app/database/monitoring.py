@@ -0,0 +1,199 @@
+from collections import Counter, deque
+from contextvars import ContextVar
+from threading import Lock
+from typing import Deque, Dict, Optional
+
+from pymongo import monitoring
+
+# Counts the commands sent to MongoDB through a pymongo command listener, both in total and per endpoint, so we can
+# see how many round trips each endpoint makes. Every request gets its own counter through a context variable, which
+# the middleware in main.py sets before the request is handled. A pool listener does the same for the connection pool,
+# so we can see how many connections are in use and how long requests wait for one.
+
+# The most commands we expect each task endpoint to send. A request going over it is counted and printed, so a
+# change that adds round trips to the hot paths shows up straight away. tests/test_command_budgets.py fails when an
+# endpoint goes over. A bulk write is one command for each kind of write in it (insert, update and delete).
+COMMAND_BUDGETS = {
+    # suggestion_estimation, the aggregation of the time frame and its tasks and the insert
+    "POST /v1/task/time-frame/{time_frame_id}": 3,
+    # the same, and the update of the tasks that moved to make room
+    "POST /v1/task/time-frame/{time_frame_id}/batch": 4,
+    # the aggregation, the update of the tasks and the update of the users estimation average when completing
+    "PUT /v1/task/{task_id}": 3,
+    # the aggregation, the delete and the update of the tasks that moved
+    "DELETE /v1/task/{task_id}": 3,
+    "PUT /v1/task/time-frame/{time_frame_id}/reorder": 2,
+    "GET /v1/task/{task_id}": 2,
+    "GET /v1/task/time-frame/{time_frame_id}/find_all": 1,
+}
+
+class RequestCommands:
+    __slots__ = ("count",)
+
+    def __init__(self):
+        self.count = 0
+
+current_request_commands: ContextVar[Optional[RequestCommands]] = ContextVar("current_request_commands", default=None)
+
+
+class CommandCounter(monitoring.CommandListener):
+    """
+        Command listener counting the commands by name and the commands per request of each endpoint.
+    """
+    def __init__(self):
+        self.lock = Lock()
+        self.commands: Counter = Counter()
+        self.endpoints: Dict[str, dict] = {}
+
+    def started(self, event) -> None:
+        with self.lock:
+            self.commands[event.command_name] += 1
+        request_commands = current_request_commands.get()
+        if request_commands is not None:
+            request_commands.count += 1
+
+    def succeeded(self, event) -> None:
+        pass
+
+    def failed(self, event) -> None:
+        pass
+
+    def start_request(self) -> RequestCommands:
+        request_commands = RequestCommands()
+        current_request_commands.set(request_commands)
+        return request_commands
+
+    def finish_request(self, endpoint: str, request_commands: RequestCommands) -> None:
+        budget = COMMAND_BUDGETS.get(endpoint)
+        with self.lock:
+            stats = self.endpoints.setdefault(endpoint, {"requests": 0, "commands": 0, "max_commands": 0, "over_budget": 0})
+            stats["requests"] += 1
+            stats["commands"] += request_commands.count
+            stats["max_commands"] = max(stats["max_commands"], request_commands.count)
+            if budget is not None and request_commands.count > budget:
+                stats["over_budget"] += 1
+        if budget is not None and request_commands.count > budget:
+            print(f"{endpoint} sent {request_commands.count} database commands, the budget is {budget}")
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                "commands": dict(self.commands),
+                "endpoints": {
+                    endpoint: {**stats, "budget": COMMAND_BUDGETS.get(endpoint)}
+                    for endpoint, stats in self.endpoints.items()
+                },
+            }
+
+
+command_counter = CommandCounter()
+
+
+# How many of the latest checkout waits are kept for the percentiles
+MAX_CHECKOUT_WAITS = 1000
+
+def percentile_ms(waits, fraction: float) -> float:
+    # waits is sorted and in seconds
+    if not waits:
+        return 0.0
+    return waits[min(int(len(waits) * fraction), len(waits) - 1)] * 1000
+
+class PoolStats:
+    __slots__ = ("connections", "in_use", "max_in_use", "checkouts", "failed_checkouts", "cleared", "waits")
+
+    def __init__(self):
+        self.connections = 0
+        self.in_use = 0
+        self.max_in_use = 0
+        self.checkouts = 0
+        self.failed_checkouts = 0
+        self.cleared = 0
+        # Seconds each of the latest checkouts waited for a connection
+        self.waits: Deque[float] = deque(maxlen=MAX_CHECKOUT_WAITS)
+
+    def to_dict(self) -> dict:
+        waits = sorted(self.waits)
+        return {
+            "connections": self.connections,
+            "in_use": self.in_use,
+            "max_in_use": self.max_in_use,
+            "checkouts": self.checkouts,
+            "failed_checkouts": self.failed_checkouts,
+            "cleared": self.cleared,
+            "wait_ms_p50": percentile_ms(waits, 0.5),
+            "wait_ms_p95": percentile_ms(waits, 0.95),
+            "wait_ms_max": percentile_ms(waits, 1),
+        }
+
+
+class PoolMonitor(monitoring.ConnectionPoolListener):
+    """
+        Connection pool listener keeping the open connections, the connections in use and how long the latest
+        checkouts waited for a connection, for each server. When the in use count sits at DB_MAX_POOL_SIZE and the
+        waits grow, the requests are queueing for connections and the pool (or the number of workers) is too small.
+    """
+    def __init__(self):
+        self.lock = Lock()
+        self.pools: Dict[str, PoolStats] = {}
+
+    def pool(self, address) -> PoolStats:
+        key = f"{address[0]}:{address[1]}"
+        if key not in self.pools:
+            self.pools[key] = PoolStats()
+        return self.pools[key]
+
+    def pool_created(self, event) -> None:
+        with self.lock:
+            self.pool(event.address)
+
+    def pool_ready(self, event) -> None:
+        pass
+
+    def pool_cleared(self, event) -> None:
+        with self.lock:
+            self.pool(event.address).cleared += 1
+
+    def pool_closed(self, event) -> None:
+        pass
+
+    def connection_created(self, event) -> None:
+        with self.lock:
+            self.pool(event.address).connections += 1
+
+    def connection_ready(self, event) -> None:
+        pass
+
+    def connection_closed(self, event) -> None:
+        with self.lock:
+            self.pool(event.address).connections -= 1
+
+    def connection_check_out_started(self, event) -> None:
+        pass
+
+    def connection_check_out_failed(self, event) -> None:
+        with self.lock:
+            pool = self.pool(event.address)
+            pool.failed_checkouts += 1
+            if event.duration is not None:
+                pool.waits.append(event.duration)
+
+    def connection_checked_out(self, event) -> None:
+        with self.lock:
+            pool = self.pool(event.address)
+            pool.checkouts += 1
+            pool.in_use += 1
+            pool.max_in_use = max(pool.max_in_use, pool.in_use)
+            # The duration includes opening a new connection when there was no idle one
+            if event.duration is not None:
+                pool.waits.append(event.duration)
+
+    def connection_checked_in(self, event) -> None:
+        with self.lock:
+            self.pool(event.address).in_use -= 1
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {address: pool.to_dict() for address, pool in self.pools.items()}
+
+
+pool_monitor = PoolMonitor()
@@ -0,0 +1,153 @@
+from typing import Dict, List, Optional, Tuple
+from uuid import UUID
+
+from ..models.task import Task
+from ..models.time_frame import TimeFrame
+from ..utils.ranking import document_rank, number_by_rank
+from ..utils.scheduler import TaskRecord
+from ..utils.time_frame_cache import time_frame_cache
+from ..utils.work_windows import WorkWindowIndex
+
+
+class TaskRepository:
+    """
+        Identity map for the documents used while handling a single task request. A time frame and all of its tasks are
+        fetched together with one aggregation, and every document is only validated or turned into a record once,
+        no matter how many times the request asks for it.
+    """
+    def __init__(self, task_collection, time_frame_collection):
+        self.task_collection = task_collection
+        self.time_frame_collection = time_frame_collection
+        self.time_frame_documents: Dict[UUID, Optional[dict]] = {}
+        # time_frame_cache.invalidations before each time frame was loaded, so an outdated document is never cached
+        self.cache_invalidations: Dict[UUID, int] = {}
+        # The task documents of each time frame as they were loaded, and with the pending writes applied sorted by rank
+        self.loaded_task_documents: Dict[UUID, List[dict]] = {}
+        self.task_documents: Dict[UUID, List[dict]] = {}
+        # Each task document by its id, along with its position in the time frame
+        self.documents: Dict[UUID, Tuple[dict, int]] = {}
+        self.tasks: Dict[UUID, Task] = {}
+        self.records: Dict[UUID, List[TaskRecord]] = {}
+
+    async def load_by_task(self, task_id: UUID) -> Optional[UUID]:
+        """
+            Loads the task, its time frame and the other tasks of the time frame in one round trip.
+            Returns the id of the time frame, or None if the task does not exist.
+        """
+        pipeline = [
+            {"$match": {"_id": task_id}},
+            {"$project": {"time_frame_id": 1}},
+            {"$lookup": {
+                "from": self.time_frame_collection.name,
+                "localField": "time_frame_id",
+                "foreignField": "_id",
+                "as": "time_frame",
+            }},
+            {"$lookup": {
+                "from": self.task_collection.name,
+                "localField": "time_frame_id",
+                "foreignField": "time_frame_id",
+                "as": "tasks",
+            }},
+        ]
+        invalidations = time_frame_cache.invalidations
+        cursor = await self.task_collection.aggregate(pipeline)
+        result = next(iter(await cursor.to_list(1)), None)
+        if result is None:
+            return None
+        self.cache_invalidations[result["time_frame_id"]] = invalidations
+        self.store_loaded(result["time_frame_id"], result["time_frame"], result["tasks"])
+        return result["time_frame_id"]
+
+    async def load_by_time_frame(self, time_frame_id: UUID) -> bool:
+        """
+            Loads the time frame and its tasks in one round trip. Returns False if the time frame does not exist.
+        """
+        pipeline = [
+            {"$match": {"_id": time_frame_id}},
+            {"$lookup": {
+                "from": self.task_collection.name,
+                "localField": "_id",
+                "foreignField": "time_frame_id",
+                "as": "tasks",
+            }},
+        ]
+        invalidations = time_frame_cache.invalidations
+        cursor = await self.time_frame_collection.aggregate(pipeline)
+        result = next(iter(await cursor.to_list(1)), None)
+        if result is None:
+            return False
+        self.cache_invalidations[time_frame_id] = invalidations
+        tasks = result.pop("tasks")
+        self.store_loaded(time_frame_id, [result], tasks)
+        return True
+
+    def store_loaded(self, time_frame_id: UUID, time_frames: List[dict], tasks: List[dict]) -> None:
+        # The documents as they are in the database, apply_pending always starts over from these
+        self.loaded_task_documents[time_frame_id] = list(tasks)
+        self.store(time_frame_id, time_frames, tasks)
+
+    def store(self, time_frame_id: UUID, time_frames: List[dict], tasks: List[dict]) -> None:
+        self.time_frame_documents[time_frame_id] = time_frames[0] if time_frames else None
+        tasks.sort(key=lambda document: (document_rank(document), document["_id"]))
+        self.task_documents[time_frame_id] = tasks
+        for position, document in enumerate(tasks, start=1):
+            self.documents[document["_id"]] = (document, position)
+
+    def task(self, task_id: UUID) -> Optional[Task]:
+        """
+            The task as a model, with its 1..N priority from its position in the time frame.
+        """
+        if task_id not in self.tasks:
+            if task_id not in self.documents:
+                return None
+            document, position = self.documents[task_id]
+            self.tasks[task_id] = Task.model_validate({**document, "priority": position})
+        return self.tasks[task_id]
+
+    def task_records(self, time_frame_id: UUID) -> List[TaskRecord]:
+        """
+            The tasks of a loaded time frame as records sorted by rank. The same list is returned every time,
+            so changes made to the records during the request are kept.
+        """
+        if time_frame_id not in self.records:
+            self.records[time_frame_id] = number_by_rank([
+                TaskRecord.from_document(document) for document in self.task_documents.get(time_frame_id, [])
+            ])
+        return self.records[time_frame_id]
+
+    def apply_pending(self, unit) -> None:
+        """
+            Applies the task writes collected in the unit of work to the loaded documents, so the next mutation run on
+            this repository sees the tasks as they will be stored. The validated tasks and records are built again.
+            The unit of work holds every write since the documents were loaded, so they are applied to the documents
+            as loaded and not on top of the last call, which would add the inserted tasks again.
+        """
+        writes = unit.pending.get(self.task_collection.full_name)
+        if writes is None:
+            return
+        self.documents = {}
+        self.tasks = {}
+        self.records = {}
+        for time_frame_id, documents in self.loaded_task_documents.items():
+            tasks = [
+                {**document, **writes.updates.get(document["_id"], {})}
+                for document in documents
+                if document["_id"] not in writes.deletes
+            ]
+            tasks += [document for document in writes.inserts.values() if document["time_frame_id"] == time_frame_id]
+            time_frame = self.time_frame_documents.get(time_frame_id)
+            self.store(time_frame_id, [time_frame] if time_frame is not None else [], tasks)
+
+    def has_unranked_tasks(self, time_frame_id: UUID) -> bool:
+        return any(document.get("rank") is None for document in self.task_documents.get(time_frame_id, []))
+
+    async def time_frame(self, time_frame_id: UUID) -> Optional[Tuple[TimeFrame, WorkWindowIndex]]:
+        """
+            The validated time frame and its window index from the time frame cache. On a miss the document that was
+            already loaded is used, so the cache does not have to fetch it again. It is only cached if the time frame
+            was not updated while it was loading.
+        """
+        if time_frame_id in self.time_frame_documents:
+            return time_frame_cache.get_loaded(time_frame_id, self.time_frame_documents[time_frame_id], self.cache_invalidations[time_frame_id])
+        return await time_frame_cache.get_async(time_frame_id, lambda: self.time_frame_collection.find_one({"_id": time_frame_id}))
@@ -0,0 +1,118 @@
+from typing import Callable, Dict, List, Optional, Tuple
+
+from pymongo import DeleteOne, InsertOne, UpdateOne
+
+from ..settings import get_settings
+
+
+class PendingWrites:
+    """
+        The writes waiting for a single collection. Several $set updates of the same document are merged into one,
+        and updates of a document inserted in the same unit of work go straight into the inserted document, so the
+        order of the operations does not matter and the bulk write can be unordered. Pipeline updates cannot be merged,
+        they are sent after the rest in the order they were made.
+    """
+    __slots__ = ("collection", "inserts", "updates", "deletes", "pipelines")
+
+    def __init__(self, collection):
+        self.collection = collection
+        self.inserts: Dict[object, dict] = {}
+        self.updates: Dict[object, dict] = {}
+        self.deletes: Dict[object, None] = {}
+        self.pipelines: List[Tuple[object, List[dict]]] = []
+
+    def operations(self) -> List:
+        operations = [InsertOne(document) for document in self.inserts.values()]
+        operations += [
+            UpdateOne({"_id": document_id}, {"$set": fields})
+            for document_id, fields in self.updates.items()
+            if document_id not in self.deletes
+        ]
+        operations += [DeleteOne({"_id": document_id}) for document_id in self.deletes]
+        operations += [UpdateOne({"_id": document_id}, pipeline) for document_id, pipeline in self.pipelines]
+        return operations
+
+
+class UnitOfWork:
+    """
+        Collects the writes made while handling a request and sends them as one unordered bulk_write per collection
+        when the unit of work is done, instead of a round trip per write. Used as an async context manager, if the
+        block raises nothing is written. With transactions turned on the bulk writes run in a multi-document transaction,
+        so a schedule is never half written.
+    """
+    def __init__(self, transaction: Optional[bool] = None):
+        # DB_TRANSACTIONS turns the transactions on, this needs a replica set which Atlas always has
+        self.transaction = get_settings().db_transactions if transaction is None else transaction
+        # Keyed by the full name of the collection, so writes to the same collection end up in the same bulk write
+        self.pending: Dict[str, PendingWrites] = {}
+        # Called once the writes are stored, e.g. for bumping the versions behind the ETags
+        self.callbacks: List[Callable[[], None]] = []
+
+    async def __aenter__(self) -> "UnitOfWork":
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback) -> None:
+        if exc_type is None:
+            await self.flush()
+        else:
+            self.pending.clear()
+            self.callbacks.clear()
+
+    def insert(self, collection, document: dict) -> None:
+        writes = self.writes_for(collection)
+        # Updates collected before the document existed would not match anything, the inserted document is what counts
+        writes.updates.pop(document["_id"], None)
+        writes.inserts[document["_id"]] = document
+
+    def update(self, collection, document_id, fields: dict) -> None:
+        """
+            Sets the given fields on the document, merged with earlier updates of the same document.
+        """
+        writes = self.writes_for(collection)
+        if document_id in writes.inserts:
+            writes.inserts[document_id].update(fields)
+        else:
+            writes.updates.setdefault(document_id, {}).update(fields)
+
+    def update_pipeline(self, collection, document_id, pipeline: List[dict]) -> None:
+        """
+            Updates the document with an aggregation pipeline, for updates that depend on what is stored like the
+            estimation history of a user.
+        """
+        self.writes_for(collection).pipelines.append((document_id, pipeline))
+
+    def after_flush(self, callback: Callable[[], None]) -> None:
+        self.callbacks.append(callback)
+
+    def delete(self, collection, document_id) -> None:
+        writes = self.writes_for(collection)
+        if writes.inserts.pop(document_id, None) is None:
+            writes.deletes[document_id] = None
+
+    def writes_for(self, collection) -> PendingWrites:
+        if collection.full_name not in self.pending:
+            self.pending[collection.full_name] = PendingWrites(collection)
+        return self.pending[collection.full_name]
+
+    async def flush(self) -> None:
+        """
+            Sends the collected writes to the database and starts over with an empty unit of work.
+        """
+        if self.pending:
+            if self.transaction:
+                client = next(iter(self.pending.values())).collection.database.client
+                async with client.start_session() as session:
+                    await session.with_transaction(self.write)
+            else:
+                await self.write(None)
+            self.pending.clear()
+        callbacks, self.callbacks = self.callbacks, []
+        for callback in callbacks:
+            callback()
+
+    async def write(self, session) -> None:
+        for writes in self.pending.values():
+            operations = writes.operations()
+            if operations:
+                # Two pipeline updates of the same document depend on each other, so those bulk writes keep the order
+                await writes.collection.bulk_write(operations, ordered=bool(writes.pipelines), session=session)
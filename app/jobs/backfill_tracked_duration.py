@@ -0,0 +1,86 @@
+# Admin job for filling in tracked_duration on completed tasks that are missing one, or recalculating it for
+# every completed task with --all. Tasks are read one time frame at a time and written back with bulk writes,
+# so there is no round trip per task.
+#
+# Run it from the root of the repository:
+#   python -m app.jobs.backfill_tracked_duration [--all] [--batch-size 500] [--dry-run]
+
+import argparse
+from itertools import groupby
+
+from pymongo import UpdateOne
+
+from ..database.mongodb import get_blocking_database
+from ..models.task import Task
+from ..models.time_frame import TimeFrame
+from ..utils.tracked_duration import calculate_tracked_durations
+from ..utils.work_windows import WorkWindowIndex
+
+
+def backfill_tracked_duration(task_collection, time_frame_collection, recalculate_all: bool = False, batch_size: int = 500, dry_run: bool = False) -> dict:
+    """
+        Calculates tracked_duration for completed tasks, one time frame at a time, and writes them with bulk writes.
+        Returns how many tasks were looked at and updated.
+    """
+    query = {"completed": True}
+    if not recalculate_all:
+        # A completed task without a tracked duration either has none or was reset to 0 by an uncompletion
+        query["$or"] = [{"tracked_duration": None}, {"tracked_duration": 0}]
+
+    counts = {"time_frames": 0, "tasks": 0, "updated": 0, "missing_time_frame": 0}
+    operations = []
+    # Sorting by time frame lets us group the tasks and only load each time frame once
+    documents = task_collection.find(query).sort("time_frame_id", 1)
+    for time_frame_id, group in groupby(documents, key=lambda document: document["time_frame_id"]):
+        tasks = [Task.model_validate(document) for document in group]
+        counts["tasks"] += len(tasks)
+
+        time_frame_document = time_frame_collection.find_one({"_id": time_frame_id})
+        if time_frame_document is None:
+            counts["missing_time_frame"] += len(tasks)
+            continue
+        time_frame = TimeFrame.model_validate(time_frame_document)
+        counts["time_frames"] += 1
+
+        durations = calculate_tracked_durations(tasks, time_frame, WorkWindowIndex.from_time_frame(time_frame))
+        for task_id, duration in durations.items():
+            operations.append(UpdateOne({"_id": task_id}, {"$set": {"tracked_duration": duration}}))
+
+        if len(operations) >= batch_size:
+            counts["updated"] += flush(task_collection, operations, dry_run)
+            operations = []
+
+    counts["updated"] += flush(task_collection, operations, dry_run)
+    return counts
+
+def flush(task_collection, operations, dry_run: bool) -> int:
+    if not operations:
+        return 0
+    if dry_run:
+        return len(operations)
+    result = task_collection.bulk_write(operations, ordered=False)
+    return result.modified_count
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Backfill tracked_duration for completed tasks")
+    parser.add_argument("--all", action="store_true", help="Recalculate every completed task, not only the ones missing a tracked duration")
+    parser.add_argument("--batch-size", type=int, default=500, help="Number of updates per bulk write")
+    parser.add_argument("--dry-run", action="store_true", help="Calculate the durations without writing them")
+    args = parser.parse_args()
+    database = get_blocking_database()
+
+    counts = backfill_tracked_duration(
+        database.task,
+        database.time_frame,
+        recalculate_all=args.all,
+        batch_size=args.batch_size,
+        dry_run=args.dry_run,
+    )
+    print(f"Looked at {counts['tasks']} tasks in {counts['time_frames']} time frames, updated {counts['updated']}")
+    if counts["missing_time_frame"]:
+        print(f"Skipped {counts['missing_time_frame']} tasks whose time frame no longer exists")
+
+
+if __name__ == "__main__":
+    main()
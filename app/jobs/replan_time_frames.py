@@ -0,0 +1,161 @@
+# Admin job for placing the tasks of every active time frame again, used when the scheduling rules change
+# (a scheduler fix, a weekend policy change and so on). Active time frames are streamed from the database in
+# chunks, the scheduling is fanned out over a process pool using the pure functions from the scheduler, and the
+# tasks that moved are written back with one bulk write per chunk.
+#
+# After each chunk the id of the last time frame is saved in a checkpoint file, so if the job crashes it can
+# continue from there with --resume.
+#
+# Run it from the root of the repository:
+#   python -m app.jobs.replan_time_frames [--workers 4] [--chunk-size 200] [--resume] [--dry-run]
+
+import argparse
+import json
+import os
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import List, Optional, Tuple
+from uuid import UUID
+
+from pymongo import UpdateOne
+
+from ..database.mongodb import get_blocking_database
+from ..models.time_frame import TimeFrame
+from ..utils.ranking import number_by_rank
+from ..utils.scheduler import TaskRecord, from_epoch_us, schedule_records
+from ..utils.work_windows import WorkWindowIndex
+
+DEFAULT_CHECKPOINT = Path(".replan_checkpoint.json")
+
+# The result of replanning one time frame: its id, the tasks that moved as (task_id, start, end) and an error if
+# the tasks could not be placed
+ReplanResult = Tuple[UUID, List[Tuple[UUID, datetime, datetime]], Optional[str]]
+
+
+def replan_time_frame(time_frame_document: dict, task_documents: List[dict]) -> ReplanResult:
+    """
+        Places the tasks of a time frame that are not completed again, starting where the first of them starts now.
+        Runs in the worker processes, so it only works on the documents it is given and does not touch the database.
+    """
+    time_frame = TimeFrame.model_validate(time_frame_document)
+    records = number_by_rank([TaskRecord.from_document(document) for document in task_documents])
+    pending = [record for record in records if not record.completed]
+    if not pending:
+        return time_frame.time_frame_id, [], None
+
+    # Remember where the tasks are placed right now, so only the ones that moved are written
+    stored = {record.task_id: record.placement() for record in pending}
+    # Only the windows from the first task on are generated, the time frame may have been going on for a long time
+    base_time = from_epoch_us(pending[0].start) if pending[0].start is not None else None
+    windows = WorkWindowIndex.from_time_frame(time_frame, base_time).free_after(base_time)
+    try:
+        scheduled = schedule_records(pending, windows)
+    except RuntimeError as error:
+        return time_frame.time_frame_id, [], str(error)
+
+    moved = []
+    for record in scheduled:
+        if not record.moved_from(stored[record.task_id]):
+            continue
+        moved.append((record.task_id, from_epoch_us(record.start), from_epoch_us(record.end)))
+    return time_frame.time_frame_id, moved, None
+
+
+def stream_active_time_frames(time_frame_collection, after_id: Optional[UUID], chunk_size: int):
+    """
+        Yields chunks of active time frames sorted by id, starting after after_id when resuming.
+    """
+    query = {"end_date": {"$gte": datetime.now(timezone.utc)}}
+    if after_id is not None:
+        query["_id"] = {"$gt": after_id}
+    chunk = []
+    for document in time_frame_collection.find(query).sort("_id", 1):
+        chunk.append(document)
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+def load_checkpoint(path: Path, resume: bool) -> dict:
+    if not resume or not path.exists():
+        return {"last_time_frame_id": None, "time_frames": 0, "moved": 0, "failed": []}
+    return json.loads(path.read_text())
+
+def save_checkpoint(path: Path, checkpoint: dict) -> None:
+    # Write to a temporary file first, so a crash while writing does not leave a broken checkpoint
+    temporary = path.with_suffix(".tmp")
+    temporary.write_text(json.dumps(checkpoint))
+    temporary.replace(path)
+
+
+def replan_time_frames(task_collection, time_frame_collection, workers: int, chunk_size: int, checkpoint_path: Path, resume: bool = False, dry_run: bool = False) -> dict:
+    checkpoint = load_checkpoint(checkpoint_path, resume)
+    after_id = UUID(checkpoint["last_time_frame_id"]) if checkpoint["last_time_frame_id"] else None
+    total = time_frame_collection.count_documents({"end_date": {"$gte": datetime.now(timezone.utc)}})
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for chunk in stream_active_time_frames(time_frame_collection, after_id, chunk_size):
+            # Fetch the tasks for the whole chunk in one query
+            time_frame_ids = [document["_id"] for document in chunk]
+            tasks_by_time_frame = defaultdict(list)
+            for task_document in task_collection.find({"time_frame_id": {"$in": time_frame_ids}}):
+                tasks_by_time_frame[task_document["time_frame_id"]].append(task_document)
+
+            results = executor.map(
+                replan_time_frame,
+                chunk,
+                [tasks_by_time_frame[time_frame_id] for time_frame_id in time_frame_ids],
+                chunksize=max(1, len(chunk) // (workers * 4)),
+            )
+
+            operations = []
+            for time_frame_id, moved, error in results:
+                if error is not None:
+                    checkpoint["failed"].append({"time_frame_id": str(time_frame_id), "error": error})
+                for task_id, start, end in moved:
+                    operations.append(UpdateOne({"_id": task_id}, {"$set": {"start": start, "end": end}}))
+            if operations and not dry_run:
+                task_collection.bulk_write(operations, ordered=False)
+
+            checkpoint["last_time_frame_id"] = str(time_frame_ids[-1])
+            checkpoint["time_frames"] += len(chunk)
+            checkpoint["moved"] += len(operations)
+            if not dry_run:
+                save_checkpoint(checkpoint_path, checkpoint)
+            print(f"{checkpoint['time_frames']}/{total} time frames, {checkpoint['moved']} tasks moved, {len(checkpoint['failed'])} failed")
+
+    # Everything went through, so the next run should start from the beginning again
+    if checkpoint_path.exists() and not dry_run:
+        checkpoint_path.unlink()
+    return checkpoint
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Place the tasks of every active time frame again")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Number of worker processes")
+    parser.add_argument("--chunk-size", type=int, default=200, help="Number of time frames per chunk and bulk write")
+    parser.add_argument("--checkpoint", type=Path, default=DEFAULT_CHECKPOINT, help="File used to resume after a crash")
+    parser.add_argument("--resume", action="store_true", help="Continue after the last time frame in the checkpoint file")
+    parser.add_argument("--dry-run", action="store_true", help="Calculate the new placements without writing them")
+    args = parser.parse_args()
+    database = get_blocking_database()
+
+    checkpoint = replan_time_frames(
+        database.task,
+        database.time_frame,
+        workers=args.workers,
+        chunk_size=args.chunk_size,
+        checkpoint_path=args.checkpoint,
+        resume=args.resume,
+        dry_run=args.dry_run,
+    )
+    print(f"Done: {checkpoint['time_frames']} time frames, {checkpoint['moved']} tasks moved")
+    for failed in checkpoint["failed"]:
+        print(f"Could not place the tasks of {failed['time_frame_id']}: {failed['error']}")
+
+
+if __name__ == "__main__":
+    main()
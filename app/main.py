@@ -1,21 +1,48 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI, HTTPException, Request
 from fastapi.exception_handlers import http_exception_handler
 from fastapi.exceptions import RequestValidationError
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse
-from pymongo import MongoClient
 from datetime import datetime, timezone
 
+from .database.indexes import ensure_indexes_at_startup
+from .database.mongodb import create_async_client
+from .database.monitoring import command_counter, pool_monitor
+from .utils.events import event_hub
+from .utils.reschedule_coalescer import reschedule_coalescer
+from .utils.reschedule_jobs import reschedule_jobs
+from .utils.time_frame_cache import time_frame_cache
+from .settings import get_settings
+
 # Routers
 from .routes.user import router as user_v1
 from .routes.time_frame import router as time_frame_v1
 from .routes.task import router as task_v1
 from .routes.feedback import router as feedback_v1
 
+# The client is made when the server starts and not when the app is imported, so importing it needs no database.
+# The routes get the database through the get_database dependency. The missing indexes are created before the
+# first request, so the routes never scan a whole collection
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    settings = get_settings()
+    missing = settings.missing()
+    if missing:
+        raise RuntimeError(f"Missing settings in the environment or .env: {', '.join(missing)}")
+    app.state.mongo_client = create_async_client(settings)
+    app.state.database = app.state.mongo_client.db
+    await ensure_indexes_at_startup(app.state.database)
+    try:
+        yield
+    finally:
+        await app.state.mongo_client.close()
+
 app = FastAPI(
     title="🦏 Rhino Service",
     description="Handles all interactions from frontend", # update description if relevant
-    version="0.0.1"
+    version="0.0.1",
+    lifespan=lifespan
 )
 
 # Used for CORS
@@ -35,6 +62,18 @@ app.add_middleware(
     allow_headers = ["*"]
 )
 
+# Count the database commands each request sends, and return the count in a header so it is easy to check
+@app.middleware("http")
+async def count_database_commands(request: Request, call_next):
+    request_commands = command_counter.start_request()
+    response = await call_next(request)
+    # The router has put the matched route in the scope by now, so requests are grouped by route and not by url
+    route = request.scope.get("route")
+    endpoint = f"{request.method} {route.path if route else request.url.path}"
+    command_counter.finish_request(endpoint, request_commands)
+    response.headers["X-DB-Commands"] = str(request_commands.count)
+    return response
+
 # Had some issues with the errors from not being properly printed in backend, causing issues with troubleshooting. Found this exception handler. Since it is located in the main it handles all incoming excepts of type 422.
 @app.exception_handler(RequestValidationError)
 async def validation_exception_handler(request: Request, exc: RequestValidationError):
@@ -70,10 +109,28 @@ async def root():
 
 # Test the connection to the database
 @app.get("/test-connection", tags=["Test Connection"])
-async def test_connection():
+async def test_connection(request: Request):
     try:
-        client = MongoClient()  # Create a MongoClient instance
-        client.server_info()  # Test the connection
+        await request.app.state.mongo_client.admin.command("ping")  # Test the connection without blocking the other requests
         return {"message": "Connection successful"}
     except Exception as e:
-        return {"message": f"Connection failed: {str(e)}"}
\ No newline at end of file
+        return {"message": f"Connection failed: {str(e)}"}
+
+# Counters for the in-process caches, the merged reschedules, the database commands and the connection pool, useful for checking they are sized correctly
+# and that an endpoint does not make more round trips than it should
+@app.get("/metrics", tags=["Metrics"])
+async def metrics(request: Request):
+    pool_options = request.app.state.mongo_client.options.pool_options
+    return {
+        "time_frame_cache": time_frame_cache.stats(),
+        "reschedules": reschedule_coalescer.stats(),
+        "reschedule_jobs": reschedule_jobs.stats(),
+        "events": event_hub.stats(),
+        "database": command_counter.stats(),
+        # Connections in use close to max_pool_size along with growing waits means requests queue up for connections
+        "connection_pool": {
+            "max_pool_size": pool_options.max_pool_size,
+            "min_pool_size": pool_options.min_pool_size,
+            "servers": pool_monitor.stats()
+        }
+    }
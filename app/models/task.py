@@ -1,5 +1,5 @@
 from pydantic import BaseModel, Field
-from typing import Optional
+from typing import List, Optional
 from datetime import datetime
 from uuid import UUID, uuid4
 from enum import Enum
@@ -19,6 +19,7 @@ class Task(BaseModel):
     time_frame_id: UUID = Field(..., description="ID for the time_frame the task belongs to")
     title: str = Field(..., description="The title of the task")
     priority: int = Field(..., description="The priority of the task that needs to be completed")
+    rank: Optional[float] = Field(default=None, description="Sort key of the task, the priority is its position when the tasks are sorted by rank")
     self_estimated_duration: float = Field(..., description="How long the user estimates the task to take")
     tracked_duration: Optional[float] = Field(..., description="The actual duration of the task")
     start: datetime = Field(..., description="The expected start of the task")
@@ -26,6 +27,7 @@ class Task(BaseModel):
     category: TaskCategory = Field(..., description="The category type of the task")
     description: Optional[str] = "" # Should we do None or empty string?
     completed: bool = Field(default=False, description="Check if task has been completed")
+    finished: Optional[datetime] = Field(default=None, description="When the task was marked as completed")
 
 class UpdateTask(BaseModel):
     title: Optional[str] = None
@@ -43,4 +45,8 @@ class CreateTask(BaseModel):
     self_estimated_duration: float
     start: datetime
     category: TaskCategory
-    description: Optional[str] = None
\ No newline at end of file
+    description: Optional[str] = None
+
+
+class ReorderTasks(BaseModel):
+    task_ids: List[UUID] = Field(..., description="Every task in the time frame, in the new order")
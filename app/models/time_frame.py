@@ -40,6 +40,7 @@ class TimeFrame(BaseModel):
     work_time_frame_intervals: list[WorkTimeIntervals] = Field(default=[], description="The work time during the day, where to user would prefer to work")
     include_weekend: bool = Field(default=False, description="Allow the user to decide if they want to include weekends in their schedule")
     created_at: datetime = Field(..., description="To track when time frames are created")
+    schedule_version: int = Field(default=0, description="Bumped every time a background reschedule of the tasks is done, so the frontend knows when the schedule has settled")
 
 # Should we allow for updates in work_time_frame_intervals? Could imagine it could get quite complex
 class UpdateTimeFrame(BaseModel):
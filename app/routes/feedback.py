@@ -1,50 +1,58 @@
-from typing import Annotated, List, Union
-from fastapi import APIRouter, Depends
-from ..database.mongodb import database
+from typing import Annotated, Optional
+from fastapi import APIRouter, Depends, Query, Response
+from ..database.mongodb import database_dependency
 from app.controllers.feedback import FeedbackList
 from app.models.feedback import CreateFeedback, CreatePromptFeedback, Feedback, PromptFeedback
 from app.utils.auth import get_current_user
-
-# Setup collection
-collection = database.feedback
+from app.utils.pagination import MAX_PAGE_SIZE, ndjson_response
 
 # Router
 router = APIRouter(prefix="/feedback", tags=["feedback"])
 
-# Controllers
-list_routes = FeedbackList(collection)
+# Controllers, made for each request from the database of the client the server started with
+async def get_list_routes(database: database_dependency) -> FeedbackList:
+    return FeedbackList(database.feedback)
 
 # Dependencies
 user_dependency = Annotated[dict, Depends(get_current_user)]
+list_dependency = Annotated[FeedbackList, Depends(get_list_routes)]
 
 @router.post("/prompt", response_model=PromptFeedback, status_code=201)
-def create_prompt(params: CreatePromptFeedback, current_user: user_dependency):
+async def create_prompt(params: CreatePromptFeedback, current_user: user_dependency, list_routes: list_dependency):
     prompt_feedback = PromptFeedback(
         user_id=current_user["_id"],
         prompt=params.prompt,
         feedback=params.feedback
     )
-    return list_routes.create_prompt(prompt_feedback)
+    return await list_routes.create_prompt(prompt_feedback)
 
 
 @router.post("/feedback", response_model=Feedback, status_code=201)
-def create_feedback(params: CreateFeedback, current_user: user_dependency):
+async def create_feedback(params: CreateFeedback, current_user: user_dependency, list_routes: list_dependency):
     feedback = Feedback(
         user_id=current_user["_id"],
         feedback_category=params.feedback_category,
         context=params.context,
         feedback=params.feedback
     )
-    return list_routes.create_feedback(feedback)
+    return await list_routes.create_feedback(feedback)
+
+# The categories and prompts are enums, they only change with a new release, so the browser can keep them for a day
+enum_cache_control = "private, max-age=86400"
 
 @router.get("/feedback")
-def get_category(current_user: user_dependency):
+def get_category(current_user: user_dependency, response: Response, list_routes: list_dependency):
+    response.headers["Cache-Control"] = enum_cache_control
     return list_routes.get_categories()
 
 @router.get("/prompt")
-def get_prompt(current_user: user_dependency):
+def get_prompt(current_user: user_dependency, response: Response, list_routes: list_dependency):
+    response.headers["Cache-Control"] = enum_cache_control
     return list_routes.get_prompts()
 
-@router.get("/user", response_model=List[Union[Feedback, PromptFeedback]])
-def get_by_user(current_user: user_dependency):
-    return list_routes.list_by_user(current_user["_id"])
\ No newline at end of file
+# No response_model here, as the feedback is returned as stored and can be limited to some of the fields
+@router.get("/user")
+async def get_by_user(current_user: user_dependency, list_routes: list_dependency, fields: Optional[str] = Query(None, description="Comma separated list of the fields to return"), limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE, description="Return a page of this many instead of everything"), cursor: Optional[str] = Query(None, description="next_cursor of the previous page"), stream: bool = Query(False, description="Stream every document as NDJSON")):
+    if stream:
+        return ndjson_response(list_routes.stream_by_user(current_user["_id"], fields))
+    return await list_routes.list_by_user(current_user["_id"], fields, limit, cursor)
\ No newline at end of file
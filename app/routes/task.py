@@ -1,39 +1,32 @@
-from fastapi import APIRouter, Depends, HTTPException, status, Query
-from typing import Annotated
+from fastapi import APIRouter, Depends, HTTPException, status, Query, Request, Response
+from fastapi.responses import StreamingResponse
+from typing import Annotated, List, Optional
+from uuid import UUID
 from datetime import timedelta
 
-from ..models.task import Task, UpdateTask, CreateTask
-from ..database.mongodb import database
+from ..models.task import Task, UpdateTask, CreateTask, ReorderTasks
+from ..database.mongodb import database_dependency
 from ..controllers.task import TaskList
 from ..controllers.user import UserList
+from ..utils.events import event_hub
+from ..utils.pagination import MAX_PAGE_SIZE, ndjson_response
 from ..utils.auth import get_current_user
-
-# Setup collection
-collection = database.task
-time_frame_collection = database.time_frame
-user_collection = database.user
+from ..utils.versions import conditional_response, resource_versions
 
 # Router
 router = APIRouter(prefix="/task", tags=["task"])
 
-# Controllers
-list_routes = TaskList(collection, time_frame_collection, user_collection)
+# Controllers, made for each request from the database of the client the server started with
+async def get_list_routes(database: database_dependency) -> TaskList:
+    return TaskList(database.task, database.time_frame, database.user)
 
 # Dependencies
 user_dependency = Annotated[dict, Depends(get_current_user)]
+list_dependency = Annotated[TaskList, Depends(get_list_routes)]
 
-@router.post("/time-frame/{time_frame_id}", status_code=201)
-async def create_task(time_frame_id: str, params: CreateTask, current_user: user_dependency, confirm: bool = Query(False)):
-    user = UserList(user_collection)
-    suggest = user.suggestion_estimation(current_user["_id"], params.category, params.self_estimated_duration, confirm)
-    
-    if suggest is not None:
-        raise HTTPException(
-            status_code=status.HTTP_409_CONFLICT,
-            detail=suggest
-        )
-    
-    task = Task(
+# The task that is stored from what the user sends when creating a task
+def build_task(time_frame_id: str, params: CreateTask) -> Task:
+    return Task(
         time_frame_id=time_frame_id,
         title=params.title,
         priority=params.priority,
@@ -45,20 +38,93 @@ async def create_task(time_frame_id: str, params: CreateTask, current_user: user
         description=params.description or ""
     )
 
-    return list_routes.create_task(task)
+@router.post("/time-frame/{time_frame_id}", status_code=201)
+async def create_task(time_frame_id: str, params: CreateTask, current_user: user_dependency, list_routes: list_dependency, confirm: bool = Query(False)):
+    user = UserList(list_routes.user_collection)
+    suggest = await user.suggestion_estimation(current_user["_id"], params.category, params.self_estimated_duration, confirm)
+    
+    if suggest is not None:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail=suggest
+        )
+    
+    return await list_routes.create_task(build_task(time_frame_id, params))
+
+@router.post("/time-frame/{time_frame_id}/batch", status_code=201, description="Create a list of tasks at once")
+async def create_tasks(time_frame_id: str, params: List[CreateTask], current_user: user_dependency, list_routes: list_dependency, confirm: bool = Query(False)):
+    if not params:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="No tasks to create"
+        )
+    try:
+        time_frame_uuid = UUID(time_frame_id)
+    except ValueError:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid time frame id format"
+        )
+
+    # The users estimation stats are read once for the whole list, and the suggestions are returned per task
+    user = UserList(list_routes.user_collection)
+    suggestions = await user.suggestion_estimations(
+        current_user["_id"],
+        [(item.category, item.self_estimated_duration) for item in params],
+        confirm
+    )
+    if any(suggest is not None for suggest in suggestions):
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail=suggestions
+        )
+
+    return await list_routes.create_tasks(time_frame_uuid, [build_task(time_frame_id, item) for item in params])
 
 @router.get("/time-frame/{time_frame_id}/find_all", description="Find all tasks for time frame")
-async def find_all_time_frame_tasks(time_frame_id: str, current_user: user_dependency):
-    return list_routes.find_all_time_frame_tasks(time_frame_id)
+async def find_all_time_frame_tasks(request: Request, response: Response, time_frame_id: str, current_user: user_dependency, list_routes: list_dependency, fields: Optional[str] = Query(None, description="Comma separated list of the fields to return"), limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE, description="Return a page of this many instead of everything"), cursor: Optional[str] = Query(None, description="next_cursor of the previous page"), stream: bool = Query(False, description="Stream every document as NDJSON")):
+    if stream:
+        return ndjson_response(list_routes.stream_time_frame_tasks(time_frame_id, fields))
+    # The planner polls this, so the tasks are only read again if they have changed since the ETag it has
+    etag = resource_versions.etag(("tasks", time_frame_id), variant=str(request.query_params))
+    cached = conditional_response(request, response, etag)
+    if cached is not None:
+        return cached
+    return await list_routes.find_all_time_frame_tasks(time_frame_id, fields, limit, cursor)
+
+@router.get("/time-frame/{time_frame_id}/events", description="Stream the changes to the tasks of the time frame as server-sent events")
+async def time_frame_events(time_frame_id: str, request: Request, current_user: user_dependency, list_routes: list_dependency):
+    subscriber = await list_routes.subscribe_events(time_frame_id)
+    return StreamingResponse(
+        event_hub.stream(request, subscriber),
+        media_type="text/event-stream",
+        # Proxies should pass the events on straight away instead of buffering them
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@router.put("/time-frame/{time_frame_id}/reorder", description="Apply a new order to all tasks in a time frame")
+async def reorder_tasks(time_frame_id: str, params: ReorderTasks, current_user: user_dependency, list_routes: list_dependency):
+    try:
+        time_frame_uuid = UUID(time_frame_id)
+    except ValueError:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid time frame id format"
+        )
+    return await list_routes.reorder_tasks(time_frame_uuid, params.task_ids)
+
+@router.get("/jobs/{job_id}", description="Find the state of a background reschedule and the tasks it moved")
+async def find_job(job_id: str, current_user: user_dependency, list_routes: list_dependency):
+    return list_routes.find_job(job_id)
 
 @router.get("/{task_id}", description="Find specific task")
-async def find_specific_task(task_id: str, current_user: user_dependency):
-    return list_routes.find_specific_task(task_id)
+async def find_specific_task(task_id: str, current_user: user_dependency, list_routes: list_dependency):
+    return await list_routes.find_specific_task(task_id)
 
 @router.put("/{task_id}", description="Update a task")
-async def update_task(task_id: str, task: UpdateTask, current_user: user_dependency):
-    return list_routes.update_task(task_id, task)
+async def update_task(task_id: str, task: UpdateTask, current_user: user_dependency, list_routes: list_dependency, background: bool = Query(False, description="Reschedule the tasks after this one in a background job")):
+    return await list_routes.update_task(task_id, task, background)
 
 @router.delete("/{task_id}", description="Delete the task")
-async def delete_task(task_id: str, current_user: user_dependency):
-    return list_routes.delete_task(task_id)
+async def delete_task(task_id: str, current_user: user_dependency, list_routes: list_dependency, background: bool = Query(False, description="Reschedule the tasks after this one in a background job")):
+    return await list_routes.delete_task(task_id, background)
@@ -1,26 +1,27 @@
-from fastapi import APIRouter, Depends
-from typing import Annotated
+from fastapi import APIRouter, Depends, Query, Request, Response
+from typing import Annotated, Optional
 from datetime import datetime, timezone
 
 from ..models.time_frame import TimeFrame, UpdateTimeFrame, CreateTimeFrame
-from ..database.mongodb import database
+from ..database.mongodb import database_dependency
 from ..controllers.time_frame import TimeFrameList
+from ..utils.pagination import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, ndjson_response
 from ..utils.auth import get_current_user
-
-# Setup collection
-collection = database.time_frame
+from ..utils.versions import conditional_response, resource_versions
 
 # Router
 router = APIRouter(prefix="/time_frame", tags=["time_frame"])
 
-# Controllers
-list_routes = TimeFrameList(collection)
+# Controllers, made for each request from the database of the client the server started with
+async def get_list_routes(database: database_dependency) -> TimeFrameList:
+    return TimeFrameList(database.time_frame)
 
 # Dependencies
 user_dependency = Annotated[dict, Depends(get_current_user)]
+list_dependency = Annotated[TimeFrameList, Depends(get_list_routes)]
 
 @router.post("", status_code=201)
-async def create_time_frame(params: CreateTimeFrame, current_user: user_dependency):
+async def create_time_frame(params: CreateTimeFrame, current_user: user_dependency, list_routes: list_dependency):
     # Converting the request to an instance of time_frame. Using this approach instead of model_dump to ensure user_id is included
     time_frame = TimeFrame(
         user_id = current_user["_id"],
@@ -30,29 +31,40 @@ async def create_time_frame(params: CreateTimeFrame, current_user: user_dependen
         include_weekend=params.include_weekend,
         created_at=datetime.now(timezone.utc)
     )                 
-    return list_routes.create_time_frame(time_frame)
+    return await list_routes.create_time_frame(time_frame)
 
 # Consider if it should be protected?
-@router.get("/all_time_frames", description="Find all time frames in database")
-async def get_all_time_frames():
-    return list_routes.get_all_time_frames()
+@router.get("/all_time_frames", description="Find all time frames in database a page at a time, or stream them all as NDJSON")
+async def get_all_time_frames(list_routes: list_dependency, limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE), cursor: Optional[str] = Query(None, description="next_cursor of the previous page"), stream: bool = Query(False, description="Stream every document as NDJSON instead of a page")):
+    if stream:
+        return ndjson_response(list_routes.stream_all_time_frames())
+    return await list_routes.get_all_time_frames(limit, cursor)
 
 @router.get("/", description="Find a specific time frame based on a given time frame id")
-async def get_single_time_frame(time_frame_id: str, current_user: user_dependency):
-    return list_routes.get_single_time_frame(time_frame_id)
+async def get_single_time_frame(time_frame_id: str, current_user: user_dependency, list_routes: list_dependency):
+    return await list_routes.get_single_time_frame(time_frame_id)
 
 @router.get("/all_user_time_frames", description="Find all time frames from a specific user")
-async def get_all_user_specific_time_frames(current_user: user_dependency):
-    return list_routes.get_all_user_specific_time_frames(current_user["_id"])
+async def get_all_user_specific_time_frames(current_user: user_dependency, list_routes: list_dependency, fields: Optional[str] = Query(None, description="Comma separated list of the fields to return")):
+    return await list_routes.get_all_user_specific_time_frames(current_user["_id"], fields)
 
 @router.get("/find_active_time_frame", description="Find the current active time frame belonging to the user")
-async def get_active_time_frame(current_user: user_dependency):
-    return list_routes.get_active_time_frame(current_user["_id"])
+async def get_active_time_frame(request: Request, response: Response, current_user: user_dependency, list_routes: list_dependency):
+    # Which time frame is active also depends on the day, so that is part of the ETag as well
+    etag = resource_versions.etag(("time_frames", current_user["_id"]), ("time_frames", None), variant=datetime.today().date().isoformat())
+    cached = conditional_response(request, response, etag)
+    if cached is not None:
+        return cached
+    return await list_routes.get_active_time_frame(current_user["_id"])
+
+@router.get("/{time_frame_id}/capacity", description="Find how many work hours are left in a time frame and when a given amount of work would be done")
+async def get_capacity(time_frame_id: str, current_user: user_dependency, list_routes: list_dependency, after: Optional[datetime] = None, hours: Optional[float] = Query(None, gt=0)):
+    return await list_routes.get_capacity(time_frame_id, after, hours)
 
 @router.put("/{time_frame_id}", description="Update a specific time_frame")
-async def update_time_frame(time_frame_id: str, time_frame: UpdateTimeFrame, current_user: user_dependency):
-    return list_routes.update_time_frame(time_frame_id, time_frame)
+async def update_time_frame(time_frame_id: str, time_frame: UpdateTimeFrame, current_user: user_dependency, list_routes: list_dependency):
+    return await list_routes.update_time_frame(time_frame_id, time_frame)
 
 @router.delete("/{id}")
-async def delete_time_frame(time_frame_id: str, current_user: user_dependency):
-    return list_routes.delete_time_frame(time_frame_id)
\ No newline at end of file
+async def delete_time_frame(time_frame_id: str, current_user: user_dependency, list_routes: list_dependency):
+    return await list_routes.delete_time_frame(time_frame_id)
\ No newline at end of file
@@ -1,42 +1,44 @@
-from fastapi import APIRouter, Depends, HTTPException, status, Response
-from typing import Annotated
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, status, Response
+from typing import Annotated, Optional
 from datetime import timedelta
 from fastapi.security import OAuth2PasswordRequestForm
-from dotenv import load_dotenv
-import os
 
 from ..models.user import User, UserUpdate, CreateUserRequest
-from ..database.mongodb import database as db
+from ..database.mongodb import database_dependency
 from ..controllers.user import UserList
+from ..settings import get_settings
+from ..utils.pagination import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, ndjson_response
+from ..utils.versions import conditional_response, resource_versions
 import app.utils.auth as auth
 
-load_dotenv()
-ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES"))
-REFRESH_TOKEN_EXPIRE_DAYS = int(os.getenv("REFRESH_TOKEN_EXPIRE_DAYS"))
-
-# Setup collection
-collection = db.user
-
 # Router
 router = APIRouter(prefix="/user", tags=["user"])
 
-# Controllers
-list_routes = UserList(collection)
+# Controllers, made for each request from the database of the client the server started with
+async def get_list_routes(database: database_dependency) -> UserList:
+    return UserList(database.user)
 
 # Dependencies
 user_dependency = Annotated[dict, Depends(auth.get_current_user)]
+list_dependency = Annotated[UserList, Depends(get_list_routes)]
 
-@router.get("/all_users", description="Find all users")
-async def get_all_users():
-    return list_routes.get_all_users()
+@router.get("/all_users", description="Find all users a page at a time, or stream them all as NDJSON")
+async def get_all_users(list_routes: list_dependency, limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE), cursor: Optional[str] = Query(None, description="next_cursor of the previous page"), stream: bool = Query(False, description="Stream every document as NDJSON instead of a page")):
+    if stream:
+        return ndjson_response(list_routes.stream_all_users())
+    return await list_routes.get_all_users(limit, cursor)
 
 @router.get("", description="Find specific user with their id")
-async def get_user(current_user: user_dependency):
+async def get_user(request: Request, response: Response, current_user: user_dependency, list_routes: list_dependency, fields: Optional[str] = Query(None, description="Comma separated list of the fields to return")):
     user_id = current_user["_id"]
-    return list_routes.get_user(user_id)
+    etag = resource_versions.etag(("user", user_id), variant=str(request.query_params))
+    cached = conditional_response(request, response, etag)
+    if cached is not None:
+        return cached
+    return await list_routes.get_user(user_id, fields)
 
 @router.post("", status_code=201, description="Create a new user")
-async def create_user(params: CreateUserRequest):
+async def create_user(params: CreateUserRequest, list_routes: list_dependency):
     try:
     # Convert user request into an instance of user
         user = User(**params.model_dump())
@@ -45,20 +47,21 @@ async def create_user(params: CreateUserRequest):
             status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
             detail="Password must be at least 8 characters"
         )
-    return list_routes.create_user(user)
+    return await list_routes.create_user(user)
 
 @router.post("/login", response_model=auth.Token)
-async def login_for_access_token(form_data: Annotated[OAuth2PasswordRequestForm, Depends()], response: Response):
+async def login_for_access_token(form_data: Annotated[OAuth2PasswordRequestForm, Depends()], response: Response, list_routes: list_dependency):
     # Ensure user exists in database
-    user = list_routes.authenticate_user(username=form_data.username, password=form_data.password)
+    user = await list_routes.authenticate_user(username=form_data.username, password=form_data.password)
     if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Could not validate user"
         )
     # Create the tokens based on the logic from the auth-file
-    access_token = auth.create_access_token(user.username, user.user_id, timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES))
-    refresh_token = auth.create_refresh_token(user.username, user.user_id, timedelta(days=REFRESH_TOKEN_EXPIRE_DAYS))
+    settings = get_settings()
+    access_token = auth.create_access_token(user.username, user.user_id, timedelta(minutes=settings.access_token_expire_minutes))
+    refresh_token = auth.create_refresh_token(user.username, user.user_id, timedelta(days=settings.refresh_token_expire_days))
     # response = JSONResponse(
     #     content={"access_token": access_token, "token_type": "bearer"}
     # )
@@ -82,14 +85,14 @@ async def logout_for_access_token(dependencies: user_dependency, response: Respo
 
 
 @router.put("", description="Update user information")
-async def update_user(user: UserUpdate, current_user: user_dependency):
+async def update_user(user: UserUpdate, current_user: user_dependency, list_routes: list_dependency):
     user_id = current_user["_id"]
-    return list_routes.update_user(user_id, user)
+    return await list_routes.update_user(user_id, user)
 
 @router.delete("", description="Permantly delete a user - approach with caution")
-async def delete_user(current_user: user_dependency):
+async def delete_user(current_user: user_dependency, list_routes: list_dependency):
     user_id = current_user["_id"]
-    return list_routes.delete_user(user_id)
+    return await list_routes.delete_user(user_id)
 
 # This endpoint is only used on routes in frontend that we do not have a backend point to
 @router.post("/protected")
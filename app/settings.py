@@ -0,0 +1,97 @@
+import os
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import List, Optional
+
+from dotenv import load_dotenv
+
+# Everything the server reads from the environment, parsed once the first time it is needed. Importing the app does
+# not read .env or connect to anything, so the modules can be imported (and the executable starts) without a database,
+# the connection is only made when the server starts in the lifespan in main.py.
+
+def env_int(name: str, default: Optional[int] = None) -> Optional[int]:
+    value = os.getenv(name)
+    return int(value) if value else default
+
+def env_bool(name: str, default: bool) -> bool:
+    value = os.getenv(name)
+    return value.lower() == "true" if value else default
+
+def env_write_concern(value: Optional[str]):
+    # w is either a number of nodes or a name like majority
+    if value is None or value == "":
+        return None
+    return int(value) if value.isdigit() else value
+
+
+@dataclass(frozen=True)
+class Settings:
+    # Connection and auth, see the README for the rest
+    db_uri: Optional[str]
+    secret_key: Optional[str]
+    algorithm: Optional[str]
+    access_token_expire_minutes: Optional[int]
+    refresh_token_expire_days: Optional[int]
+    # Connection pool, timeouts, compression and concerns, None is left to the driver
+    db_max_pool_size: Optional[int]
+    db_min_pool_size: int
+    db_connect_timeout_ms: Optional[int]
+    db_socket_timeout_ms: Optional[int]
+    db_server_selection_timeout_ms: int
+    db_compressors: Optional[str]
+    db_read_concern: Optional[str]
+    db_write_concern: Optional[object]
+    db_transactions: bool
+    db_ensure_indexes: bool
+    # The in-process helpers
+    reschedule_coalesce_ms: float
+    reschedule_workers: int
+    time_frame_cache_max_entries: int
+    time_frame_cache_max_bytes: int
+
+    @classmethod
+    def from_env(cls) -> "Settings":
+        return cls(
+            db_uri=os.getenv("DB_URI"),
+            secret_key=os.getenv("SECRET_KEY"),
+            algorithm=os.getenv("ALGORITHM"),
+            access_token_expire_minutes=env_int("ACCESS_TOKEN_EXPIRE_MINUTES"),
+            refresh_token_expire_days=env_int("REFRESH_TOKEN_EXPIRE_DAYS"),
+            db_max_pool_size=env_int("DB_MAX_POOL_SIZE"),
+            db_min_pool_size=env_int("DB_MIN_POOL_SIZE", 0),
+            db_connect_timeout_ms=env_int("DB_CONNECT_TIMEOUT_MS"),
+            db_socket_timeout_ms=env_int("DB_SOCKET_TIMEOUT_MS"),
+            # The driver waits 30 seconds for a server, so when Atlas is unreachable every request would hang that
+            # long before failing, 5 seconds is plenty for a healthy cluster
+            db_server_selection_timeout_ms=env_int("DB_SERVER_SELECTION_TIMEOUT_MS", 5000),
+            db_compressors=os.getenv("DB_COMPRESSORS") or None,
+            db_read_concern=os.getenv("DB_READ_CONCERN") or None,
+            db_write_concern=env_write_concern(os.getenv("DB_WRITE_CONCERN")),
+            db_transactions=env_bool("DB_TRANSACTIONS", False),
+            db_ensure_indexes=env_bool("DB_ENSURE_INDEXES", True),
+            reschedule_coalesce_ms=float(os.getenv("RESCHEDULE_COALESCE_MS", "5")),
+            reschedule_workers=int(os.getenv("RESCHEDULE_WORKERS", "2")),
+            time_frame_cache_max_entries=int(os.getenv("TIME_FRAME_CACHE_MAX_ENTRIES", "256")),
+            time_frame_cache_max_bytes=int(os.getenv("TIME_FRAME_CACHE_MAX_BYTES", str(64 * 1024 * 1024))),
+        )
+
+    def missing(self) -> List[str]:
+        """
+            The variables the server cannot run without that are not set. Checked when the server starts, so a
+            missing one fails the start instead of the first login.
+        """
+        required = {
+            "DB_URI": self.db_uri,
+            "SECRET_KEY": self.secret_key,
+            "ALGORITHM": self.algorithm,
+            "ACCESS_TOKEN_EXPIRE_MINUTES": self.access_token_expire_minutes,
+            "REFRESH_TOKEN_EXPIRE_DAYS": self.refresh_token_expire_days,
+        }
+        return [name for name, value in required.items() if value is None]
+
+
+@lru_cache(maxsize=None)
+def get_settings() -> Settings:
+    # Loading the variables from the .env file, only the first call reads it
+    load_dotenv()
+    return Settings.from_env()
@@ -4,9 +4,8 @@ from typing import Annotated, Optional
 from jose import jwt, JWTError
 from fastapi import Cookie, Depends, HTTPException, Response, status
 from pydantic import BaseModel
-from dotenv import load_dotenv
-import os
 
+from ..settings import get_settings
 from ..utils.oauth_cookies import OAuth2PasswordBearerWithCookie
 
 # Based on fastapi document for oauth:
@@ -14,10 +13,7 @@ from ..utils.oauth_cookies import OAuth2PasswordBearerWithCookie
 # And on Eric Robys video:
 # https://www.youtube.com/watch?v=0A_GCXBCNUQ&t=14s
 
-load_dotenv()
-SECRET_KEY = os.getenv("SECRET_KEY")
-ALGORITHM = os.getenv("ALGORITHM")
-ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES"))
+# SECRET_KEY, ALGORITHM and ACCESS_TOKEN_EXPIRE_MINUTES are read from the settings when a token is made or checked
 
 # FIX: the prefix should not be hard-coded in here, should come from main
 oauth2_scheme = OAuth2PasswordBearerWithCookie(tokenUrl="/v1/user/login")
@@ -29,30 +25,33 @@ class Token(BaseModel):
 
 # Setup and encoding of tokens
 def create_access_token(username: str, user_id: str, expires_delta: timedelta):
+    settings = get_settings()
     # This is were the payload is created
     encode = {"sub": username, "_id": str(user_id)}
     # Ensure that payload also contains an expiration
     expires = datetime.now(timezone.utc) + expires_delta
     encode.update({"exp": expires})
     # Encode it to contain the signature
-    encoded_jwt = jwt.encode(encode, SECRET_KEY, algorithm=ALGORITHM)
+    encoded_jwt = jwt.encode(encode, settings.secret_key, algorithm=settings.algorithm)
     return encoded_jwt
 
 # Refresh token is based on this article: 
 # https://gh0stfrk.medium.com/token-based-authentication-with-fastapi-7d6a22a127bf
 # It is created when the user logs in
 def create_refresh_token(username: str, user_id: str, expires_delta: timedelta):
+    settings = get_settings()
     payload = {
         "sub": username, 
         "_id": str(user_id)
     }
     expires = datetime.now(timezone.utc) + expires_delta
     payload.update({"exp": expires})
-    refresh_jwt = jwt.encode(payload, SECRET_KEY, algorithm=ALGORITHM)
+    refresh_jwt = jwt.encode(payload, settings.secret_key, algorithm=settings.algorithm)
     return refresh_jwt
 
 # Used for checking if the refresh token is valid and then create new access token
 def refresh_for_new_access_token(refresh_token: str):
+    settings = get_settings()
     # We are currently not using blacklist
     # if refresh_token in blacklist:
     #     raise HTTPException(
@@ -68,7 +67,7 @@ def refresh_for_new_access_token(refresh_token: str):
         )
     try:
         # Decode signature to ensure it contains the username and id.
-        payload = jwt.decode(refresh_token, SECRET_KEY, algorithms=[ALGORITHM])
+        payload = jwt.decode(refresh_token, settings.secret_key, algorithms=[settings.algorithm])
         username = payload.get("sub")
         user_id = payload.get("_id")
         if username is None or user_id is None:
@@ -77,7 +76,7 @@ def refresh_for_new_access_token(refresh_token: str):
                 detail="Invalid refresh token"
             )
         
-        new_access_token = create_access_token(username, user_id, timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES))
+        new_access_token = create_access_token(username, user_id, timedelta(minutes=settings.access_token_expire_minutes))
         return {
             "access_token": new_access_token,
             "token_type": "bearer"
@@ -98,6 +97,7 @@ blacklist = set()
 
 # This is used as our dependency for ensuring protected routes
 async def get_current_user(token: Annotated[str, Depends(oauth2_scheme)]):
+    settings = get_settings()
     # currently not using blacklist
     # if token in blacklist:
     #     raise HTTPException(
@@ -107,7 +107,7 @@ async def get_current_user(token: Annotated[str, Depends(oauth2_scheme)]):
     try:
         # TODO: This is used several places, maybe we should create a function to follow DRY?
         # Or maybe it does not make sense?
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        payload = jwt.decode(token, settings.secret_key, algorithms=[settings.algorithm])
         username: str = payload.get("sub")
         user_id: str = payload.get("_id")
         if username is None or user_id is None:
@@ -124,7 +124,8 @@ async def get_current_user(token: Annotated[str, Depends(oauth2_scheme)]):
 
 # Helper function to check is token is expired
 def decode_for_exp(token: str) -> dict:
-    payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+    settings = get_settings()
+    payload = jwt.decode(token, settings.secret_key, algorithms=[settings.algorithm])
     exp = int(payload.get("exp"))
     if exp < datetime.now(timezone.utc).timestamp():
         raise JWTError("Token expired")
@@ -140,6 +141,7 @@ async def get_current_user_with_refresh(
     access_token: Optional[str] = Cookie(None),
     refresh_token: Optional[str] = Cookie(None)
 ):
+    settings = get_settings()
     if not access_token or not refresh_token:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -162,7 +164,7 @@ async def get_current_user_with_refresh(
                 secure=False, 
                 samesite="lax",
             )
-            payload = jwt.decode(new_access_token, SECRET_KEY, algorithms=[ALGORITHM])
+            payload = jwt.decode(new_access_token, settings.secret_key, algorithms=[settings.algorithm])
             return {"username": payload.get("sub"), "_id": payload.get("_id")}
         except Exception or JWTError:
             raise HTTPException(
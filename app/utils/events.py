@@ -0,0 +1,129 @@
+import asyncio
+import json
+from threading import Lock
+from typing import AsyncIterator, Dict, Set
+
+from fastapi import Request
+from fastapi.encoders import jsonable_encoder
+
+from .versions import resource_key
+
+# Pushes the changes to the tasks of a time frame to the planners that have it open, so they do not have to poll
+# find_all to find out something was rescheduled. The task mutations publish the same changesets they respond with
+# to an in-process hub, which fans them out to every subscriber of the time frame as server-sent events. Nothing is
+# read from the database for it, and an event is only encoded once no matter how many subscribers there are.
+#
+# The mutations publish from the event loop, but publishing is also safe from other threads (like a sync route in the
+# threadpool), so every subscriber remembers its loop and the events are handed over with call_soon_threadsafe.
+
+# How many events a subscriber can be behind before it is told to fetch the tasks again instead
+MAX_QUEUED_EVENTS = 100
+# A comment is sent when nothing has happened for a while, so proxies do not close the connection
+KEEPALIVE_SECONDS = 15
+
+RESYNC = "event: resync\ndata: {}\n\n"
+
+
+def format_event(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(jsonable_encoder(data))}\n\n"
+
+
+class Subscriber:
+    __slots__ = ("key", "loop", "queue", "dropped")
+
+    def __init__(self, key: str, loop: asyncio.AbstractEventLoop):
+        self.key = key
+        self.loop = loop
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=MAX_QUEUED_EVENTS)
+        self.dropped = 0
+
+    # Runs in the event loop of the subscriber
+    def put(self, message: str) -> None:
+        if self.queue.full():
+            # The client is not keeping up, instead of it missing some of the changes it is told to fetch the tasks again
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.dropped += 1
+            message = RESYNC
+        self.queue.put_nowait(message)
+
+
+class EventHub:
+    """
+        Subscribers of each time frame along with the events published to them.
+    """
+    def __init__(self):
+        self.lock = Lock()
+        self.subscribers: Dict[str, Set[Subscriber]] = {}
+        self.published = 0
+        self.delivered = 0
+
+    def subscribe(self, time_frame_id) -> Subscriber:
+        """
+            Has to be called from the event loop the events are read in.
+        """
+        subscriber = Subscriber(resource_key(time_frame_id), asyncio.get_running_loop())
+        with self.lock:
+            self.subscribers.setdefault(subscriber.key, set()).add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber: Subscriber) -> None:
+        with self.lock:
+            subscribers = self.subscribers.get(subscriber.key)
+            if subscribers is not None:
+                subscribers.discard(subscriber)
+                if not subscribers:
+                    del self.subscribers[subscriber.key]
+
+    def publish(self, time_frame_id, event: str, data: dict) -> int:
+        """
+            Sends the event to every subscriber of the time frame, can be called from any thread.
+            Returns how many subscribers it was sent to.
+        """
+        with self.lock:
+            subscribers = list(self.subscribers.get(resource_key(time_frame_id), ()))
+            self.published += 1
+        # Nobody is listening, so there is no reason to encode it
+        if not subscribers:
+            return 0
+        message = format_event(event, data)
+        delivered = 0
+        for subscriber in subscribers:
+            try:
+                subscriber.loop.call_soon_threadsafe(subscriber.put, message)
+                delivered += 1
+            except RuntimeError:
+                # The loop of the subscriber is closed, so it will never read it
+                self.unsubscribe(subscriber)
+        with self.lock:
+            self.delivered += delivered
+        return delivered
+
+    async def stream(self, request: Request, subscriber: Subscriber) -> AsyncIterator[str]:
+        """
+            The events of the subscriber as a server-sent event stream, until the client goes away.
+        """
+        try:
+            # Tells EventSource how long to wait before connecting again
+            yield "retry: 3000\n\n"
+            while not await request.is_disconnected():
+                try:
+                    message = await asyncio.wait_for(subscriber.queue.get(), KEEPALIVE_SECONDS)
+                except asyncio.TimeoutError:
+                    yield ": keepalive\n\n"
+                    continue
+                yield message
+        finally:
+            self.unsubscribe(subscriber)
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                "time_frames": len(self.subscribers),
+                "subscribers": sum(len(subscribers) for subscribers in self.subscribers.values()),
+                "published": self.published,
+                "delivered": self.delivered,
+            }
+
+
+event_hub = EventHub()
@@ -0,0 +1,96 @@
+import base64
+import binascii
+import json
+from datetime import datetime
+from typing import AsyncIterable, AsyncIterator, List, Optional, Tuple
+from uuid import UUID
+
+from fastapi import HTTPException, status
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import StreamingResponse
+
+# Keyset pagination for the list endpoints. Instead of skipping documents, every page continues after the sort key
+# of the last document on the previous page, so each page is a single range scan no matter how deep we are. The
+# key is handed to the client as an opaque cursor (base64 of a small JSON object) to send back for the next page.
+#
+# For exports the lists can also be streamed as NDJSON straight from the cursor, one document per line, so the
+# whole collection never has to be held in memory.
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+# The values in the sort keys are UUIDs, datetimes and numbers, the first two are tagged so they can be decoded again
+def encode_value(value):
+    if isinstance(value, UUID):
+        return {"uuid": str(value)}
+    if isinstance(value, datetime):
+        return {"date": value.isoformat()}
+    return value
+
+def decode_value(value):
+    if isinstance(value, dict) and "uuid" in value:
+        return UUID(value["uuid"])
+    if isinstance(value, dict) and "date" in value:
+        return datetime.fromisoformat(value["date"])
+    return value
+
+def encode_cursor(values: List, position: int) -> str:
+    payload = json.dumps({"key": [encode_value(value) for value in values], "position": position})
+    return base64.urlsafe_b64encode(payload.encode()).decode()
+
+def decode_cursor(cursor: str, length: int) -> Tuple[List, int]:
+    """
+        The sort key and the number of documents before it from a cursor, 400 if it is not one of ours.
+    """
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        values = [decode_value(value) for value in payload["key"]]
+        position = int(payload["position"])
+    except (binascii.Error, ValueError, KeyError, TypeError):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid cursor"
+        )
+    if len(values) != length:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid cursor"
+        )
+    return values, position
+
+def after_key(sort_keys: List[str], values: List) -> dict:
+    """
+        Query for the documents sorting after the given values, e.g. (a > x) or (a == x and b > y).
+        MongoDB only compares values of the same type, so {"$gt": None} matches nothing. Null and missing values sort
+        first, so everything that is not null comes after them.
+    """
+    conditions = []
+    for index, key in enumerate(sort_keys):
+        condition = {sort_keys[before]: values[before] for before in range(index)}
+        condition[key] = {"$ne": None} if values[index] is None else {"$gt": values[index]}
+        conditions.append(condition)
+    return {"$or": conditions}
+
+async def keyset_page(collection, query: dict, sort_keys: List[str], limit: int, cursor: Optional[str], projection: Optional[dict] = None) -> Tuple[List[dict], Optional[str], int]:
+    """
+        One page of documents sorted by sort_keys, starting after the cursor.
+        Returns the documents, the cursor for the next page (None on the last page) and the number of documents before the page.
+    """
+    position = 0
+    if cursor is not None:
+        values, position = decode_cursor(cursor, len(sort_keys))
+        query = {"$and": [query, after_key(sort_keys, values)]}
+    # One extra document tells us if there is a next page without counting the collection
+    documents = await collection.find(query, projection).sort([(key, 1) for key in sort_keys]).limit(limit + 1).to_list()
+    next_cursor = None
+    if len(documents) > limit:
+        documents = documents[:limit]
+        next_cursor = encode_cursor([documents[-1].get(key) for key in sort_keys], position + limit)
+    return documents, next_cursor, position
+
+async def ndjson(documents: AsyncIterable[dict]) -> AsyncIterator[bytes]:
+    async for document in documents:
+        yield (json.dumps(jsonable_encoder(document)) + "\n").encode()
+
+def ndjson_response(documents: AsyncIterable[dict]) -> StreamingResponse:
+    return StreamingResponse(ndjson(documents), media_type="application/x-ndjson")
@@ -0,0 +1,55 @@
+from typing import List, Optional
+
+# Tasks are ordered by a rank with gaps between them instead of by contiguous priorities. Moving or inserting a task
+# only needs a rank between its two new neighbours, so only that one document is written, and deleting a task just
+# leaves a bigger gap. The 1..N priority shown in the API is the position of the task when sorted by rank.
+#
+# When a gap gets too small to split again (or a time frame still has tasks from before ranks existed) the ranks of
+# the whole time frame are spread out again, which is the only time more than one document is written.
+
+RANK_GAP = 1024.0
+# Below this the midpoint of two ranks is no longer safe to compute with floats
+MIN_RANK_GAP = 1e-6
+
+# Tasks stored before ranks existed are ordered by their priority
+def document_rank(document: dict) -> float:
+    rank = document.get("rank")
+    return rank if rank is not None else document["priority"] * RANK_GAP
+
+def rank_between(before: Optional[float], after: Optional[float]) -> Optional[float]:
+    """
+        A rank between the two neighbours, where None means the start or the end of the list.
+        Returns None if the gap is too small, in which case the time frame has to be rebalanced first.
+    """
+    if before is None and after is None:
+        return RANK_GAP
+    if after is None:
+        return before + RANK_GAP
+    # Ranks are kept positive, so in front of the first task we split the gap down to 0
+    if before is None:
+        before = 0.0
+    if after - before < 2 * MIN_RANK_GAP:
+        return None
+    return (before + after) / 2
+
+def rank_for_position(ranks: List[float], priority: int) -> Optional[float]:
+    """
+        The rank for a task placed at the given 1..N priority among the sorted ranks of the other tasks.
+        Priorities outside the list are clamped to the start or the end.
+    """
+    position = min(max(priority, 1), len(ranks) + 1) - 1
+    before = ranks[position - 1] if position > 0 else None
+    after = ranks[position] if position < len(ranks) else None
+    return rank_between(before, after)
+
+def needs_rebalance(ranks: List[float]) -> bool:
+    return any(after - before < 2 * MIN_RANK_GAP for before, after in zip(ranks, ranks[1:]))
+
+def number_by_rank(records: list) -> list:
+    """
+        Sorts task records by rank and gives them their 1..N priority from their position.
+    """
+    records.sort(key=lambda record: (record.rank, record.task_id))
+    for priority, record in enumerate(records, start=1):
+        record.priority = priority
+    return records
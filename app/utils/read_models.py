@@ -0,0 +1,77 @@
+from functools import lru_cache
+from typing import Dict, Iterable, List, Optional, Type
+
+from fastapi import HTTPException, status
+from pydantic import BaseModel
+
+# Read path for documents coming from our own database. They were validated by the models when they were written,
+# so validating them again on every read only costs time (for users it even ran the password validator on the
+# bcrypt hash). Instead the documents are returned as they are stored, with the defaults of the model filled in
+# for fields older documents do not have, so the response looks the same as when it went through the model.
+#
+# The read endpoints also take a ?fields= option with a comma separated list of fields, so a view can fetch only
+# what it needs. The fields are turned into a projection, so the rest never leaves the database.
+
+# The key each field is stored under, looked up by both the field name and its alias (task_id and _id both give _id)
+@lru_cache(maxsize=None)
+def stored_keys(model: Type[BaseModel]) -> Dict[str, str]:
+    keys = {}
+    for name, field in model.model_fields.items():
+        key = field.alias or name
+        keys[name] = key
+        keys[key] = key
+    return keys
+
+def parse_fields(models: Iterable[Type[BaseModel]], fields: Optional[str], hidden: Iterable[str] = ()) -> Optional[List[str]]:
+    """
+        Turns ?fields=a,b into the stored keys of the fields, None if all fields are wanted.
+        Raises a 400 if a field does not exist on any of the models or is hidden.
+    """
+    if fields is None:
+        return None
+    keys: Dict[str, str] = {}
+    for model in models:
+        keys.update(stored_keys(model))
+    requested = [field.strip() for field in fields.split(",") if field.strip()]
+    unknown = [field for field in requested if field not in keys or keys[field] in hidden]
+    if unknown:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Unknown fields: {', '.join(unknown)}"
+        )
+    # _id is always included, so the client can tell the documents apart
+    return list(dict.fromkeys(["_id"] + [keys[field] for field in requested]))
+
+def projection(fields: Optional[List[str]], needed: Iterable[str] = (), exclude: Iterable[str] = ()) -> Optional[dict]:
+    """
+        The projection for the requested fields plus the ones needed for building the response.
+        Without requested fields everything except the excluded fields is returned.
+    """
+    if fields is None:
+        excluded = {key: 0 for key in exclude}
+        return excluded or None
+    return {key: 1 for key in [*fields, *needed]}
+
+MISSING = object()
+
+def read_document(model: Type[BaseModel], document: dict, fields: Optional[List[str]] = None) -> dict:
+    """
+        A trusted document from the database as a response, without validating it again. Only the requested
+        fields are kept, and defaults from the model are filled in for fields the document does not have.
+    """
+    keys = fields if fields is not None else dict.fromkeys(stored_keys(model).values())
+    result = {}
+    for key in keys:
+        if key in document:
+            result[key] = document[key]
+        else:
+            default = model_default(model, key)
+            if default is not MISSING:
+                result[key] = default
+    return result
+
+def model_default(model: Type[BaseModel], key: str):
+    for name, field in model.model_fields.items():
+        if (field.alias or name) == key:
+            return MISSING if field.is_required() else field.get_default(call_default_factory=True)
+    return MISSING
@@ -0,0 +1,170 @@
+import asyncio
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, List, Optional, Set
+
+from ..settings import get_settings
+
+# When a user ticks off a few tasks or changes estimates quickly, every request reschedules the same time frame.
+# Running at the same time they would read the same tasks and overwrite each others placements, and each of them
+# does a load and a bulk write of its own. The coalescer queues the mutations per time frame, so only one batch
+# runs for a time frame at a time. The first request in the queue waits a short window for others to arrive, and
+# then runs all of the queued mutations on the same loaded tasks with one bulk write at the end.
+#
+# The coalescer is in-process, so it only sees the requests of its own worker (the Dockerfile runs one). Everything
+# runs in the event loop of that worker, so the queues need no locks, as nothing else runs between two awaits.
+
+# How many time frames we remember the last batch of, see generation()
+MAX_GENERATIONS = 10_000
+
+
+class PendingMutation:
+    """
+        A mutation waiting for its batch, along with what the request already loaded so the batch can reuse it.
+    """
+    __slots__ = ("mutation", "repository", "generation", "leads", "finished", "result", "error", "ready")
+
+    def __init__(self, mutation: Callable, repository, generation: int):
+        self.mutation = mutation
+        self.repository = repository
+        self.generation = generation
+        self.leads = False
+        self.finished = False
+        self.result = None
+        self.error: Optional[BaseException] = None
+        self.ready = asyncio.Event()
+
+    def outcome(self):
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+
+class RescheduleCoalescer:
+    """
+        Runs the mutations of each time frame one batch at a time and merges the mutations that arrive while a batch
+        is waiting or running into the next one.
+    """
+    def __init__(self, window: Optional[float] = None):
+        # How long the first mutation of a time frame waits for others to join its batch (RESCHEDULE_COALESCE_MS),
+        # the setting is read the first time it is needed so importing the coalescer does not read the settings
+        self.window_seconds = window
+        # The queued mutations of each time frame, a time frame is only in here while one of its batches runs
+        self.queues: Dict[object, List[PendingMutation]] = {}
+        self.running: Set[asyncio.Task] = set()
+        # Every batch that is done gets the next number, and the number of the last batch of each time frame is kept.
+        # A request reads the current number before loading, if the time frame has a higher one by the time its batch
+        # runs, what it loaded is stale. A forgotten time frame counts as the highest number forgotten so far.
+        self.generations: "OrderedDict[object, int]" = OrderedDict()
+        self.last_generation = 0
+        self.forgotten = 0
+        self.batches = 0
+        self.mutations = 0
+        self.merged = 0
+        self.reloads = 0
+        self.max_batch = 0
+        # Batches where a mutation failed and every mutation ran again on its own, see run_batch in the task controller
+        self.failed_batches = 0
+
+    @property
+    def window(self) -> float:
+        if self.window_seconds is None:
+            self.window_seconds = get_settings().reschedule_coalesce_ms / 1000
+        return self.window_seconds
+
+    @window.setter
+    def window(self, window: float) -> None:
+        self.window_seconds = window
+
+    def generation(self) -> int:
+        """
+            Read before loading the tasks of a time frame, and passed to submit along with them.
+        """
+        return self.last_generation
+
+    async def submit(self, key, mutation: Callable, run_batch: Callable[[List[PendingMutation], bool], Awaitable[None]], repository=None, generation: int = 0):
+        """
+            Queues the mutation for the time frame and returns its result once its batch has run.
+            run_batch(batch, stale) runs a list of pending mutations and sets the result or error of each of them,
+            stale tells if the repository of the first one was loaded before the last batch of the time frame was done.
+        """
+        pending = PendingMutation(mutation, repository, generation)
+        queue = self.queues.get(key)
+        if queue is None:
+            self.queues[key] = [pending]
+            pending.leads = True
+        else:
+            queue.append(pending)
+        if not pending.leads:
+            try:
+                await pending.ready.wait()
+            except asyncio.CancelledError:
+                # The request went away, but the batch still has to run for the mutations queued after it
+                if pending.leads and not pending.finished:
+                    self.start_lead(key, run_batch)
+                raise
+        # Either the first in the queue, or the first one after the batch that was running when we joined. The batch
+        # is shielded, so the queue of the time frame is handed over even if the request is cancelled
+        if pending.leads and not pending.finished:
+            await asyncio.shield(self.start_lead(key, run_batch))
+        return pending.outcome()
+
+    def start_lead(self, key, run_batch: Callable[[List[PendingMutation], bool], Awaitable[None]]) -> asyncio.Task:
+        # The loop only keeps weak references to its tasks, so the running batches are kept until they are done
+        task = asyncio.ensure_future(self.lead(key, run_batch))
+        self.running.add(task)
+        task.add_done_callback(self.running.discard)
+        return task
+
+    async def lead(self, key, run_batch: Callable[[List[PendingMutation], bool], Awaitable[None]]) -> None:
+        # Sleeping in the loop lets the other requests of the time frame join the queue in the meantime
+        if self.window > 0:
+            await asyncio.sleep(self.window)
+        batch = self.queues[key]
+        self.queues[key] = []
+        stale = self.generations.get(key, self.forgotten) > batch[0].generation
+
+        try:
+            await run_batch(batch, stale)
+        except BaseException as error:
+            # run_batch sets the errors of the mutations itself, this is only if it failed before getting that far
+            for pending in batch:
+                if pending.error is None and pending.result is None:
+                    pending.error = error
+
+        self.last_generation += 1
+        self.generations[key] = self.last_generation
+        self.generations.move_to_end(key)
+        while len(self.generations) > MAX_GENERATIONS:
+            _, forgotten = self.generations.popitem(last=False)
+            self.forgotten = max(self.forgotten, forgotten)
+        self.batches += 1
+        self.mutations += len(batch)
+        self.merged += len(batch) - 1
+        self.reloads += stale
+        self.max_batch = max(self.max_batch, len(batch))
+        # Hand over to the first mutation that arrived while this batch ran, or let the time frame go
+        queue = self.queues[key]
+        if queue:
+            queue[0].leads = True
+            queue[0].ready.set()
+        else:
+            del self.queues[key]
+
+        for pending in batch:
+            pending.finished = True
+            pending.ready.set()
+
+    def stats(self) -> dict:
+        return {
+            "window_ms": self.window * 1000,
+            "batches": self.batches,
+            "mutations": self.mutations,
+            "merged": self.merged,
+            "reloads": self.reloads,
+            "max_batch": self.max_batch,
+            "failed_batches": self.failed_batches,
+            "active_time_frames": len(self.queues),
+        }
+
+
+reschedule_coalescer = RescheduleCoalescer()
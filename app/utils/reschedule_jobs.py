@@ -0,0 +1,118 @@
+import asyncio
+import contextvars
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import Awaitable, Callable, List, Optional, Set, Tuple
+from uuid import UUID, uuid4
+
+from ..settings import get_settings
+
+# Updating or deleting a task with ?background=true only writes the task itself before responding. Rescheduling the
+# tasks after it is queued as a job and run as a task in the event loop, so the response time does not depend
+# on how many tasks follow. The job goes through the reschedule coalescer like any other mutation, so it never runs
+# at the same time as another change to the time frame. When it is done the schedule_version of the time frame is
+# bumped, and the job can be looked up by its id to see what moved.
+#
+# The jobs are kept in memory, so they are only known by the worker that queued them (the Dockerfile runs one).
+
+# How many finished jobs we remember
+MAX_FINISHED_JOBS = 1000
+
+
+class RescheduleJob:
+    __slots__ = ("job_id", "time_frame_id", "task_id", "state", "created_at", "finished_at", "changed", "schedule_version", "error")
+
+    def __init__(self, time_frame_id: UUID, task_id: UUID):
+        self.job_id = uuid4()
+        self.time_frame_id = time_frame_id
+        self.task_id = task_id
+        self.state = "queued"
+        self.created_at = datetime.now(timezone.utc)
+        self.finished_at: Optional[datetime] = None
+        self.changed: List[dict] = []
+        self.schedule_version: Optional[int] = None
+        self.error: Optional[str] = None
+
+    def to_dict(self) -> dict:
+        return {
+            "job_id": self.job_id,
+            "time_frame_id": self.time_frame_id,
+            "task_id": self.task_id,
+            "state": self.state,
+            "created_at": self.created_at,
+            "finished_at": self.finished_at,
+            "changed": self.changed,
+            "schedule_version": self.schedule_version,
+            "error": self.error,
+        }
+
+
+class RescheduleJobs:
+    """
+        The queued and finished reschedule jobs along with the tasks running them.
+    """
+    def __init__(self, workers: Optional[int] = None, max_finished: int = MAX_FINISHED_JOBS):
+        # Only this many of the jobs run at a time (RESCHEDULE_WORKERS), the rest wait for their turn. The semaphore
+        # is made with the first job, so importing the jobs does not read the settings
+        self.worker_count = workers
+        self.semaphore: Optional[asyncio.Semaphore] = None
+        self.max_finished = max_finished
+        # The loop only keeps weak references to its tasks, so the jobs are kept here until they are done
+        self.running: Set[asyncio.Task] = set()
+        self.jobs: "OrderedDict[UUID, RescheduleJob]" = OrderedDict()
+        self.finished = 0
+        self.failed = 0
+
+    @property
+    def workers(self) -> asyncio.Semaphore:
+        if self.semaphore is None:
+            count = get_settings().reschedule_workers if self.worker_count is None else self.worker_count
+            self.semaphore = asyncio.Semaphore(count)
+        return self.semaphore
+
+    def submit(self, time_frame_id: UUID, task_id: UUID, run: Callable[[RescheduleJob], Awaitable[Tuple[List[dict], int]]]) -> RescheduleJob:
+        """
+            Queues run, which is given the job, reschedules the tasks and returns the changed tasks and the new schedule version.
+            Has to be called from the event loop the jobs run in.
+        """
+        job = RescheduleJob(time_frame_id, task_id)
+        self.jobs[job.job_id] = job
+        # The job gets a context of its own, otherwise its database commands are counted for the request that queued it
+        task = asyncio.get_running_loop().create_task(self.run(job, run), context=contextvars.Context())
+        self.running.add(task)
+        task.add_done_callback(self.running.discard)
+        return job
+
+    async def run(self, job: RescheduleJob, run: Callable[[RescheduleJob], Awaitable[Tuple[List[dict], int]]]) -> None:
+        async with self.workers:
+            job.state = "running"
+            try:
+                job.changed, job.schedule_version = await run(job)
+                job.state = "done"
+            except Exception as error:
+                job.error = getattr(error, "detail", None) or repr(error)
+                job.state = "failed"
+        job.finished_at = datetime.now(timezone.utc)
+        self.finished += 1
+        self.failed += job.state == "failed"
+        self.forget_old_jobs()
+
+    def get(self, job_id: UUID) -> Optional[RescheduleJob]:
+        return self.jobs.get(job_id)
+
+    def stats(self) -> dict:
+        return {
+            "jobs": len(self.jobs),
+            "pending": sum(job.finished_at is None for job in self.jobs.values()),
+            "finished": self.finished,
+            "failed": self.failed,
+        }
+
+    # The oldest finished jobs are dropped, jobs that have not run yet are always kept
+    def forget_old_jobs(self) -> None:
+        finished = [job_id for job_id, job in self.jobs.items() if job.finished_at is not None]
+        for job_id in finished[:max(len(finished) - self.max_finished, 0)]:
+            del self.jobs[job_id]
+
+
+reschedule_jobs = RescheduleJobs()
@@ -1,22 +1,150 @@
 
 from datetime import datetime, timedelta, timezone
-from typing import List, Tuple
+from typing import Iterable, Iterator, List, Optional, Tuple
+import numpy as np
 from ..models.time_frame import TimeFrame, WorkTimeIntervals
 from ..models.task import Task
+from .ranking import RANK_GAP, document_rank
 
 # Scheduler is two helper functions used as a tool to ensure the tasks are placed in accordance with the given time-frame's work windows. It takes the start and end date of the users time frame and the work intervals and build into a tuple list. When given a task it looks at priority and in ascending order, split and places the tasks accordingly.
 
+# From this number of tasks schedule_tasks switches to the vectorized version, below it the plain loop is faster
+VECTORIZED_SCHEDULING_THRESHOLD = 64
+
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+ONE_MICROSECOND = timedelta(microseconds=1)
+
+# Helpers for converting between datetimes and epoch microseconds. We use microseconds so no precision is lost
+# compared to doing the calculations with datetime and timedelta.
+def to_epoch_us(value: datetime) -> int:
+    return (value - EPOCH) // ONE_MICROSECOND
+
+def from_epoch_us(value: int) -> datetime:
+    return EPOCH + timedelta(microseconds=value)
+
+# Compact version of a task used inside the scheduler. The Pydantic models are only needed at the database and API
+# boundaries, while scheduling only needs the order, the duration and the placement. Keeping those as plain ints
+# (epoch microseconds) in a slotted object saves both memory and the overhead of validating models on every change.
+class TaskRecord:
+    __slots__ = ("task_id", "priority", "rank", "duration", "start", "end", "completed", "tracked_duration")
+
+    def __init__(self, task_id, priority: int, rank: float, duration: int, start: Optional[int], end: Optional[int], completed: bool = False, tracked_duration: Optional[float] = None):
+        self.task_id = task_id
+        self.priority = priority
+        self.rank = rank
+        # Estimated duration in microseconds
+        self.duration = duration
+        self.start = start
+        self.end = end
+        self.completed = completed
+        self.tracked_duration = tracked_duration
+
+    @classmethod
+    def from_task(cls, task: Task) -> "TaskRecord":
+        return cls(
+            task.task_id,
+            task.priority,
+            task.rank if task.rank is not None else task.priority * RANK_GAP,
+            timedelta(hours=task.self_estimated_duration) // ONE_MICROSECOND,
+            to_epoch_us(task.start) if task.start is not None else None,
+            to_epoch_us(task.end) if task.end is not None else None,
+            task.completed,
+            task.tracked_duration,
+        )
+
+    @classmethod
+    def from_document(cls, document: dict) -> "TaskRecord":
+        """
+            Builds the record straight from a task document, without validating a whole Task model first.
+        """
+        return cls(
+            document["_id"],
+            document["priority"],
+            document_rank(document),
+            timedelta(hours=document["self_estimated_duration"]) // ONE_MICROSECOND,
+            to_epoch_us(document["start"]) if document.get("start") is not None else None,
+            to_epoch_us(document["end"]) if document.get("end") is not None else None,
+            document.get("completed", False),
+            document.get("tracked_duration"),
+        )
+
+    def apply(self, fields: dict) -> None:
+        """
+            Applies a $set of task fields to the record, so it matches the document after the update without reading it again.
+        """
+        if fields.get("rank") is not None:
+            self.rank = fields["rank"]
+        if fields.get("self_estimated_duration") is not None:
+            self.duration = timedelta(hours=fields["self_estimated_duration"]) // ONE_MICROSECOND
+        if fields.get("completed") is not None:
+            self.completed = fields["completed"]
+        if "tracked_duration" in fields:
+            self.tracked_duration = fields["tracked_duration"]
+        if fields.get("start") is not None:
+            self.start = to_epoch_us(fields["start"])
+
+    def actual_finish(self) -> int:
+        # If the task was completed we use the tracked time, otherwise its scheduled end
+        if self.completed and self.tracked_duration is not None:
+            return self.start + timedelta(hours=self.tracked_duration) // ONE_MICROSECOND
+        return self.end
+
+    def placement(self) -> Tuple[Optional[int], Optional[int]]:
+        return (self.start, self.end)
+
+    def with_placement(self, start: Optional[int], end: Optional[int]) -> "TaskRecord":
+        """
+            A copy of the record placed at the given start and end, every other slot is copied as it is.
+        """
+        copy = TaskRecord.__new__(TaskRecord)
+        for slot in TaskRecord.__slots__:
+            setattr(copy, slot, getattr(self, slot))
+        copy.start = start
+        copy.end = end
+        return copy
+
+    def moved_from(self, placement: Tuple[Optional[int], Optional[int]]) -> bool:
+        """
+            Whether the record is placed differently than the given (start, end). MongoDB only stores milliseconds,
+            so the times are compared on milliseconds, otherwise every task read back would look like it moved.
+        """
+        old_start, old_end = placement
+        return not (same_millisecond(old_start, self.start) and same_millisecond(old_end, self.end))
+
+    def changeset(self) -> dict:
+        # The part of the task the frontend needs to move it, used for the changed tasks in responses
+        return {
+            "_id": self.task_id,
+            "priority": self.priority,
+            "start": from_epoch_us(self.start) if self.start is not None else None,
+            "end": from_epoch_us(self.end) if self.end is not None else None,
+        }
+
+def same_millisecond(first: Optional[int], second: Optional[int]) -> bool:
+    if first is None or second is None:
+        return first is second
+    return first // 1000 == second // 1000
+
 # Helper function for making a list with all dates in time frame and their work window intervals
 def generate_available_work_window_slots(time_frame: TimeFrame) -> List[Tuple[datetime, datetime]]:
     """
         Takes a time frames start and end date along with it work time intervals. 
         Creates a where each entry it is a tuple of start and end time of format 2025-04-20T08:00:00
     """
-    # Create an empty list to contain a list where each element is a work window interval
-    work_windows_slots: List[Tuple[datetime, datetime]] = []
+    return list(iterate_work_window_slots(time_frame))
+
+def iterate_work_window_slots(time_frame: TimeFrame, base_time: Optional[datetime] = None) -> Iterator[Tuple[datetime, datetime]]:
+    """
+        Lazy version of generate_available_work_window_slots. Yields the work windows one at a time
+        and can begin at base_time, so we only build the windows the scheduler actually pulls.
+        A window that base_time falls inside is trimmed to start at base_time.
+    """
     # Finds the start and end date of the time frame
     start_date = time_frame.start_date.date()
     end_date = time_frame.end_date.date()
+    # Jump straight to the day of base_time instead of walking every day from the beginning of the time frame
+    if base_time is not None:
+        start_date = max(start_date, base_time.astimezone(timezone.utc).date())
     while start_date <= end_date:
         # Check if time frame also includes weekends otherwise it will only take monday to friday into account
         if time_frame.include_weekend or start_date.weekday() < 5:
@@ -25,33 +153,60 @@ def generate_available_work_window_slots(time_frame: TimeFrame) -> List[Tuple[da
                 # Combines a date in the time frame with the work intervals - it creates a string like this 2025-04-20T08:00:00
                 start = datetime.combine(start_date, interval.start.timetz()).replace(tzinfo=timezone.utc)
                 end   = datetime.combine(start_date, interval.end.timetz()).replace(tzinfo=timezone.utc)
-                work_windows_slots.append((start, end))
+                if base_time is not None:
+                    # Skip the work window if it ends before base_time, and only keep the free part if base_time is inside it
+                    if end <= base_time:
+                        continue
+                    if start < base_time:
+                        start = base_time
+                yield (start, end)
         start_date += timedelta(days=1)
-    return work_windows_slots
 
-def schedule_tasks(tasks: List[Task], work_windows: List[Tuple[datetime, datetime]]) -> List[Task]:
+def schedule_tasks(tasks: List[Task], work_windows: Iterable[Tuple[datetime, datetime]]) -> List[Task]:
     """
         Pack each task (in ascending priority) into the available work window slots,
-        automatically splitting it across multiple work windows if needed and returns a list
+        automatically splitting it across multiple work windows if needed and returns a list.
+        work_windows can be a list or a lazy iterator, only the windows that are filled are pulled from it.
+        The scheduling itself is done on TaskRecords by schedule_records, this only copies the placement back.
     """
     # sort by priority
     tasks = sorted(tasks, key=lambda t: t.priority)
+    records = schedule_records([TaskRecord.from_task(task) for task in tasks], work_windows)
+
+    # Add the correct start and end time to the tasks
+    for task, record in zip(tasks, records):
+        task.start = from_epoch_us(record.start) if record.start is not None else None
+        task.end   = from_epoch_us(record.end)
+
+    return tasks
+
+def schedule_records(records: List[TaskRecord], work_windows: Iterable[Tuple[datetime, datetime]]) -> List[TaskRecord]:
+    """
+        Same as schedule_tasks, but on TaskRecords, so everything is done with epoch microseconds.
+        Sets start and end on the records and returns them sorted by priority.
+    """
+    records = sorted(records, key=lambda record: record.priority)
+
+    # Large task sets are handed to the vectorized version. Tasks without a duration are left to the loop,
+    # as they do not take up any time in the work windows.
+    if len(records) >= VECTORIZED_SCHEDULING_THRESHOLD and all(record.duration > 0 for record in records):
+        return schedule_records_vectorized(records, work_windows)
 
     # Uses a python iterator called iter, works on list, dicts and tuples. Can use the Pythons next to iteratre through them.
-    iterate_through_work_window_slots = iter(work_windows)
+    iterate_through_work_window_slots = iterate_epoch_windows(work_windows)
     # Try to iterate through the work windows, unless there are none
     try:
         current_start, current_end = next(iterate_through_work_window_slots)
     except StopIteration:
         raise RuntimeError("No work windows")
 
-    for task in tasks:
+    for record in records:
         # Keeping track of how much of the task still needs to be allocated time
-        remaing_time_left_on_task = timedelta(hours=task.self_estimated_duration)
+        remaing_time_left_on_task = record.duration
         task_start = None
 
         # Continue to go through task until there are no more to schedule
-        while remaing_time_left_on_task > timedelta(0):
+        while remaing_time_left_on_task > 0:
             # if no more time left in work window we try to continue to the next work window, as long as it exists 
             if current_start >= current_end:
                 try:
@@ -69,11 +224,76 @@ def schedule_tasks(tasks: List[Task], work_windows: List[Tuple[datetime, datetim
             current_start += chunk
             remaing_time_left_on_task -= chunk
 
-        # Add the correct start and end time to the tasks
-        task.start = task_start
-        task.end   = current_start
+        record.start = task_start
+        record.end   = current_start
 
-    return tasks
+    return records
+
+def schedule_records_vectorized(records: List[TaskRecord], work_windows: Iterable[Tuple[datetime, datetime]]) -> List[TaskRecord]:
+    """
+        Same result as schedule_records, but instead of stepping through the windows one chunk at a time it uses numpy.
+        The windows become epoch arrays with a running total of their capacity, and the start and end of each task is
+        found with searchsorted on the running total of the task durations.
+    """
+    records = sorted(records, key=lambda record: record.priority)
+    # Running total of work time needed when each task is done
+    durations = np.fromiter((record.duration for record in records), dtype=np.int64, count=len(records))
+    finished_work = np.cumsum(durations)
+    started_work = finished_work - durations
+
+    starts, ends = pull_epoch_windows(work_windows, int(finished_work[-1]))
+    if len(starts) == 0:
+        raise RuntimeError("No work windows")
+    # Running total of work time available at the end of each window
+    capacity = np.maximum(ends - starts, 0)
+    capacity_after = np.cumsum(capacity)
+    capacity_before = capacity_after - capacity
+    if finished_work[-1] > capacity_after[-1]:
+        raise RuntimeError("Not enough available work time to schedule all tasks")
+
+    # A task ends in the first window where the capacity is enough, so a task filling a window ends in that window.
+    end_window = np.searchsorted(capacity_after, finished_work, side="left")
+    task_ends = starts[end_window] + (finished_work - capacity_before[end_window])
+    # A task starts where the previous one ended if there is time left in that window, otherwise at the start of
+    # the next window, just like the loop moves on to the next window when the current one is used up.
+    previous_window = np.searchsorted(capacity_after, started_work, side="left")
+    next_window = np.minimum(previous_window + 1, len(starts) - 1)
+    task_starts = np.where(
+        started_work < capacity_after[previous_window],
+        starts[previous_window] + (started_work - capacity_before[previous_window]),
+        starts[next_window],
+    )
+
+    for record, start, end in zip(records, task_starts.tolist(), task_ends.tolist()):
+        record.start = start
+        record.end   = end
+
+    return records
+
+def iterate_epoch_windows(work_windows: Iterable[Tuple[datetime, datetime]]) -> Iterator[Tuple[int, int]]:
+    # The window views from the window index can hand out epoch windows directly, other windows are converted
+    if hasattr(work_windows, "iterate_epoch"):
+        return work_windows.iterate_epoch()
+    return ((to_epoch_us(start), to_epoch_us(end)) for start, end in work_windows)
+
+def pull_epoch_windows(work_windows: Iterable[Tuple[datetime, datetime]], needed: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+        Takes windows from work_windows until they can hold the needed work time (in microseconds) and returns
+        their start and end as epoch arrays. Like the loop, only the windows that are filled are pulled.
+    """
+    # The window views from the window index already have the epoch arrays, so no datetimes are created
+    if hasattr(work_windows, "epoch_arrays"):
+        return work_windows.epoch_arrays()
+    starts: List[int] = []
+    ends: List[int] = []
+    available = 0
+    for start, end in ((to_epoch_us(start), to_epoch_us(end)) for start, end in work_windows):
+        starts.append(start)
+        ends.append(end)
+        available += max(end - start, 0)
+        if available >= needed:
+            break
+    return np.array(starts, dtype=np.int64), np.array(ends, dtype=np.int64)
 
 
 def calculate_tracked_duration(
@@ -0,0 +1,157 @@
+from collections import OrderedDict
+from threading import Lock
+from typing import Awaitable, Callable, Dict, Optional, Tuple
+from uuid import UUID
+
+from ..models.time_frame import TimeFrame
+from ..settings import get_settings
+from .work_windows import WorkWindowIndex
+
+# Every task mutation needs the time frame and its work windows. Instead of fetching, validating and generating
+# the windows again each time, the validated time frame and its window index are kept in an in-process LRU cache.
+# Each time frame has a version counter that is bumped when the time frame is updated or deleted, which makes
+# the cached entry stale so it is loaded again on the next request.
+
+# Rough size of a cached entry, used for keeping the cache within its memory bound. The window index holds three
+# int64 arrays (start, end and capacity), so each window is 24 bytes.
+BYTES_PER_WINDOW = 24
+BYTES_PER_TIME_FRAME = 2048
+
+class TimeFrameCacheEntry:
+    __slots__ = ("version", "time_frame", "windows", "size")
+
+    def __init__(self, version: int, time_frame: TimeFrame, windows: WorkWindowIndex):
+        self.version = version
+        self.time_frame = time_frame
+        self.windows = windows
+        self.size = BYTES_PER_TIME_FRAME + len(windows) * BYTES_PER_WINDOW
+
+
+class TimeFrameCache:
+    """
+        LRU cache of validated time frames and their work window index, keyed by time frame id and version.
+        Bounded both by number of entries and by the estimated memory of the entries.
+    """
+    def __init__(self, max_entries: Optional[int] = None, max_bytes: Optional[int] = None):
+        # TIME_FRAME_CACHE_MAX_ENTRIES and TIME_FRAME_CACHE_MAX_BYTES unless given, read the first time they are needed
+        # so importing the cache does not read the settings
+        self.entries_limit = max_entries
+        self.bytes_limit = max_bytes
+        self.entries: "OrderedDict[UUID, TimeFrameCacheEntry]" = OrderedDict()
+        self.versions: Dict[UUID, int] = {}
+        # How many times any time frame was invalidated, see get_loaded
+        self.invalidations = 0
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = Lock()
+
+    @property
+    def max_entries(self) -> int:
+        if self.entries_limit is None:
+            self.entries_limit = get_settings().time_frame_cache_max_entries
+        return self.entries_limit
+
+    @property
+    def max_bytes(self) -> int:
+        if self.bytes_limit is None:
+            self.bytes_limit = get_settings().time_frame_cache_max_bytes
+        return self.bytes_limit
+
+    def get(self, time_frame_id: UUID, load: Callable[[], Optional[dict]]) -> Optional[Tuple[TimeFrame, WorkWindowIndex]]:
+        """
+            Returns the time frame and its window index. On a miss load is called to fetch the document,
+            if it returns None nothing is cached and None is returned.
+        """
+        cached, version = self.lookup(time_frame_id)
+        if cached is not None:
+            return cached
+        return self.store(time_frame_id, version, load())
+
+    async def get_async(self, time_frame_id: UUID, load: Callable[[], Awaitable[Optional[dict]]]) -> Optional[Tuple[TimeFrame, WorkWindowIndex]]:
+        """
+            Same as get, for when the document is fetched with the async client.
+        """
+        cached, version = self.lookup(time_frame_id)
+        if cached is not None:
+            return cached
+        return self.store(time_frame_id, version, await load())
+
+    def get_loaded(self, time_frame_id: UUID, document: Optional[dict], invalidations: int) -> Optional[Tuple[TimeFrame, WorkWindowIndex]]:
+        """
+            Same as get, for a document that was loaded before the version was looked up. invalidations is read before
+            loading it, if a time frame has been invalidated since, the document may be older than the current version,
+            so it is only used for this request and not cached.
+        """
+        cached, version = self.lookup(time_frame_id)
+        if cached is not None:
+            return cached
+        return self.store(time_frame_id, version, document, invalidations)
+
+    def lookup(self, time_frame_id: UUID) -> Tuple[Optional[Tuple[TimeFrame, WorkWindowIndex]], int]:
+        # The cached time frame if there is a fresh one, along with the version a loaded one would be stored under
+        with self.lock:
+            version = self.versions.get(time_frame_id, 0)
+            entry = self.entries.get(time_frame_id)
+            if entry is not None and entry.version == version:
+                self.hits += 1
+                self.entries.move_to_end(time_frame_id)
+                return (entry.time_frame, entry.windows), version
+            self.misses += 1
+        return None, version
+
+    def store(self, time_frame_id: UUID, version: int, document: Optional[dict], invalidations: Optional[int] = None) -> Optional[Tuple[TimeFrame, WorkWindowIndex]]:
+        # The document is loaded outside the lock so a slow database call does not block other time frames
+        if document is None:
+            return None
+        time_frame = TimeFrame.model_validate(document)
+        windows = WorkWindowIndex.from_time_frame(time_frame)
+
+        with self.lock:
+            # Only cache it if the time frame was not updated while we were loading it
+            unchanged = invalidations is None or invalidations == self.invalidations
+            if unchanged and self.versions.get(time_frame_id, 0) == version:
+                self.remove(time_frame_id)
+                entry = TimeFrameCacheEntry(version, time_frame, windows)
+                self.entries[time_frame_id] = entry
+                self.size += entry.size
+                self.evict()
+        return time_frame, windows
+
+    def invalidate(self, time_frame_id: UUID) -> None:
+        """
+            Bump the version of the time frame, used when it is updated or deleted.
+        """
+        with self.lock:
+            self.versions[time_frame_id] = self.versions.get(time_frame_id, 0) + 1
+            self.invalidations += 1
+            self.remove(time_frame_id)
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                "entries": len(self.entries),
+                "max_entries": self.max_entries,
+                "bytes": self.size,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+    # The helpers below expect the lock to be held
+    def remove(self, time_frame_id: UUID) -> None:
+        entry = self.entries.pop(time_frame_id, None)
+        if entry is not None:
+            self.size -= entry.size
+
+    def evict(self) -> None:
+        # Remove the least recently used entries until we are within both bounds
+        while self.entries and (len(self.entries) > self.max_entries or self.size > self.max_bytes):
+            _, entry = self.entries.popitem(last=False)
+            self.size -= entry.size
+            self.evictions += 1
+
+
+time_frame_cache = TimeFrameCache()
@@ -0,0 +1,85 @@
+from datetime import date, datetime, timedelta, timezone
+from typing import Dict, Iterable, Optional
+from uuid import UUID
+
+from ..models.task import Task
+from ..models.time_frame import TimeFrame
+from .scheduler import to_epoch_us
+from .work_windows import WorkWindowIndex
+
+# Tracked duration for tasks over whole time frames. calculate_tracked_duration in scheduler.py compares against the
+# interval datetimes directly, which only works when the task starts and finishes on the day the intervals were
+# created. Here the intervals are expanded to every day of the time frame (skipping weekends unless they are
+# included) through the window index, so tasks spanning several days are handled correctly.
+#
+# The rule is the same as the single day version: time inside the work windows counts, the breaks between the
+# windows do not, and time before the first window on the day the task was started or after the last window on the
+# day it was finished counts as well, since the user was working outside their planned hours. For days without
+# windows (weekends that are not included) the time only counts if the task was started and finished that day.
+
+def calculate_tracked_duration_in_time_frame(
+    start: datetime,
+    finished: datetime,
+    time_frame: TimeFrame,
+    windows: WorkWindowIndex,
+) -> float:
+    """
+        Return total hours between "start" and "finished" using the expanded daily work windows of the time frame.
+    """
+    if finished <= start or not time_frame.work_time_frame_intervals:
+        return max(finished - start, timedelta(0)).total_seconds() / 3600
+
+    # Work time inside the windows is the difference in used capacity, so we do not have to walk the windows
+    total = timedelta(microseconds=windows.used_capacity(to_epoch_us(finished)) - windows.used_capacity(to_epoch_us(start)))
+
+    start_day = start.astimezone(timezone.utc).date()
+    finished_day = finished.astimezone(timezone.utc).date()
+    first_start = first_window_start(time_frame, start_day)
+    last_end = last_window_end(time_frame, finished_day)
+
+    if first_start is None and last_end is None and start_day == finished_day:
+        return (finished - start).total_seconds() / 3600
+    # before the first window on the day the task was started
+    if first_start is not None and start < first_start:
+        total += min(finished, first_start) - start
+    # after the last window on the day the task was finished
+    if last_end is not None and finished > last_end:
+        total += finished - max(start, last_end)
+
+    return total.total_seconds() / 3600
+
+
+def calculate_tracked_durations(
+    tasks: Iterable[Task],
+    time_frame: TimeFrame,
+    windows: WorkWindowIndex,
+) -> Dict[UUID, float]:
+    """
+        Tracked duration in hours for every completed task in a time frame, rounded like when a task is completed.
+        A task is finished at its finished time, or its end if it was completed before finished was stored.
+    """
+    durations: Dict[UUID, float] = {}
+    for task in tasks:
+        if not task.completed:
+            continue
+        finished = task.finished or task.end
+        durations[task.task_id] = round(calculate_tracked_duration_in_time_frame(task.start, finished, time_frame, windows), 2)
+    return durations
+
+# Helpers for finding the first and last work window of a given day, None if the day has no windows
+def has_work_windows(time_frame: TimeFrame, day: date) -> bool:
+    if not time_frame.start_date.date() <= day <= time_frame.end_date.date():
+        return False
+    return time_frame.include_weekend or day.weekday() < 5
+
+def first_window_start(time_frame: TimeFrame, day: date) -> Optional[datetime]:
+    if not has_work_windows(time_frame, day):
+        return None
+    first = min(interval.start.time() for interval in time_frame.work_time_frame_intervals)
+    return datetime.combine(day, first, tzinfo=timezone.utc)
+
+def last_window_end(time_frame: TimeFrame, day: date) -> Optional[datetime]:
+    if not has_work_windows(time_frame, day):
+        return None
+    last = max(interval.end.time() for interval in time_frame.work_time_frame_intervals)
+    return datetime.combine(day, last, tzinfo=timezone.utc)
@@ -0,0 +1,97 @@
+import hashlib
+from collections import OrderedDict
+from threading import Lock
+from typing import Optional, Tuple
+from uuid import UUID, uuid4
+
+from fastapi import Request, Response, status
+
+# The planner polls the tasks of the time frame, the active time frame and the user all the time, and most of the
+# time nothing has changed. Every write to one of them bumps an in-process version counter, and the read endpoints
+# send an ETag built from the counters. When the client sends the ETag back in If-None-Match and nothing has been
+# written since, the endpoint answers 304 without reading the database.
+#
+# The counters only see the writes of this process. The Dockerfile runs a single uvicorn worker, so that is all of
+# them, but the admin jobs in app/jobs write from their own process, so restart the server after running one.
+
+MAX_VERSIONS = 100_000
+
+# A resource is a kind of document along with the id it belongs to, e.g. ("tasks", time frame id)
+Resource = Tuple[str, Optional[str]]
+
+
+def resource_key(value) -> Optional[str]:
+    # Ids come both as UUIDs and as strings from the url, they have to end up as the same key
+    if value is None:
+        return None
+    try:
+        return str(UUID(str(value)))
+    except ValueError:
+        return str(value)
+
+
+class ResourceVersions:
+    """
+        Version counters for the resources. Every bump takes the next number of one counter shared by all resources,
+        so a number is never given out twice, and a resource that was forgotten to stay within MAX_VERSIONS counts as
+        the highest number forgotten so far. That way an old ETag can never match a version it was not built from.
+    """
+    def __init__(self, max_versions: int = MAX_VERSIONS):
+        self.max_versions = max_versions
+        self.lock = Lock()
+        self.versions: "OrderedDict[Resource, int]" = OrderedDict()
+        self.last = 0
+        self.forgotten = 0
+        # Part of every ETag, so ETags from before a restart never match the counters that start over
+        self.instance = uuid4().hex[:8]
+
+    def bump(self, kind: str, key=None) -> None:
+        resource = (kind, resource_key(key))
+        with self.lock:
+            self.last += 1
+            self.versions[resource] = self.last
+            self.versions.move_to_end(resource)
+            while len(self.versions) > self.max_versions:
+                _, forgotten = self.versions.popitem(last=False)
+                self.forgotten = max(self.forgotten, forgotten)
+
+    def version(self, kind: str, key=None) -> int:
+        with self.lock:
+            return self.versions.get((kind, resource_key(key)), self.forgotten)
+
+    def etag(self, *resources: Tuple[str, object], variant: str = "") -> str:
+        """
+            Strong ETag for a response built from the given resources. variant is everything else the response
+            depends on, like the query string, so ?fields=title does not get the same ETag as the whole task.
+        """
+        versions = "-".join(str(self.version(kind, key)) for kind, key in resources)
+        named = ",".join(f"{kind}:{resource_key(key)}" for kind, key in resources)
+        digest = hashlib.blake2b(f"{named}|{variant}".encode(), digest_size=6).hexdigest()
+        return f'"{self.instance}-{versions}-{digest}"'
+
+
+def not_modified(request: Request, etag: str) -> bool:
+    """
+        Whether the client already has the response with this ETag.
+    """
+    header = request.headers.get("if-none-match")
+    if header is None:
+        return False
+    tags = [tag.strip() for tag in header.split(",")]
+    # If-None-Match uses the weak comparison, so a W/ in front of the tag does not matter
+    return "*" in tags or any(tag.removeprefix("W/") == etag for tag in tags)
+
+
+def conditional_response(request: Request, response: Response, etag: str) -> Optional[Response]:
+    """
+        A 304 if the client already has the response with this ETag, otherwise None after putting the ETag on the
+        response. The response may be kept by the browser, but has to be checked with us before it is used again.
+    """
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if not_modified(request, etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    response.headers.update(headers)
+    return None
+
+
+resource_versions = ResourceVersions()
@@ -0,0 +1,182 @@
+from array import array
+from bisect import bisect_left, bisect_right
+from datetime import datetime, timedelta
+from typing import Iterable, Iterator, Optional, Tuple
+
+import numpy as np
+
+from ..models.time_frame import TimeFrame
+from .scheduler import ONE_MICROSECOND, from_epoch_us, iterate_work_window_slots, to_epoch_us
+
+# The window index is a compact version of the work window slots for a time frame. Instead of a list of
+# datetime tuples it keeps two sorted arrays with the start and end of each window as epoch microseconds.
+# This way we can use bisect to find the free windows after a given time in O(log n) instead of walking
+# through every window in the time frame.
+# Next to the windows it keeps a running total of the work time (capacity) at the end of each window. With that we
+# can answer how much work time is left after a given time, and when a given amount of work would be done, without
+# scheduling anything.
+
+
+class WorkWindowIndex:
+    """
+        Sorted start and end arrays of all work windows in a time frame, along with the capacity prefix sum.
+    """
+    def __init__(self, starts: array, ends: array):
+        self.starts = starts
+        self.ends = ends
+        # capacity[i] is the work time in all windows up to and including window i
+        self.capacity = array("q")
+        total = 0
+        for start, end in zip(starts, ends):
+            total += end - start
+            self.capacity.append(total)
+
+    @classmethod
+    def from_time_frame(cls, time_frame: TimeFrame, base_time: Optional[datetime] = None) -> "WorkWindowIndex":
+        """
+            Builds the index of the work windows from base_time, or of the whole time frame without it. Code that only
+            schedules once from a known time (like the replan job) passes base_time, so only the windows from there on
+            are generated. The index in the time frame cache is built for the whole time frame, as it is shared by every
+            request until the time frame changes, and those look up windows from different times, including the start
+            of tasks in the past when tracking durations. It is only built once per version of the time frame, so the
+            requests only pay for the bisect in free_after.
+        """
+        return cls.from_slots(iterate_work_window_slots(time_frame, base_time))
+
+    @classmethod
+    def from_slots(cls, slots: Iterable[Tuple[datetime, datetime]]) -> "WorkWindowIndex":
+        """
+            Builds the index from (start, end) tuples. Windows are sorted and overlapping windows are merged,
+            so both arrays are sorted and the same time can never be handed out twice.
+        """
+        starts = array("q")
+        ends = array("q")
+        for start, end in sorted((to_epoch_us(start), to_epoch_us(end)) for start, end in slots):
+            if end <= start:
+                continue
+            if ends and start <= ends[-1]:
+                ends[-1] = max(ends[-1], end)
+                continue
+            starts.append(start)
+            ends.append(end)
+        return cls(starts, ends)
+
+    def __len__(self) -> int:
+        return len(self.starts)
+
+    def __iter__(self) -> Iterator[Tuple[datetime, datetime]]:
+        return iter(self.free_after(None))
+
+    def free_after(self, moment) -> "WorkWindowView":
+        """
+            Returns a view of the free work windows after moment. The window moment falls inside is trimmed
+            so it starts at moment. Nothing is copied, the view reads from the arrays of the index.
+        """
+        if moment is None:
+            return WorkWindowView(self, 0, self.starts[0] if self.starts else 0)
+        moment_us = moment if isinstance(moment, int) else to_epoch_us(moment)
+        # First window that ends after moment
+        position = bisect_right(self.ends, moment_us)
+        if position == len(self.starts):
+            return WorkWindowView(self, position, moment_us)
+        return WorkWindowView(self, position, max(self.starts[position], moment_us))
+
+    def total_capacity(self) -> timedelta:
+        return timedelta(microseconds=self.capacity[-1] if self.capacity else 0)
+
+    def used_capacity(self, moment_us: int) -> int:
+        """
+            Work time in microseconds from the beginning of the time frame until moment_us.
+        """
+        position = bisect_right(self.ends, moment_us)
+        used = self.capacity[position - 1] if position else 0
+        # Add the part of the window moment_us falls inside
+        if position < len(self.starts) and moment_us > self.starts[position]:
+            used += moment_us - self.starts[position]
+        return used
+
+    def remaining_after(self, moment: datetime) -> timedelta:
+        """
+            How much work time is left in the time frame after moment.
+        """
+        used = self.used_capacity(to_epoch_us(moment))
+        return self.total_capacity() - timedelta(microseconds=used)
+
+    def finish_time(self, work: timedelta, after: datetime) -> Optional[datetime]:
+        """
+            When the given amount of work would be done if it starts after the given time. Gives the same end as
+            scheduling a single task with schedule_tasks. Returns None if it does not fit in the time frame.
+        """
+        if work <= timedelta(0):
+            return after
+        target = self.used_capacity(to_epoch_us(after)) + work // ONE_MICROSECOND
+        # First window where the running total reaches the target
+        position = bisect_left(self.capacity, target)
+        if position == len(self.capacity):
+            return None
+        capacity_before = self.capacity[position] - (self.ends[position] - self.starts[position])
+        return from_epoch_us(self.starts[position] + (target - capacity_before))
+
+
+class WorkWindowView:
+    """
+        Read only view of the windows in a WorkWindowIndex from a position and onwards. Behaves like a list
+        of (start, end) datetime tuples, but the datetimes are only created when they are read.
+    """
+    __slots__ = ("index", "offset", "first_start")
+
+    def __init__(self, index: WorkWindowIndex, offset: int, first_start: int):
+        self.index = index
+        self.offset = offset
+        self.first_start = first_start
+
+    def __len__(self) -> int:
+        return len(self.index.starts) - self.offset
+
+    def __bool__(self) -> bool:
+        return len(self) > 0
+
+    def __getitem__(self, position: int) -> Tuple[datetime, datetime]:
+        start, end = self.epoch_window(position)
+        return (from_epoch_us(start), from_epoch_us(end))
+
+    def __iter__(self) -> Iterator[Tuple[datetime, datetime]]:
+        for position in range(len(self)):
+            yield self[position]
+
+    def epoch_window(self, position: int) -> Tuple[int, int]:
+        """
+            Same as indexing the view, but returns the window as epoch microseconds.
+        """
+        if position < 0:
+            position += len(self)
+        if not 0 <= position < len(self):
+            raise IndexError("work window index out of range")
+        start = self.first_start if position == 0 else self.index.starts[self.offset + position]
+        return (start, self.index.ends[self.offset + position])
+
+    def iterate_epoch(self) -> Iterator[Tuple[int, int]]:
+        """
+            Iterates the windows as epoch microseconds, used by the scheduler so no datetimes are created.
+        """
+        starts, ends = self.index.starts, self.index.ends
+        for position in range(self.offset, len(starts)):
+            yield (self.first_start if position == self.offset else starts[position], ends[position])
+
+    def epoch_arrays(self) -> Tuple[np.ndarray, np.ndarray]:
+        """
+            The start and end of the windows in the view as numpy arrays, used by the vectorized scheduler.
+            The ends share memory with the index, only the starts are copied because the first one is trimmed.
+        """
+        starts = np.frombuffer(self.index.starts, dtype=np.int64)[self.offset:].copy()
+        ends = np.frombuffer(self.index.ends, dtype=np.int64)[self.offset:]
+        if len(starts):
+            starts[0] = self.first_start
+        return starts, ends
+
+    def free_after(self, moment) -> "WorkWindowView":
+        """
+            Trim the view further, the same way as WorkWindowIndex.free_after.
+        """
+        moment_us = moment if isinstance(moment, int) else to_epoch_us(moment)
+        return self.index.free_after(max(moment_us, self.first_start))
@@ -0,0 +1,176 @@
+# Throughput of concurrent requests against MongoDB, with the blocking client called straight from coroutines (how
+# the async routes used the database before), with the blocking client in the threadpool (how the task mutations ran
+# for a while), and with the async client the routes use now. Every simulated request does the round trips of a
+# typical read, a find_one by id and a small sorted find, and the requests run in a single event loop like in one
+# uvicorn worker. The results are written to JSON so two commits can be compared.
+#
+# Needs DB_URI in .env. The documents are written to a bench_concurrency collection that is dropped afterwards.
+#
+# Run from the root of the repository:
+#   python -m benchmarks.bench_concurrency                          # writes benchmarks/results/concurrency-<commit>.json
+#   python -m benchmarks.bench_concurrency --concurrency 1 50 --requests 200
+#   python -m benchmarks.bench_concurrency --compare benchmarks/results/concurrency-a.json benchmarks/results/concurrency-b.json
+
+import argparse
+import asyncio
+import json
+import platform
+import random
+import time
+from datetime import datetime, timezone
+from functools import lru_cache
+from pathlib import Path
+from statistics import quantiles
+from uuid import uuid4
+
+from fastapi.concurrency import run_in_threadpool
+
+from app.database.mongodb import create_async_client, get_blocking_database
+from app.settings import get_settings
+from benchmarks.bench_scheduler import RESULTS_DIRECTORY, git_commit
+
+COLLECTION = "bench_concurrency"
+DOCUMENTS = 2000
+GROUPS = 100
+CONCURRENCY = [1, 10, 50, 100]
+MODES = ["sync", "threadpool", "async"]
+
+
+@lru_cache(maxsize=None)
+def async_database():
+    # The async client is made the first time a request runs, so it belongs to the event loop of the benchmark
+    return create_async_client(get_settings()).db
+
+
+def seed() -> list:
+    collection = get_blocking_database()[COLLECTION]
+    collection.drop()
+    documents = [
+        {"_id": uuid4(), "group": number % GROUPS, "rank": number, "title": f"Document {number}", "created_at": datetime.now(timezone.utc)}
+        for number in range(DOCUMENTS)
+    ]
+    collection.insert_many(documents)
+    collection.create_index([("group", 1), ("rank", 1)])
+    return [document["_id"] for document in documents]
+
+# One simulated request for each of the modes
+def sync_request(document_id, group: int) -> None:
+    collection = get_blocking_database()[COLLECTION]
+    collection.find_one({"_id": document_id})
+    list(collection.find({"group": group}).sort("rank", 1).limit(20))
+
+async def blocking_request(document_id, group: int) -> None:
+    # The blocking calls hold up the event loop, so the other coroutines wait for every round trip
+    sync_request(document_id, group)
+
+async def threadpool_request(document_id, group: int) -> None:
+    await run_in_threadpool(sync_request, document_id, group)
+
+async def async_request(document_id, group: int) -> None:
+    collection = async_database()[COLLECTION]
+    await collection.find_one({"_id": document_id})
+    await collection.find({"group": group}).sort("rank", 1).limit(20).to_list()
+
+REQUESTS = {"sync": blocking_request, "threadpool": threadpool_request, "async": async_request}
+
+
+async def run_level(mode: str, concurrency: int, total: int, ids: list) -> dict:
+    """
+        Runs total requests with concurrency of them in flight at a time, returns the throughput and latencies.
+    """
+    request = REQUESTS[mode]
+    latencies = []
+    remaining = total
+
+    async def worker() -> None:
+        nonlocal remaining
+        while remaining > 0:
+            remaining -= 1
+            started = time.perf_counter()
+            await request(random.choice(ids), random.randrange(GROUPS))
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*[worker() for _ in range(concurrency)])
+    seconds = time.perf_counter() - started
+    percentiles = quantiles(latencies, n=100) if len(latencies) > 1 else latencies * 99
+    return {
+        "mode": mode,
+        "concurrency": concurrency,
+        "requests": total,
+        "seconds": seconds,
+        "requests_per_second": total / seconds,
+        "latency_p50_ms": percentiles[49] * 1000,
+        "latency_p95_ms": percentiles[94] * 1000,
+        "latency_p99_ms": percentiles[98] * 1000,
+    }
+
+async def run(modes: list, levels: list, total: int, ids: list) -> list:
+    results = []
+    # A few requests first, so every mode starts with open connections
+    for mode in modes:
+        await run_level(mode, max(levels), max(levels), ids)
+    for concurrency in levels:
+        for mode in modes:
+            result = await run_level(mode, concurrency, total, ids)
+            results.append(result)
+            print(
+                f"{mode:10} {concurrency:>5} in flight {result['requests_per_second']:>10.1f} req/s "
+                f"p50 {result['latency_p50_ms']:>8.1f}ms p95 {result['latency_p95_ms']:>8.1f}ms"
+            )
+    return results
+
+
+def compare(before_path: str, after_path: str) -> None:
+    """
+        Prints the change in throughput for every mode and concurrency found in both files.
+    """
+    before = json.loads(Path(before_path).read_text())
+    after = json.loads(Path(after_path).read_text())
+    before_results = {(result["mode"], result["concurrency"]): result for result in before["results"]}
+    print(f"{before['meta']['commit']} -> {after['meta']['commit']}")
+    print(f"{'mode':10} {'in flight':>9} {'req/s':>10} {'speedup':>8} {'p95':>10}")
+    for result in after["results"]:
+        old = before_results.get((result["mode"], result["concurrency"]))
+        if old is None:
+            continue
+        speedup = result["requests_per_second"] / old["requests_per_second"]
+        print(f"{result['mode']:10} {result['concurrency']:>9} {result['requests_per_second']:>10.1f} {speedup:>7.2f}x {result['latency_p95_ms']:>8.1f}ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark concurrent requests with the blocking and the async MongoDB client")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=CONCURRENCY, help="Requests in flight at a time")
+    parser.add_argument("--requests", type=int, default=1000, help="Number of requests for each mode and concurrency")
+    parser.add_argument("--modes", nargs="+", choices=MODES, default=MODES)
+    parser.add_argument("--output", help="Where to write the JSON results, defaults to benchmarks/results/concurrency-<commit>.json")
+    parser.add_argument("--compare", nargs=2, metavar=("BEFORE", "AFTER"), help="Compare two result files instead of running")
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    ids = seed()
+    try:
+        results = asyncio.run(run(args.modes, args.concurrency, args.requests, ids))
+    finally:
+        get_blocking_database()[COLLECTION].drop()
+
+    commit = git_commit()
+    output = Path(args.output) if args.output else RESULTS_DIRECTORY / f"concurrency-{commit}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps({
+        "meta": {
+            "commit": commit,
+            "python": platform.python_version(),
+            "created_at": datetime.now(timezone.utc).isoformat(),
+            "documents": DOCUMENTS,
+        },
+        "results": results,
+    }, indent=2))
+    print(f"Results written to {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,228 @@
+# Micro benchmarks for the scheduler and the TaskList helpers, using synthetic time frames and tasks.
+# Each scenario is timed a few times and run once under tracemalloc for the peak memory, and the results are
+# written to JSON so two commits can be compared.
+#
+# Run from the root of the repository:
+#   python -m benchmarks.bench_scheduler                 # full matrix, writes benchmarks/results/<commit>.json
+#   python -m benchmarks.bench_scheduler --quick         # smaller matrix for a quick check
+#   python -m benchmarks.bench_scheduler --compare benchmarks/results/a.json benchmarks/results/b.json
+
+import argparse
+import json
+import platform
+import subprocess
+import time
+import tracemalloc
+from datetime import datetime, timedelta, timezone
+from itertools import product
+from pathlib import Path
+from uuid import uuid4
+
+from app.models.task import Task
+from app.models.time_frame import TimeFrame
+from app.utils.scheduler import calculate_tracked_duration, generate_available_work_window_slots, schedule_tasks
+
+# The window index only exists from the commit that added it, older commits use TaskList.remaining_work_windows
+try:
+    from app.utils.work_windows import WorkWindowIndex
+except ImportError:
+    WorkWindowIndex = None
+
+# Same for the compact task records
+try:
+    from app.utils.scheduler import TaskRecord, schedule_records
+except ImportError:
+    TaskRecord = None
+
+RESULTS_DIRECTORY = Path(__file__).parent / "results"
+
+# 1 week to 2 years, 1 to 8 intervals per day and 10 to 10,000 tasks
+DAYS = [7, 30, 182, 730]
+INTERVALS_PER_DAY = [1, 2, 4, 8]
+TASK_COUNTS = [10, 100, 1000, 10000]
+QUICK_DAYS = [7, 182]
+QUICK_INTERVALS_PER_DAY = [2, 8]
+QUICK_TASK_COUNTS = [10, 1000]
+
+START = datetime(2025, 1, 6, tzinfo=timezone.utc)
+
+
+def build_time_frame(days: int, intervals_per_day: int) -> TimeFrame:
+    """
+        A time frame over the given number of days, with work intervals of 1 hour spread from 06:00 with
+        30 minutes between them, so 8 intervals ends at 17:30.
+    """
+    intervals = []
+    for number in range(intervals_per_day):
+        start = START.replace(hour=6) + timedelta(minutes=90 * number)
+        intervals.append({"start": start, "end": start + timedelta(hours=1)})
+    return TimeFrame(
+        user_id=uuid4(),
+        start_date=START,
+        end_date=START + timedelta(days=days - 1),
+        work_time_frame_intervals=intervals,
+        include_weekend=False,
+        created_at=START,
+    )
+
+def build_tasks(time_frame: TimeFrame, task_count: int, capacity_hours: float) -> list:
+    # Tasks are sized so they fill 80% of the time frame at most, which means they always fit
+    duration = round(min(1.5, capacity_hours * 0.8 / task_count), 4)
+    return [
+        Task(
+            time_frame_id=time_frame.time_frame_id,
+            title=f"Task {priority}",
+            priority=priority,
+            self_estimated_duration=duration,
+            tracked_duration=0,
+            start=START,
+            end=START,
+            category="reading",
+            completed=priority % 3 == 0,
+        )
+        for priority in range(1, task_count + 1)
+    ]
+
+
+def measure(function, repeat: int, setup=None) -> dict:
+    """
+        Times function repeat times and runs it once more under tracemalloc for the peak memory.
+        setup is called before each run, outside of the timing, and its result is passed to function.
+    """
+    timings = []
+    for _ in range(repeat):
+        argument = setup() if setup else None
+        started = time.perf_counter()
+        function(argument)
+        timings.append(time.perf_counter() - started)
+
+    argument = setup() if setup else None
+    tracemalloc.start()
+    function(argument)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        "seconds_best": min(timings),
+        "seconds_mean": sum(timings) / len(timings),
+        "peak_bytes": peak,
+    }
+
+def remaining_work_windows_benchmark(time_frame: TimeFrame, slots: list, tasks: list):
+    """
+        Finds the free windows after every task end, like the delete and reschedule paths do.
+    """
+    moments = [task.start + timedelta(hours=task.self_estimated_duration * task.priority) for task in tasks[:100]]
+    if WorkWindowIndex is not None:
+        index = WorkWindowIndex.from_time_frame(time_frame)
+        return lambda _: [index.free_after(moment) for moment in moments]
+    from app.controllers.task import TaskList
+    task_list = TaskList(None, None, None)
+    return lambda _: [task_list.remaining_work_windows(slots, moment) for moment in moments]
+
+def run_scenario(days: int, intervals_per_day: int, task_count: int, repeat: int) -> list:
+    time_frame = build_time_frame(days, intervals_per_day)
+    slots = generate_available_work_window_slots(time_frame)
+    capacity_hours = sum((end - start for start, end in slots), timedelta()).total_seconds() / 3600
+    tasks = build_tasks(time_frame, task_count, capacity_hours)
+    windows = WorkWindowIndex.from_time_frame(time_frame) if WorkWindowIndex is not None else slots
+    # The scheduler changes the tasks it is given, so every run gets its own copies
+    copies = lambda: [task.model_copy() for task in tasks]
+    completed = [task for task in schedule_tasks(copies(), slots) if task.completed]
+
+    benchmarks = {
+        "generate_available_work_window_slots": (lambda _: generate_available_work_window_slots(time_frame), None),
+        "schedule_tasks": (lambda task_copies: schedule_tasks(task_copies, windows), copies),
+        "remaining_work_windows": (remaining_work_windows_benchmark(time_frame, slots, tasks), None),
+        "calculate_tracked_duration": (
+            lambda _: [
+                calculate_tracked_duration(task.start, task.end, time_frame.work_time_frame_intervals)
+                for task in completed
+            ],
+            None,
+        ),
+    }
+    if TaskRecord is not None:
+        benchmarks["schedule_records"] = (
+            lambda records: schedule_records(records, windows),
+            lambda: [TaskRecord.from_task(task) for task in tasks],
+        )
+    scenario = {"days": days, "intervals_per_day": intervals_per_day, "tasks": task_count, "windows": len(slots)}
+    results = []
+    for name, (function, setup) in benchmarks.items():
+        results.append({"name": name, "scenario": scenario, **measure(function, repeat, setup)})
+    return results
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+def result_key(result: dict) -> tuple:
+    scenario = result["scenario"]
+    return (result["name"], scenario["days"], scenario["intervals_per_day"], scenario["tasks"])
+
+def compare(before_path: str, after_path: str) -> None:
+    """
+        Prints the change in time and peak memory for every benchmark found in both files.
+    """
+    before = json.loads(Path(before_path).read_text())
+    after = json.loads(Path(after_path).read_text())
+    before_results = {result_key(result): result for result in before["results"]}
+    print(f"{before['meta']['commit']} -> {after['meta']['commit']}")
+    print(f"{'benchmark':40} {'days':>5} {'ivl':>4} {'tasks':>6} {'time':>10} {'speedup':>8} {'peak':>10} {'memory':>8}")
+    for result in after["results"]:
+        old = before_results.get(result_key(result))
+        if old is None:
+            continue
+        name, days, intervals, tasks = result_key(result)
+        speedup = old["seconds_best"] / result["seconds_best"] if result["seconds_best"] else float("inf")
+        memory = old["peak_bytes"] / result["peak_bytes"] if result["peak_bytes"] else float("inf")
+        print(
+            f"{name:40} {days:>5} {intervals:>4} {tasks:>6} {result['seconds_best'] * 1000:>8.2f}ms "
+            f"{speedup:>7.1f}x {result['peak_bytes'] / 1024:>8.0f}kB {memory:>7.1f}x"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the scheduler with synthetic time frames")
+    parser.add_argument("--quick", action="store_true", help="Run a smaller matrix")
+    parser.add_argument("--repeat", type=int, default=5, help="Number of timed runs per benchmark")
+    parser.add_argument("--output", help="Where to write the JSON results, defaults to benchmarks/results/<commit>.json")
+    parser.add_argument("--compare", nargs=2, metavar=("BEFORE", "AFTER"), help="Compare two result files instead of running")
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    matrix = product(
+        QUICK_DAYS if args.quick else DAYS,
+        QUICK_INTERVALS_PER_DAY if args.quick else INTERVALS_PER_DAY,
+        QUICK_TASK_COUNTS if args.quick else TASK_COUNTS,
+    )
+    results = []
+    for days, intervals_per_day, task_count in matrix:
+        print(f"{days} days, {intervals_per_day} intervals per day, {task_count} tasks")
+        for result in run_scenario(days, intervals_per_day, task_count, args.repeat):
+            results.append(result)
+            print(f"  {result['name']:40} {result['seconds_best'] * 1000:>10.2f}ms {result['peak_bytes'] / 1024:>10.0f}kB")
+
+    commit = git_commit()
+    output = Path(args.output) if args.output else RESULTS_DIRECTORY / f"{commit}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps({
+        "meta": {
+            "commit": commit,
+            "python": platform.python_version(),
+            "created_at": datetime.now(timezone.utc).isoformat(),
+            "repeat": args.repeat,
+        },
+        "results": results,
+    }, indent=2))
+    print(f"Results written to {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+# Cold start cost of the server. Every run starts a fresh interpreter (like a new uvicorn worker or the executable
+# from py_installer.py) and times importing app.main, and then starting and stopping the app through its lifespan,
+# which makes the MongoDB client and creates the missing indexes. One more run with python -X importtime lists the
+# modules that take the longest to import. The results are written to JSON so two commits can be compared.
+#
+# The import needs nothing, the startup needs the settings in .env. Set DB_ENSURE_INDEXES=false to leave the index
+# round trips out of the startup time, and use --import-only when there is no database at all.
+#
+# Run from the root of the repository:
+#   python -m benchmarks.bench_startup                       # writes benchmarks/results/startup-<commit>.json
+#   python -m benchmarks.bench_startup --import-only --repeat 20
+#   python -m benchmarks.bench_startup --compare benchmarks/results/startup-a.json benchmarks/results/startup-b.json
+
+import argparse
+import json
+import platform
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+from statistics import median
+
+from benchmarks.bench_scheduler import RESULTS_DIRECTORY, git_commit
+
+ROOT = Path(__file__).parent.parent
+SLOWEST_MODULES = 15
+
+# Runs in the fresh interpreter and prints the timings as JSON on the last line
+CHILD = """
+import asyncio, json, sys, time
+started = time.perf_counter()
+from app.main import app
+imported = time.perf_counter()
+timings = {"import_seconds": imported - started, "startup_seconds": None, "shutdown_seconds": None}
+
+async def lifespan():
+    async with app.router.lifespan_context(app):
+        timings["startup_seconds"] = time.perf_counter() - imported
+        stopping = time.perf_counter()
+    timings["shutdown_seconds"] = time.perf_counter() - stopping
+
+if sys.argv[1] == "startup":
+    asyncio.run(lifespan())
+print(json.dumps(timings))
+"""
+
+
+def run_once(startup: bool) -> dict:
+    """
+        Times one cold start, the process time includes starting the interpreter itself.
+    """
+    command = [sys.executable, "-c", CHILD, "startup" if startup else "import"]
+    started = time.perf_counter()
+    result = subprocess.run(command, cwd=ROOT, capture_output=True, text=True)
+    process_seconds = time.perf_counter() - started
+    if result.returncode != 0:
+        raise RuntimeError(f"The cold start failed:\n{result.stderr}")
+    timings = json.loads(result.stdout.strip().splitlines()[-1])
+    timings["process_seconds"] = process_seconds
+    return timings
+
+def slowest_modules(count: int) -> list:
+    """
+        The modules with the highest import time of their own (without the modules they import) from -X importtime.
+    """
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", "import app.main"], cwd=ROOT, capture_output=True, text=True)
+    modules = []
+    for line in result.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        own, cumulative, name = line[len("import time:"):].split("|")
+        modules.append({"module": name.strip(), "self_ms": int(own) / 1000, "cumulative_ms": int(cumulative) / 1000})
+    return sorted(modules, key=lambda module: module["self_ms"], reverse=True)[:count]
+
+
+def summary(runs: list, key: str) -> dict:
+    values = [run[key] for run in runs if run[key] is not None]
+    if not values:
+        return {"best_ms": None, "median_ms": None}
+    return {"best_ms": min(values) * 1000, "median_ms": median(values) * 1000}
+
+def compare(before_path: str, after_path: str) -> None:
+    """
+        Prints the change in the median of every timing found in both files.
+    """
+    before = json.loads(Path(before_path).read_text())
+    after = json.loads(Path(after_path).read_text())
+    print(f"{before['meta']['commit']} -> {after['meta']['commit']}")
+    print(f"{'timing':10} {'before':>10} {'after':>10} {'speedup':>8}")
+    for name, result in after["results"].items():
+        old = before["results"].get(name, {}).get("median_ms")
+        new = result["median_ms"]
+        if old is None or new is None:
+            continue
+        print(f"{name:10} {old:>8.1f}ms {new:>8.1f}ms {old / new:>7.2f}x")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark how long the server takes to import and start")
+    parser.add_argument("--repeat", type=int, default=10, help="Number of cold starts")
+    parser.add_argument("--import-only", action="store_true", help="Only time the import, the startup needs a database")
+    parser.add_argument("--output", help="Where to write the JSON results, defaults to benchmarks/results/startup-<commit>.json")
+    parser.add_argument("--compare", nargs=2, metavar=("BEFORE", "AFTER"), help="Compare two result files instead of running")
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    # The first start fills the bytecode cache, so it is not counted
+    run_once(startup=False)
+    runs = [run_once(startup=not args.import_only) for _ in range(args.repeat)]
+    results = {name: summary(runs, f"{name}_seconds") for name in ["process", "import", "startup", "shutdown"]}
+    for name, result in results.items():
+        if result["median_ms"] is not None:
+            print(f"{name:10} best {result['best_ms']:>8.1f}ms median {result['median_ms']:>8.1f}ms")
+
+    modules = slowest_modules(SLOWEST_MODULES)
+    print("\nSlowest imports (own time)")
+    for module in modules:
+        print(f"{module['self_ms']:>8.1f}ms {module['cumulative_ms']:>8.1f}ms  {module['module']}")
+
+    commit = git_commit()
+    output = Path(args.output) if args.output else RESULTS_DIRECTORY / f"startup-{commit}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps({
+        "meta": {
+            "commit": commit,
+            "python": platform.python_version(),
+            "created_at": datetime.now(timezone.utc).isoformat(),
+            "repeat": args.repeat,
+            "import_only": args.import_only,
+        },
+        "results": results,
+        "slowest_modules": modules,
+    }, indent=2))
+    print(f"Results written to {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,391 @@
+# In-memory stand-ins for the async MongoDB collections, with just enough of the query language for the controllers.
+# Every call that would be a round trip to MongoDB is counted through the command listener in app/database/monitoring.py,
+# so the counts per request are the same ones the X-DB-Commands header shows. Like pymongo, a bulk write is one command
+# per kind of operation (insert, update, delete), and a cursor is one command when it is read.
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+from typing import Dict, List, Optional
+from uuid import UUID, uuid4
+
+from pymongo import DeleteOne, InsertOne, ReturnDocument, UpdateOne
+
+from app.database.monitoring import command_counter
+
+MISSING = object()
+
+
+# MongoDB compares values of different types by the order of their type, and $gt/$lt only match values of the same
+# type, so e.g. {"rank": {"$gt": None}} never matches a number
+def type_order(value) -> int:
+    if value is None or value is MISSING:
+        return 1
+    if isinstance(value, bool):
+        return 8
+    if isinstance(value, (int, float)):
+        return 2
+    if isinstance(value, str):
+        return 3
+    if isinstance(value, dict):
+        return 4
+    if isinstance(value, list):
+        return 5
+    if isinstance(value, UUID):
+        return 6
+    if isinstance(value, datetime):
+        return 9
+    raise TypeError(f"Cannot compare {value!r}")
+
+def sort_key(value):
+    order = type_order(value)
+    return (order, 0) if order == 1 else (order, value)
+
+def get_path(document: dict, path: str):
+    value = document
+    for part in path.split("."):
+        if not isinstance(value, dict) or part not in value:
+            return MISSING
+        value = value[part]
+    return value
+
+def set_path(document: dict, path: str, value) -> None:
+    *parents, last = path.split(".")
+    for part in parents:
+        document = document.setdefault(part, {})
+    document[last] = value
+
+def compare(value, operator: str, operand) -> bool:
+    if type_order(value) != type_order(operand):
+        return False
+    first, second = sort_key(value), sort_key(operand)
+    return {"$gt": first > second, "$gte": first >= second, "$lt": first < second, "$lte": first <= second}[operator]
+
+def equal(value, operand) -> bool:
+    if operand is None:
+        return value is None or value is MISSING
+    return value is not MISSING and value == operand
+
+def matches(document: dict, query: dict) -> bool:
+    for key, condition in query.items():
+        if key == "$and":
+            if not all(matches(document, part) for part in condition):
+                return False
+            continue
+        if key == "$or":
+            if not any(matches(document, part) for part in condition):
+                return False
+            continue
+        value = get_path(document, key)
+        if isinstance(condition, dict) and condition and all(operator.startswith("$") for operator in condition):
+            for operator, operand in condition.items():
+                if operator in ("$gt", "$gte", "$lt", "$lte"):
+                    matched = compare(value, operator, operand)
+                elif operator == "$ne":
+                    matched = not equal(value, operand)
+                elif operator == "$in":
+                    matched = any(equal(value, option) for option in operand)
+                elif operator == "$exists":
+                    matched = (value is not MISSING) == operand
+                else:
+                    raise NotImplementedError(operator)
+                if not matched:
+                    return False
+        elif not equal(value, condition):
+            return False
+    return True
+
+def project(document: dict, projection: Optional[dict]) -> dict:
+    document = copy_document(document)
+    if not projection:
+        return document
+    if all(not included for included in projection.values()):
+        for path in projection:
+            *parents, last = path.split(".")
+            parent = document
+            for part in parents:
+                parent = parent.get(part, {})
+            parent.pop(last, None)
+        return document
+    kept = {"_id": document["_id"]} if projection.get("_id", 1) else {}
+    for path, included in projection.items():
+        value = get_path(document, path)
+        if included and value is not MISSING:
+            set_path(kept, path, value)
+    return kept
+
+def copy_document(document):
+    if isinstance(document, dict):
+        return {key: copy_document(value) for key, value in document.items()}
+    if isinstance(document, list):
+        return [copy_document(value) for value in document]
+    return document
+
+
+# The aggregation expressions used by the update pipelines of the controllers
+def evaluate(expression, document: dict, variables: Dict[str, object]):
+    if isinstance(expression, str) and expression.startswith("$$"):
+        name, _, path = expression[2:].partition(".")
+        value = variables[name]
+        return get_path(value, path) if path else value
+    if isinstance(expression, str) and expression.startswith("$"):
+        value = get_path(document, expression[1:])
+        return None if value is MISSING else value
+    if isinstance(expression, list):
+        return [evaluate(value, document, variables) for value in expression]
+    if not isinstance(expression, dict):
+        return expression
+    if len(expression) == 1 and next(iter(expression)).startswith("$"):
+        operator, arguments = next(iter(expression.items()))
+        if operator == "$filter":
+            items = evaluate(arguments["input"], document, variables) or []
+            name = arguments.get("as", "this")
+            return [item for item in items if evaluate(arguments["cond"], document, {**variables, name: item})]
+        values = evaluate(arguments, document, variables)
+        if operator == "$concatArrays":
+            return [item for value in values for item in value]
+        if operator == "$ifNull":
+            return next((value for value in values if value is not None), None)
+        if operator == "$round":
+            return None if values[0] is None else round(values[0], values[1])
+        if operator == "$avg":
+            numbers = [value for value in (values if isinstance(values, list) else [values]) if isinstance(value, (int, float))]
+            return sum(numbers) / len(numbers) if numbers else None
+        if operator == "$ne":
+            return values[0] != values[1]
+        if operator == "$multiply":
+            result = 1
+            for value in values:
+                result *= value
+            return result
+        raise NotImplementedError(operator)
+    return {key: evaluate(value, document, variables) for key, value in expression.items()}
+
+def apply_update(document: dict, update) -> None:
+    if isinstance(update, list):
+        for stage in update:
+            (name, fields), = stage.items()
+            if name not in ("$set", "$addFields"):
+                raise NotImplementedError(name)
+            values = {path: evaluate(expression, document, {"ROOT": document}) for path, expression in fields.items()}
+            for path, value in values.items():
+                set_path(document, path, value)
+        return
+    for operator, fields in update.items():
+        for path, value in fields.items():
+            if operator == "$set":
+                set_path(document, path, value)
+            elif operator == "$inc":
+                current = get_path(document, path)
+                set_path(document, path, (0 if current is MISSING else current) + value)
+            elif operator == "$unset":
+                *parents, last = path.split(".")
+                parent = document
+                for part in parents:
+                    parent = parent.get(part, {})
+                parent.pop(last, None)
+            else:
+                raise NotImplementedError(operator)
+
+
+class FakeCursor:
+    def __init__(self, collection: "FakeCollection", load, command: Optional[str]):
+        self.collection = collection
+        self.load = load
+        # The command is counted when the cursor is read, like the find of a real cursor
+        self.command = command
+        self.sort_keys: List = []
+        self.limit_to: Optional[int] = None
+        self.results: Optional[List[dict]] = None
+
+    def sort(self, keys, direction: int = 1) -> "FakeCursor":
+        self.sort_keys = [(keys, direction)] if isinstance(keys, str) else list(keys)
+        return self
+
+    def limit(self, count: int) -> "FakeCursor":
+        self.limit_to = count
+        return self
+
+    def read(self) -> List[dict]:
+        if self.results is None:
+            if self.command is not None:
+                self.collection.database.count_command(self.command)
+            documents = self.load()
+            for key, direction in reversed(self.sort_keys):
+                documents.sort(key=lambda document: sort_key(get_path(document, key)), reverse=direction < 0)
+            if self.limit_to:
+                documents = documents[:self.limit_to]
+            self.results = documents
+        return self.results
+
+    async def to_list(self, length: Optional[int] = None) -> List[dict]:
+        documents = self.read()
+        return documents[:length] if length else list(documents)
+
+    def __aiter__(self):
+        return self.iterate()
+
+    async def iterate(self):
+        for document in self.read():
+            yield document
+
+
+class FakeCollection:
+    def __init__(self, database: "FakeDatabase", name: str):
+        self.database = database
+        self.name = name
+        self.full_name = f"{database.name}.{name}"
+        self.documents: Dict[object, dict] = {}
+
+    def matching(self, query: Optional[dict]) -> List[dict]:
+        return [document for document in self.documents.values() if matches(document, query or {})]
+
+    def find(self, query: Optional[dict] = None, projection: Optional[dict] = None) -> FakeCursor:
+        return FakeCursor(self, lambda: [project(document, projection) for document in self.matching(query)], "find")
+
+    async def find_one(self, query: Optional[dict] = None, projection: Optional[dict] = None) -> Optional[dict]:
+        self.database.count_command("find")
+        found = self.matching(query)
+        return project(found[0], projection) if found else None
+
+    async def count_documents(self, query: dict) -> int:
+        self.database.count_command("aggregate")
+        return len(self.matching(query))
+
+    async def aggregate(self, pipeline: List[dict]) -> FakeCursor:
+        self.database.count_command("aggregate")
+        documents = [copy_document(document) for document in self.documents.values()]
+        for stage in pipeline:
+            (name, argument), = stage.items()
+            if name == "$match":
+                documents = [document for document in documents if matches(document, argument)]
+            elif name == "$project":
+                documents = [project(document, argument) for document in documents]
+            elif name == "$lookup":
+                foreign = self.database[argument["from"]]
+                for document in documents:
+                    value = get_path(document, argument["localField"])
+                    document[argument["as"]] = [
+                        copy_document(other) for other in foreign.documents.values()
+                        if get_path(other, argument["foreignField"]) == value
+                    ]
+            else:
+                raise NotImplementedError(name)
+        return FakeCursor(self, lambda: documents, None)
+
+    async def insert_one(self, document: dict):
+        self.database.count_command("insert")
+        self.documents[document["_id"]] = copy_document(document)
+        return SimpleNamespace(inserted_id=document["_id"])
+
+    async def update_one(self, query: dict, update, upsert: bool = False):
+        self.database.count_command("update")
+        found = self.matching(query)
+        if found:
+            apply_update(found[0], update)
+        return SimpleNamespace(matched_count=len(found[:1]), modified_count=len(found[:1]))
+
+    async def delete_one(self, query: dict):
+        self.database.count_command("delete")
+        found = self.matching(query)
+        if found:
+            del self.documents[found[0]["_id"]]
+        return SimpleNamespace(deleted_count=len(found[:1]))
+
+    async def find_one_and_update(self, query: dict, update, projection: Optional[dict] = None, return_document=ReturnDocument.BEFORE):
+        self.database.count_command("findAndModify")
+        found = self.matching(query)
+        if not found:
+            return None
+        before = project(found[0], projection)
+        apply_update(found[0], update)
+        return project(found[0], projection) if return_document == ReturnDocument.AFTER else before
+
+    async def bulk_write(self, operations: List, ordered: bool = True, session=None):
+        # pymongo sends one command per run of the same kind of operation, or per kind when the order does not matter
+        kinds = [{InsertOne: "insert", UpdateOne: "update", DeleteOne: "delete"}[type(operation)] for operation in operations]
+        if ordered:
+            commands = [kind for position, kind in enumerate(kinds) if position == 0 or kind != kinds[position - 1]]
+        else:
+            commands = list(dict.fromkeys(kinds))
+        for command in commands:
+            self.database.count_command(command)
+        for operation in operations:
+            if isinstance(operation, InsertOne):
+                self.documents[operation._doc["_id"]] = copy_document(operation._doc)
+            elif isinstance(operation, UpdateOne):
+                found = self.matching(operation._filter)
+                if found:
+                    apply_update(found[0], operation._doc)
+            elif isinstance(operation, DeleteOne):
+                found = self.matching(operation._filter)
+                if found:
+                    del self.documents[found[0]["_id"]]
+            else:
+                raise NotImplementedError(type(operation).__name__)
+        return SimpleNamespace(acknowledged=True)
+
+
+class FakeDatabase:
+    def __init__(self, name: str = "test"):
+        self.name = name
+        self.collections: Dict[str, FakeCollection] = {}
+        self.commands: List[str] = []
+
+    def __getitem__(self, name: str) -> FakeCollection:
+        if name not in self.collections:
+            self.collections[name] = FakeCollection(self, name)
+        return self.collections[name]
+
+    def __getattr__(self, name: str) -> FakeCollection:
+        if name.startswith("__"):
+            raise AttributeError(name)
+        return self[name]
+
+    def count_command(self, name: str) -> None:
+        self.commands.append(name)
+        command_counter.started(SimpleNamespace(command_name=name))
+
+    # Documents for the tests, stored straight into the collections without counting anything
+    def add_user(self) -> dict:
+        user = {"_id": uuid4(), "username": f"user-{uuid4().hex[:8]}", "estimation_average_for_category": {}}
+        self.user.documents[user["_id"]] = user
+        return user
+
+    def add_time_frame(self, user_id: UUID, days: int = 30) -> dict:
+        today = datetime.now(timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0)
+        time_frame = {
+            "_id": uuid4(),
+            "user_id": user_id,
+            "start_date": today - timedelta(days=1),
+            "end_date": today + timedelta(days=days),
+            "work_time_frame_intervals": [
+                {"start": datetime(2025, 1, 1, 8, tzinfo=timezone.utc), "end": datetime(2025, 1, 1, 12, tzinfo=timezone.utc)},
+                {"start": datetime(2025, 1, 1, 13, tzinfo=timezone.utc), "end": datetime(2025, 1, 1, 17, tzinfo=timezone.utc)},
+            ],
+            "include_weekend": True,
+            "created_at": today,
+            "schedule_version": 0,
+        }
+        self.time_frame.documents[time_frame["_id"]] = time_frame
+        return time_frame
+
+    def add_task(self, time_frame_id: UUID, title: str, priority: int, rank: Optional[float], hours: float = 1.0, start: Optional[datetime] = None) -> dict:
+        start = start or datetime.now(timezone.utc).replace(microsecond=0) + timedelta(days=1, hours=priority)
+        task = {
+            "_id": uuid4(),
+            "time_frame_id": time_frame_id,
+            "title": title,
+            "priority": priority,
+            "self_estimated_duration": hours,
+            "tracked_duration": 0,
+            "start": start,
+            "end": start + timedelta(hours=hours),
+            "category": "reading",
+            "description": "",
+            "completed": False,
+            "finished": None,
+        }
+        # Tasks stored before ranks existed have no rank at all
+        if rank is not None:
+            task["rank"] = rank
+        self.task.documents[task["_id"]] = task
+        return task
@@ -0,0 +1,103 @@
+# Run from the root of the repository: python -m unittest discover tests
+import unittest
+from datetime import datetime, timedelta, timezone
+
+from app.controllers.task import TaskList
+from app.controllers.user import UserList
+from app.database.monitoring import COMMAND_BUDGETS, command_counter
+from app.models.task import CreateTask, TaskCategory, UpdateTask
+from app.routes.task import build_task
+from app.utils.reschedule_coalescer import reschedule_coalescer
+
+from fake_collections import FakeDatabase
+
+
+class CommandBudgetTest(unittest.IsolatedAsyncioTestCase):
+    """
+        Every task endpoint sends at most the number of commands in COMMAND_BUDGETS. Each test sends what the route in
+        app/routes/task.py does, counted by the command listener the same way as for a real request.
+    """
+    def setUp(self):
+        self.window = reschedule_coalescer.window
+        reschedule_coalescer.window = 0
+        self.database = FakeDatabase()
+        self.tasks = TaskList(self.database.task, self.database.time_frame, self.database.user)
+        self.user = self.database.add_user()
+        self.time_frame = self.database.add_time_frame(self.user["_id"])
+        now = datetime.now(timezone.utc).replace(microsecond=0)
+        # The first one is in progress, so it can be completed
+        self.stored = [self.database.add_task(self.time_frame["_id"], "first", 1, 1024.0, start=now - timedelta(hours=2))]
+        self.stored += [self.database.add_task(self.time_frame["_id"], f"task {priority}", priority, priority * 1024.0) for priority in range(2, 6)]
+
+    def tearDown(self):
+        reschedule_coalescer.window = self.window
+
+    async def assertWithinBudget(self, endpoint: str, *calls):
+        request_commands = command_counter.start_request()
+        for call in calls:
+            await call()
+        self.assertLessEqual(request_commands.count, COMMAND_BUDGETS[endpoint], f"{endpoint} sent {self.database.commands}")
+        return request_commands.count
+
+    def create_params(self, priority: int) -> CreateTask:
+        start = datetime.now(timezone.utc) + timedelta(days=2)
+        return CreateTask(title="new", priority=priority, self_estimated_duration=1.5, start=start, category=TaskCategory.reading)
+
+    async def test_create(self):
+        params = self.create_params(2)
+        time_frame_id = str(self.time_frame["_id"])
+        await self.assertWithinBudget(
+            "POST /v1/task/time-frame/{time_frame_id}",
+            lambda: UserList(self.database.user).suggestion_estimation(str(self.user["_id"]), params.category, params.self_estimated_duration),
+            lambda: self.tasks.create_task(build_task(time_frame_id, params)),
+        )
+        self.assertEqual(len(self.database.task.documents), 6)
+
+    async def test_create_batch(self):
+        params = [self.create_params(1), self.create_params(4), self.create_params(9)]
+        time_frame_id = str(self.time_frame["_id"])
+        await self.assertWithinBudget(
+            "POST /v1/task/time-frame/{time_frame_id}/batch",
+            lambda: UserList(self.database.user).suggestion_estimations(str(self.user["_id"]), [(item.category, item.self_estimated_duration) for item in params]),
+            lambda: self.tasks.create_tasks(self.time_frame["_id"], [build_task(time_frame_id, item) for item in params]),
+        )
+        self.assertEqual(len(self.database.task.documents), 8)
+
+    async def test_update_duration(self):
+        task_id = str(self.stored[1]["_id"])
+        await self.assertWithinBudget("PUT /v1/task/{task_id}", lambda: self.tasks.update_task(task_id, UpdateTask(self_estimated_duration=3)))
+
+    async def test_update_priority(self):
+        task_id = str(self.stored[4]["_id"])
+        await self.assertWithinBudget("PUT /v1/task/{task_id}", lambda: self.tasks.update_task(task_id, UpdateTask(priority=1)))
+
+    async def test_complete(self):
+        task_id = str(self.stored[0]["_id"])
+        await self.assertWithinBudget("PUT /v1/task/{task_id}", lambda: self.tasks.update_task(task_id, UpdateTask(completed=True)))
+        # The estimation history of the user is written along with the task
+        self.assertEqual(len(self.user["estimation_average_for_category"]["reading"]["history"]), 1)
+
+    async def test_delete(self):
+        task_id = str(self.stored[0]["_id"])
+        await self.assertWithinBudget("DELETE /v1/task/{task_id}", lambda: self.tasks.delete_task(task_id))
+        self.assertEqual(len(self.database.task.documents), 4)
+
+    async def test_reorder(self):
+        task_ids = [document["_id"] for document in reversed(self.stored)]
+        await self.assertWithinBudget(
+            "PUT /v1/task/time-frame/{time_frame_id}/reorder",
+            lambda: self.tasks.reorder_tasks(self.time_frame["_id"], task_ids),
+        )
+
+    async def test_find(self):
+        task_id = str(self.stored[2]["_id"])
+        await self.assertWithinBudget("GET /v1/task/{task_id}", lambda: self.tasks.find_specific_task(task_id))
+
+    async def test_list(self):
+        time_frame_id = str(self.time_frame["_id"])
+        await self.assertWithinBudget("GET /v1/task/time-frame/{time_frame_id}/find_all", lambda: self.tasks.find_all_time_frame_tasks(time_frame_id))
+        await self.assertWithinBudget("GET /v1/task/time-frame/{time_frame_id}/find_all", lambda: self.tasks.find_all_time_frame_tasks(time_frame_id, limit=2))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,71 @@
+# Run from the root of the repository: python -m unittest discover tests
+import unittest
+
+from app.controllers.task import TaskList
+from app.utils.pagination import keyset_page
+from app.utils.reschedule_coalescer import reschedule_coalescer
+
+from fake_collections import FakeDatabase
+
+
+class TaskPageTest(unittest.IsolatedAsyncioTestCase):
+    """
+        A time frame with tasks from before ranks existed (only a priority) mixed in between ranked tasks.
+    """
+    def setUp(self):
+        self.window = reschedule_coalescer.window
+        reschedule_coalescer.window = 0
+        self.database = FakeDatabase()
+        self.tasks = TaskList(self.database.task, self.database.time_frame, self.database.user)
+        user = self.database.add_user()
+        self.time_frame_id = self.database.add_time_frame(user["_id"])["_id"]
+        # Sorted by document_rank: old 1, new 1, old 2, new 2, old 3, new 3, new 4
+        for title, priority, rank in [
+            ("old 1", 1, None), ("old 2", 2, None), ("old 3", 3, None),
+            ("new 1", 1, 1536.0), ("new 2", 2, 2560.0), ("new 3", 3, 3584.0), ("new 4", 4, 5000.0),
+        ]:
+            self.database.add_task(self.time_frame_id, title, priority, rank)
+
+    def tearDown(self):
+        reschedule_coalescer.window = self.window
+
+    async def read_pages(self, limit: int) -> list:
+        pages = []
+        cursor = None
+        while True:
+            page = await self.tasks.find_all_time_frame_tasks(self.time_frame_id, limit=limit, cursor=cursor)
+            pages.append([(task["title"], task["priority"]) for task in page["data"]])
+            cursor = page["next_cursor"]
+            if cursor is None:
+                return pages
+
+    async def test_pages_follow_the_order_of_the_whole_list(self):
+        whole = await self.tasks.find_all_time_frame_tasks(self.time_frame_id)
+        expected = [(task["title"], task["priority"]) for task in whole["data"]]
+        self.assertEqual([title for title, _ in expected], ["old 1", "new 1", "old 2", "new 2", "old 3", "new 3", "new 4"])
+
+        pages = await self.read_pages(3)
+
+        self.assertEqual(len(pages), 3)
+        self.assertEqual([task for page in pages for task in page], expected)
+        # The old tasks were ranked by the first page, so the list reads the same afterwards
+        self.assertTrue(all("rank" in document for document in self.database.task.documents.values()))
+        again = await self.tasks.find_all_time_frame_tasks(self.time_frame_id)
+        self.assertEqual([(task["title"], task["priority"]) for task in again["data"]], expected)
+
+    async def test_cursor_after_a_task_without_rank(self):
+        # Straight on the collection, so nothing is ranked: after an unranked task the ranked ones still come
+        titles = []
+        cursor = None
+        while True:
+            documents, cursor, _ = await keyset_page(self.database.task, {"time_frame_id": self.time_frame_id}, ["rank", "_id"], 2, cursor)
+            titles += [document["title"] for document in documents]
+            if cursor is None:
+                break
+        self.assertEqual(len(titles), 7)
+        self.assertEqual(set(titles[:3]), {"old 1", "old 2", "old 3"})
+        self.assertEqual(titles[3:], ["new 1", "new 2", "new 3", "new 4"])
+
+
+if __name__ == "__main__":
+    unittest.main()
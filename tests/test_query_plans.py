@@ -0,0 +1,52 @@
+# Run from the root of the repository: python -m unittest discover tests
+#
+# Needs a mongod, TEST_DB_URI or mongodb://localhost:27017. The test makes a database of its own and drops it again,
+# and is skipped when there is no mongod to connect to.
+import os
+import unittest
+from uuid import uuid4
+
+from pymongo import AsyncMongoClient
+from pymongo.errors import PyMongoError
+
+from app.database.indexes import QueryRecorder, ensure_indexes, explain_queries
+
+TEST_DB_URI = os.getenv("TEST_DB_URI", "mongodb://localhost:27017")
+
+
+class QueryPlanTest(unittest.IsolatedAsyncioTestCase):
+    """
+        Every query the controllers send uses an index, the same check as python -m app.database.indexes --explain.
+    """
+    async def asyncSetUp(self):
+        self.recorder = QueryRecorder()
+        self.client = AsyncMongoClient(
+            TEST_DB_URI,
+            uuidRepresentation="standard",
+            tz_aware=True,
+            serverSelectionTimeoutMS=1000,
+            event_listeners=[self.recorder],
+        )
+        try:
+            await self.client.admin.command("ping")
+        except PyMongoError as error:
+            await self.client.close()
+            self.skipTest(f"No mongod at {TEST_DB_URI}: {error}")
+        self.database = self.client[f"test_query_plans_{uuid4().hex[:8]}"]
+
+    async def asyncTearDown(self):
+        await self.client.drop_database(self.database.name)
+        await self.client.close()
+
+    async def test_no_collection_scans(self):
+        await ensure_indexes(self.database)
+
+        plans = await explain_queries(self.database, self.recorder)
+
+        self.assertTrue(plans)
+        scans = [f"{source}: {description} ({' > '.join(stages)})" for source, description, stages in plans if "COLLSCAN" in stages]
+        self.assertEqual(scans, [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,212 @@
+# Run from the root of the repository: python -m unittest discover tests
+import asyncio
+import copy
+import io
+import unittest
+from contextlib import redirect_stdout
+from datetime import datetime, timedelta, timezone
+
+from fastapi import HTTPException
+
+from app.controllers.task import TaskList
+from app.models.task import UpdateTask
+from app.utils.reschedule_coalescer import RescheduleCoalescer, reschedule_coalescer
+
+from fake_collections import FakeDatabase
+
+WINDOW = 0.01
+
+
+# The task in a response is a model or a trusted document, depending on the path the update took
+def field(task, name: str):
+    return task[name] if isinstance(task, dict) else getattr(task, name)
+
+
+class RescheduleCoalescerTest(unittest.IsolatedAsyncioTestCase):
+    """
+        The coalescer on its own, with a run_batch that records the batches it is given.
+    """
+    def setUp(self):
+        self.coalescer = RescheduleCoalescer(window=WINDOW)
+        self.batches = []
+        self.release = None
+
+    async def run_batch(self, batch, stale):
+        self.batches.append(([pending.mutation for pending in batch], stale))
+        if self.release is not None:
+            await self.release.wait()
+        for pending in batch:
+            if pending.mutation.startswith("fail"):
+                pending.error = ValueError(pending.mutation)
+            else:
+                pending.result = pending.mutation.upper()
+
+    def submit(self, key, mutation, generation=0):
+        return self.coalescer.submit(key, mutation, self.run_batch, None, generation)
+
+    async def test_concurrent_mutations_share_a_batch(self):
+        results = await asyncio.gather(self.submit("a", "one"), self.submit("a", "two"), self.submit("a", "three"))
+
+        self.assertEqual(results, ["ONE", "TWO", "THREE"])
+        self.assertEqual(self.batches, [(["one", "two", "three"], False)])
+        self.assertEqual(self.coalescer.stats()["merged"], 2)
+        self.assertEqual(self.coalescer.stats()["active_time_frames"], 0)
+
+    async def test_time_frames_are_batched_apart(self):
+        await asyncio.gather(self.submit("a", "one"), self.submit("b", "two"), self.submit("a", "three"))
+
+        self.assertCountEqual(self.batches, [(["one", "three"], False), (["two"], False)])
+
+    async def test_mutations_arriving_while_a_batch_runs_get_the_next_batch(self):
+        self.release = asyncio.Event()
+        first = asyncio.ensure_future(self.submit("a", "one"))
+        while not self.batches:
+            await asyncio.sleep(0)
+        later = [asyncio.ensure_future(self.submit("a", name)) for name in ["two", "three"]]
+        await asyncio.sleep(WINDOW * 2)
+        # Only the first batch has started, the others wait for it to be done
+        self.assertEqual(len(self.batches), 1)
+        self.release.set()
+
+        self.assertEqual(await asyncio.gather(first, *later), ["ONE", "TWO", "THREE"])
+        self.assertEqual([mutations for mutations, _ in self.batches], [["one"], ["two", "three"]])
+
+    async def test_loaded_before_the_last_batch_is_stale(self):
+        generation = self.coalescer.generation()
+        await self.submit("a", "one", generation)
+        # Loaded before the batch above was done
+        await self.submit("a", "two", generation)
+        # Loaded after it, or another time frame
+        await self.submit("a", "three", self.coalescer.generation())
+        await self.submit("b", "four", generation)
+
+        self.assertEqual([stale for _, stale in self.batches], [False, True, False, False])
+        self.assertEqual(self.coalescer.stats()["reloads"], 1)
+
+    async def test_errors_go_to_their_own_caller(self):
+        results = await asyncio.gather(self.submit("a", "one"), self.submit("a", "fail two"), self.submit("a", "three"), return_exceptions=True)
+
+        self.assertEqual(results[0], "ONE")
+        self.assertIsInstance(results[1], ValueError)
+        self.assertEqual(results[2], "THREE")
+
+    async def test_cancelled_leader_hands_over_the_queue(self):
+        first = asyncio.ensure_future(self.submit("a", "one"))
+        await asyncio.sleep(0)
+        second = asyncio.ensure_future(self.submit("a", "two"))
+        await asyncio.sleep(0)
+        first.cancel()
+
+        self.assertEqual(await asyncio.wait_for(second, 1), "TWO")
+        self.assertEqual(self.batches, [(["one", "two"], False)])
+        self.assertEqual(self.coalescer.stats()["active_time_frames"], 0)
+
+
+class TaskListCoalescingTest(unittest.IsolatedAsyncioTestCase):
+    """
+        The task mutations through TaskList.coalesce and run_batch, on in-memory collections.
+    """
+    def setUp(self):
+        self.window = reschedule_coalescer.window
+        reschedule_coalescer.window = WINDOW
+        self.database = FakeDatabase()
+        self.user = self.database.add_user()
+        self.time_frame = self.database.add_time_frame(self.user["_id"])
+        now = datetime.now(timezone.utc).replace(microsecond=0)
+        self.stored = [self.database.add_task(self.time_frame["_id"], "first", 1, 1024.0, start=now - timedelta(hours=2))]
+        self.stored += [self.database.add_task(self.time_frame["_id"], f"task {priority}", priority, priority * 1024.0) for priority in range(2, 7)]
+
+    def tearDown(self):
+        reschedule_coalescer.window = self.window
+
+    def task_list(self, database: FakeDatabase) -> TaskList:
+        return TaskList(database.task, database.time_frame, database.user)
+
+    def placements(self, database: FakeDatabase) -> list:
+        tasks = sorted(database.task.documents.values(), key=lambda document: document["rank"])
+        return [(task["title"], task["self_estimated_duration"], task["start"], task["end"]) for task in tasks]
+
+    def task_id(self, position: int) -> str:
+        return str(self.stored[position]["_id"])
+
+    async def test_concurrent_updates_end_like_sequential_ones(self):
+        sequential = copy.deepcopy(self.database)
+        updates = [(self.task_id(1), 3.0), (self.task_id(3), 0.5), (self.task_id(4), 2.0)]
+        for task_id, hours in updates:
+            await self.task_list(sequential).update_task(task_id, UpdateTask(self_estimated_duration=hours))
+        batches = reschedule_coalescer.batches
+
+        tasks = self.task_list(self.database)
+        results = await asyncio.gather(*[tasks.update_task(task_id, UpdateTask(self_estimated_duration=hours)) for task_id, hours in updates])
+
+        # One batch with one bulk write, and the same schedule as one request after the other
+        self.assertEqual(reschedule_coalescer.batches, batches + 1)
+        self.assertEqual(self.database.commands.count("update"), 1)
+        self.assertEqual(self.placements(self.database), self.placements(sequential))
+        self.assertEqual([field(result["data"], "self_estimated_duration") for result in results], [3.0, 0.5, 2.0])
+
+    async def test_stale_tasks_are_loaded_again(self):
+        tasks = self.task_list(self.database)
+        generation = reschedule_coalescer.generation()
+        repository = await tasks.load_time_frame_tasks(self.time_frame["_id"])
+        # Another request changes the task after ours loaded it
+        await tasks.update_task(self.task_id(2), UpdateTask(self_estimated_duration=4))
+
+        async def mutation(unit, loaded):
+            return loaded, tasks.loaded_task(loaded, self.stored[2]["_id"]).self_estimated_duration
+
+        loaded, hours = await tasks.coalesce(self.time_frame["_id"], mutation, repository, generation)
+
+        self.assertIsNot(loaded, repository)
+        self.assertEqual(hours, 4)
+
+    async def test_failed_batch_runs_each_mutation_on_its_own(self):
+        tasks = self.task_list(self.database)
+        failed_batches = reschedule_coalescer.failed_batches
+        output = io.StringIO()
+        with redirect_stdout(output):
+            results = await asyncio.gather(
+                tasks.update_task(self.task_id(0), UpdateTask(completed=True)),
+                tasks.delete_task(self.task_id(3)),
+                # Loaded before the first delete ran, so it fails inside the batch
+                tasks.delete_task(self.task_id(3)),
+                tasks.update_task(self.task_id(5), UpdateTask(self_estimated_duration=2)),
+                return_exceptions=True,
+            )
+
+        self.assertEqual(field(results[0]["data"], "completed"), True)
+        self.assertEqual(results[1]["data"], {"deleted_task_id": self.task_id(3)})
+        self.assertIsInstance(results[2], HTTPException)
+        self.assertEqual(results[2].status_code, 404)
+        self.assertEqual(field(results[3]["data"], "self_estimated_duration"), 2)
+        self.assertEqual(reschedule_coalescer.failed_batches, failed_batches + 1)
+        # A 404 of one request is not a failure of the batch
+        self.assertEqual(output.getvalue(), "")
+        # Nothing of the failed batch was written, so the estimation history of the user only has the completion once
+        self.assertEqual(len(self.user["estimation_average_for_category"]["reading"]["history"]), 1)
+        self.assertEqual(len(self.database.task.documents), 5)
+
+    async def test_unexpected_errors_are_logged(self):
+        tasks = self.task_list(self.database)
+
+        async def broken(unit, loaded):
+            raise RuntimeError("broken")
+
+        async def working(unit, loaded):
+            return "done"
+
+        output = io.StringIO()
+        with redirect_stdout(output):
+            results = await asyncio.gather(
+                tasks.coalesce(self.time_frame["_id"], broken, None, 0),
+                tasks.coalesce(self.time_frame["_id"], working, None, 0),
+                return_exceptions=True,
+            )
+
+        self.assertIsInstance(results[0], RuntimeError)
+        self.assertEqual(results[1], "done")
+        self.assertIn("RuntimeError('broken')", output.getvalue())
+
+
+if __name__ == "__main__":
+    unittest.main()
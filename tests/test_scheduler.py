@@ -0,0 +1,22 @@
+# Run from the root of the repository: python -m unittest discover tests
+import unittest
+from uuid import uuid4
+
+from app.utils.scheduler import TaskRecord
+
+
+class TaskRecordTest(unittest.TestCase):
+    def test_with_placement_copies_every_other_slot(self):
+        record = TaskRecord(uuid4(), 2, 2048.0, 3_600_000_000, 1_000, 2_000, True, 1.5)
+        moved = record.with_placement(1_000, 5_000)
+
+        self.assertIsNot(moved, record)
+        self.assertEqual(moved.placement(), (1_000, 5_000))
+        self.assertEqual(record.placement(), (1_000, 2_000))
+        for slot in TaskRecord.__slots__:
+            if slot not in ("start", "end"):
+                self.assertEqual(getattr(moved, slot), getattr(record, slot), slot)
+
+
+if __name__ == "__main__":
+    unittest.main()
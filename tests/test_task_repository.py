@@ -0,0 +1,75 @@
+# Run from the root of the repository: python -m unittest discover tests
+import unittest
+from types import SimpleNamespace
+from uuid import uuid4
+
+from app.database.task_repository import TaskRepository
+from app.database.unit_of_work import UnitOfWork
+
+
+def collection(name: str):
+    # apply_pending only needs the names of the collections, nothing is read or written
+    return SimpleNamespace(name=name, full_name=f"db.{name}")
+
+def task_document(time_frame_id, title: str, rank: float) -> dict:
+    return {"_id": uuid4(), "time_frame_id": time_frame_id, "title": title, "rank": rank}
+
+
+class ApplyPendingTest(unittest.TestCase):
+    """
+        A coalesced batch runs its mutations one after the other on the same repository, with apply_pending in
+        between. After each of them the repository should hold the tasks as the unit of work will store them.
+    """
+    def setUp(self):
+        self.tasks = collection("task")
+        self.time_frame_id = uuid4()
+        self.repository = TaskRepository(self.tasks, collection("time_frame"))
+        self.first = task_document(self.time_frame_id, "first", 1024.0)
+        self.second = task_document(self.time_frame_id, "second", 2048.0)
+        self.repository.store_loaded(self.time_frame_id, [{"_id": self.time_frame_id}], [self.first, self.second])
+        self.unit = UnitOfWork(transaction=False)
+
+    def titles(self) -> list:
+        return [document["title"] for document in self.repository.task_documents[self.time_frame_id]]
+
+    def test_inserts_are_not_added_twice(self):
+        inserted = task_document(self.time_frame_id, "inserted", 1536.0)
+        self.unit.insert(self.tasks, inserted)
+        self.repository.apply_pending(self.unit)
+        self.unit.update(self.tasks, self.first["_id"], {"title": "first updated"})
+        self.repository.apply_pending(self.unit)
+        self.unit.update(self.tasks, self.first["_id"], {"rank": 512.0})
+        self.repository.apply_pending(self.unit)
+
+        self.assertEqual(self.titles(), ["first updated", "inserted", "second"])
+        self.assertEqual(self.repository.documents[self.second["_id"]][1], 3)
+
+    def test_mixed_inserts_and_deletes(self):
+        kept = task_document(self.time_frame_id, "kept", 3072.0)
+        dropped = task_document(self.time_frame_id, "dropped", 1536.0)
+        self.unit.insert(self.tasks, dropped)
+        self.repository.apply_pending(self.unit)
+        self.unit.insert(self.tasks, kept)
+        self.repository.apply_pending(self.unit)
+        # Deleting a task inserted in the same batch only drops the insert
+        self.unit.delete(self.tasks, dropped["_id"])
+        self.repository.apply_pending(self.unit)
+        self.unit.delete(self.tasks, self.first["_id"])
+        self.repository.apply_pending(self.unit)
+        self.unit.update(self.tasks, kept["_id"], {"rank": 1024.0})
+        self.repository.apply_pending(self.unit)
+
+        self.assertEqual(self.titles(), ["kept", "second"])
+        self.assertNotIn(dropped["_id"], self.repository.documents)
+        self.assertNotIn(self.first["_id"], self.repository.documents)
+
+    def test_loaded_documents_are_left_alone(self):
+        self.unit.update(self.tasks, self.first["_id"], {"title": "first updated"})
+        self.repository.apply_pending(self.unit)
+
+        self.assertEqual(self.first["title"], "first")
+        self.assertEqual(self.titles(), ["first updated", "second"])
+
+
+if __name__ == "__main__":
+    unittest.main()
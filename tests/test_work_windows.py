@@ -0,0 +1,45 @@
+# Run from the root of the repository: python -m unittest discover tests
+import unittest
+from datetime import datetime, timedelta, timezone
+from uuid import uuid4
+
+from app.models.time_frame import TimeFrame
+from app.utils.work_windows import WorkWindowIndex
+
+
+def time_frame(days: int) -> TimeFrame:
+    start = datetime(2025, 1, 6, tzinfo=timezone.utc)
+    return TimeFrame.model_validate({
+        "_id": uuid4(),
+        "user_id": uuid4(),
+        "start_date": start,
+        "end_date": start + timedelta(days=days),
+        "work_time_frame_intervals": [
+            {"start": datetime(2025, 1, 1, 8, tzinfo=timezone.utc), "end": datetime(2025, 1, 1, 12, tzinfo=timezone.utc)},
+            {"start": datetime(2025, 1, 1, 13, tzinfo=timezone.utc), "end": datetime(2025, 1, 1, 17, tzinfo=timezone.utc)},
+        ],
+        "created_at": start,
+    })
+
+
+class WorkWindowIndexTest(unittest.TestCase):
+    def test_index_from_base_time_has_the_same_free_windows(self):
+        frame = time_frame(120)
+        full = WorkWindowIndex.from_time_frame(frame)
+        for base_time in [
+            datetime(2025, 1, 1, tzinfo=timezone.utc),
+            datetime(2025, 2, 3, 10, 30, tzinfo=timezone.utc),
+            datetime(2025, 2, 8, 9, tzinfo=timezone.utc),
+            datetime(2025, 3, 4, 12, 15, tzinfo=timezone.utc),
+        ]:
+            index = WorkWindowIndex.from_time_frame(frame, base_time)
+            if base_time > frame.start_date:
+                self.assertLess(len(index), len(full))
+            self.assertEqual(
+                list(index.free_after(base_time).iterate_epoch()),
+                list(full.free_after(base_time).iterate_epoch()),
+            )
+
+
+if __name__ == "__main__":
+    unittest.main()